@@ -0,0 +1,19 @@
+"""
+Gunicorn settings for the production server, gunicorn reads this file from the working directory.
+
+    gunicorn store.wsgi:application
+    gunicorn store.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8001
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+# Recycle workers now and then, so a slow leak can not grow forever
+max_requests = 10000
+max_requests_jitter = 1000
+accesslog = '-'
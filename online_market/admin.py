@@ -1,8 +1,46 @@
 from django.contrib import admin
 
-from .models import Product, Comment, CartItem, ShopOrder
+from .models import Product, ProductVote, Comment, CartItem, ShopOrder, ShopOrderItem
+from .cart_store import cart_store
+from .moderation import moderate_comments
+
+
+@admin.register(Comment)
+class CommentAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'object_id', 'status', 'created_at']
+    list_filter = ['status']
+    ordering = ['-created_at', '-id']
+    raw_id_fields = ['user']
+    # The exact count is a full table scan on large tables
+    show_full_result_count = False
+    actions = ['approve', 'reject']
+
+    @admin.action(description="Approve selected waiting comments")
+    def approve(self, request, queryset):
+        result = moderate_comments(approve=queryset.values_list('pk', flat=True))
+        self.message_user(request, f"Approved {result['approved']} comments.")
+
+    @admin.action(description="Reject selected waiting comments")
+    def reject(self, request, queryset):
+        result = moderate_comments(reject=queryset.values_list('pk', flat=True))
+        self.message_user(request, f"Rejected {result['rejected']} comments.")
+
+
+@admin.register(CartItem)
+class CartItemAdmin(admin.ModelAdmin):
+    # CartItem has no post_delete receiver, the cached carts are invalidated here
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        cart_store.invalidate(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        cart_store.invalidate(*user_ids)
+
 
 admin.site.register(Product)
-admin.site.register(Comment)
-admin.site.register(CartItem)
+admin.site.register(ProductVote)
 admin.site.register(ShopOrder)
+admin.site.register(ShopOrderItem)
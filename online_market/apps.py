@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class OnlineMarketConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'online_market'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import async_views
+
+urlpatterns = [
+	path('products/', async_views.product_list, name='api_async_product'),
+	path('products/<int:pk>/', async_views.product_detail, name='api_async_product_detail'),
+	path('opinion/<int:pk>/', async_views.comment_list, name='api_async_comment_list'),
+	path('track/', async_views.order_list, name='api_async_orders'),
+]
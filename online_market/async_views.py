@@ -0,0 +1,105 @@
+"""
+Async variants of the read-heavy endpoints, for ASGI workers.
+
+Cached catalog payloads and cached tokens are served without leaving the event loop, so a worker can hold
+many keep-alive clients. Django 4.0 has no async ORM, whatever needs the database runs the regular view in
+a worker thread.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from rest_framework import exceptions
+
+from user_auth.authentication import CachedTokenAuthentication
+from . import views, conditional
+from .cache import catalog_cache
+from .filters import facet_filters
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+sync_product_list = sync_to_async(views.ProductView.as_view())
+sync_product_detail = sync_to_async(views.ProductDetailView.as_view())
+sync_comment_list = sync_to_async(views.CommentListView.as_view())
+sync_order_list = sync_to_async(views.TrackShopOrderView.as_view())
+
+
+async def authenticate(request, required=True):
+    """
+    Returns None for authenticated requests, and for anonymous ones unless `required`, the 401 response otherwise.
+    Invalid credentials are rejected like the regular views do, even where anonymous requests are allowed.
+    """
+    authentication = CachedTokenAuthentication()
+    try:
+        result = await authentication.aauthenticate(request)
+    except exceptions.AuthenticationFailed as e:
+        detail = e.detail
+    else:
+        if result is not None or not required:
+            return None
+        detail = exceptions.NotAuthenticated.default_detail
+
+    response = JsonResponse({"detail": str(detail)}, status=401)
+    response['WWW-Authenticate'] = authentication.authenticate_header(request)
+    return response
+
+
+async def product_list(request):
+    if request.method not in SAFE_METHODS:
+        return HttpResponseNotAllowed(SAFE_METHODS)
+
+    facets = await catalog_cache.apeek_facets(facet_filters(request.GET))
+    if facets is None:
+        return await sync_product_list(request)
+
+    counted_at, facets = facets
+    etag = quote_etag(conditional.make_etag(await catalog_cache.alist_version(), counted_at, request.get_full_path()))
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    data = await catalog_cache.apeek_list(request.build_absolute_uri())
+    if data is None:
+        return await sync_product_list(request)
+
+    response = JsonResponse({**data, 'facets': facets})
+    response['ETag'] = etag
+    return response
+
+
+async def product_detail(request, pk):
+    if request.method not in SAFE_METHODS:
+        return HttpResponseNotAllowed(SAFE_METHODS)
+
+    data = await catalog_cache.apeek_product(pk)
+    if data is None:
+        return await sync_product_detail(request, pk=pk)
+    unauthorized = await authenticate(request, required=False)
+    if unauthorized is not None:
+        return unauthorized
+
+    last_modified = parse_datetime(data['modified_at'])
+    etag = quote_etag(conditional.make_etag(pk, last_modified.timestamp()))
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if not_modified is not None:
+        return not_modified
+
+    response = JsonResponse(data)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+async def comment_list(request, pk):
+    if request.method not in SAFE_METHODS:
+        return HttpResponseNotAllowed(SAFE_METHODS)
+
+    return await authenticate(request) or await sync_comment_list(request, pk=pk)
+
+
+async def order_list(request):
+    if request.method not in SAFE_METHODS:
+        return HttpResponseNotAllowed(SAFE_METHODS)
+
+    return await authenticate(request) or await sync_order_list(request)
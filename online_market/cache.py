@@ -0,0 +1,137 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from store.db import primary_reads
+
+# Bump when the cached payloads change shape, so a deploy never serves the old format.
+SCHEMA_VERSION = 2
+
+
+class CatalogCache:
+    """
+    Read-through cache of serialized product payloads, per product and per list page.
+
+    Product entries are deleted when the product changes. List pages are keyed by a list version,
+    changing any product replaces the version, so every cached page becomes unreachable at once.
+    List facets do not depend on the page and are expensive to count, they are kept per filter for
+    `facets_timeout` seconds whatever the list version, with the time they were counted at. Cached pages
+    do not include them, so a response never shows facets older than `facets_timeout`.
+    On a miss only one client recomputes the value, the others wait for it for up to `wait` seconds.
+    """
+
+    prefix = f'catalog:{SCHEMA_VERSION}:'
+
+    def __init__(self, alias=None, timeout=None, facets_timeout=None, lock_timeout=10, wait=2, poll_interval=0.05):
+        self.alias = alias or getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+        self.timeout = timeout or getattr(settings, 'CATALOG_CACHE_TIMEOUT', 600)
+        self.facets_timeout = facets_timeout or getattr(settings, 'CATALOG_FACETS_TIMEOUT', 60)
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def product_key(self, pk):
+        return f'{self.prefix}product:{pk}'
+
+    def list_key(self, url):
+        digest = hashlib.md5(url.encode()).hexdigest()
+        return f'{self.prefix}list:{self.list_version()}:{digest}'
+
+    def facets_key(self, filters):
+        digest = hashlib.md5(filters.encode()).hexdigest()
+        return f'{self.prefix}facets:{digest}'
+
+    def list_version(self):
+        key = self.prefix + 'list_version'
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key)
+        return version
+
+    async def alist_version(self):
+        key = self.prefix + 'list_version'
+        version = await self.cache.aget(key)
+        if version is None:
+            await self.cache.aadd(key, time.time_ns(), None)
+            version = await self.cache.aget(key)
+        return version
+
+    async def apeek_list(self, url):
+        digest = hashlib.md5(url.encode()).hexdigest()
+        return await self.cache.aget(f'{self.prefix}list:{await self.alist_version()}:{digest}')
+
+    async def apeek_product(self, pk):
+        return await self.cache.aget(self.product_key(pk))
+
+    def peek_product(self, pk):
+        """
+        The cached product payload or None, never computes it.
+        """
+        return self.cache.get(self.product_key(pk))
+
+    def get_product(self, pk, compute):
+        return self.get_or_compute(self.product_key(pk), compute)
+
+    def get_list(self, url, compute):
+        return self.get_or_compute(self.list_key(url), compute)
+
+    def get_facets(self, filters, compute):
+        """
+        ``(counted_at, facets)``, counted_at is in nanoseconds.
+        """
+        return self.get_or_compute(self.facets_key(filters), lambda: (time.time_ns(), compute()), self.facets_timeout)
+
+    async def apeek_facets(self, filters):
+        return await self.cache.aget(self.facets_key(filters))
+
+    def get_or_compute(self, key, compute, timeout=None):
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        lock_key = key + ':lock'
+        if not self.cache.add(lock_key, 1, self.lock_timeout):
+            # Someone else is computing the value, wait for it before hitting the database too
+            deadline = time.monotonic() + self.wait
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                value = self.cache.get(key)
+                if value is not None:
+                    return value
+            with primary_reads():
+                return compute()
+
+        try:
+            # A lagging replica would keep its stale rows cached for the whole timeout
+            with primary_reads():
+                value = compute()
+            self.cache.set(key, value, timeout or self.timeout)
+        finally:
+            self.cache.delete(lock_key)
+
+        return value
+
+    def invalidate_products(self, *pks, lists=True):
+        """
+        Drop the given products and all list pages, now and again after the current transaction commits,
+        so a page cached from the not yet committed state does not survive.
+        Pass ``lists=False`` for changes to fields which no list page shows, the pages stay cached.
+        """
+        def invalidate():
+            self.cache.delete_many([self.product_key(pk) for pk in pks])
+            if lists:
+                self.cache.set(self.prefix + 'list_version', time.time_ns(), None)
+
+        invalidate()
+        transaction.on_commit(invalidate)
+
+
+catalog_cache = CatalogCache()
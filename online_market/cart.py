@@ -0,0 +1,67 @@
+from .cart_store import cart_store
+from .models import CartItem
+from .stock import stock_service
+
+
+def add_items_to_cart(user, items_list):
+    """
+    Add a batch of ``{"product_id", "quantity"}`` items to the user's cart.
+
+    The user's cart comes from the cart store and the stock of all referenced products is reserved in one
+    round trip to the stock service, an item is added only if its product has that much free. New lines are
+    written with a single bulk insert, more of a product already in the cart only changes the cached
+    quantity. Returns the per-item ``{"id", "success", "message"}`` list in request order.
+    """
+    pids = {item['product_id'] for item in items_list}
+    cart_items = {item.product_id: item for item in cart_store.items(user.id) if item.product_id in pids}
+
+    requests = {pid: (cart_items[pid].quantity if pid in cart_items else 0, list()) for pid in pids}
+    for item in items_list:
+        requests[item['product_id']][1].append(item['quantity'])
+    reserved = {pid: iter(added) if added is not None else None
+                for pid, added in stock_service.reserve(user.id, requests).items()}
+
+    data = list()
+    to_create = dict()
+    to_update = dict()
+    for item in items_list:
+        pid = item['product_id']
+        quantity = item['quantity']
+        cart_item = cart_items.get(pid)
+        if reserved[pid] is None:
+            data.append(
+                {"id": pid, "success": False, "message": "There is no product with the entered id!"}
+            )
+        elif cart_item is not None:
+            if not next(reserved[pid]):
+                data.append(
+                    {"id": pid, "success": False, "message": f"There is an item with product_id={pid} and "
+                                                             f"the total quantity is more than available items"
+                                                             f" in the store!"}
+                )
+            else:
+                cart_item.quantity += quantity
+                if pid not in to_create:
+                    to_update[pid] = cart_item
+                data.append(
+                    {"id": pid, "success": True, "message": f"There is an item with product_id={pid} and "
+                                                            f"the quantity is updated"}
+                )
+        elif not next(reserved[pid]):
+            data.append(
+                {"id": pid, "success": False,
+                 "message": "There are not enough number of this product in the store!"}
+            )
+        else:
+            cart_item = CartItem(user=user, product_id=pid, quantity=quantity)
+            cart_items[pid] = to_create[pid] = cart_item
+            data.append(
+                {"id": pid, "success": True, "message": "The product added to the cart, successfully"}
+            )
+
+    if to_create:
+        created = CartItem.objects.bulk_create(to_create.values())
+        cart_store.add_lines(user.id, created)
+    cart_store.set_quantities(user.id, list(to_update.values()))
+
+    return data
@@ -0,0 +1,350 @@
+"""
+Per-user carts kept in Redis hashes, with quantity changes written behind to CartItem.
+
+``cart:<user id>`` maps the id of every line of the user's cart to ``<product id>:<quantity>`` and is filled
+from the database on the first read. Quantity changes only touch the hash and are queued in
+``cart:<user id>:pending``; `CartStore.flush` writes the queued quantities of many carts with one ``UPDATE``.
+
+Adding and removing lines still writes to the database right away, so the database always knows which lines
+a cart has. Checkout flushes the cart and then only reads the database: losing the cache loses the quantity
+changes which were not flushed yet, never the consistency of an order.
+
+While redis is unreachable carts are read from and quantities written to CartItem directly. The process
+remembers the carts it changed meanwhile and drops their cached copies once redis answers again.
+"""
+import threading
+from functools import cached_property
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import CartItem
+
+# Marks a hash which holds the whole cart, a hash without it was only partially written and is reloaded
+LOADED = 'loaded'
+
+
+class LocalCartBackend:
+    """
+    The part of the redis client API used by CartStore, kept in process memory.
+    A stand-in for tests and single process development servers, entries never expire.
+    """
+
+    def __init__(self):
+        self._data = dict()
+        self._lock = threading.RLock()
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data.get(name, {}))
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        with self._lock:
+            data = self._data.setdefault(name, dict())
+            added = len(set(map(str, items)) - set(data))
+            data.update({str(k): str(v) for k, v in items.items()})
+            return added
+
+    def hsetnx(self, name, key, value):
+        with self._lock:
+            data = self._data.setdefault(name, dict())
+            if str(key) in data:
+                return 0
+            data[str(key)] = str(value)
+            return 1
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            data = self._data.get(name, {})
+            removed = sum(data.pop(str(key), None) is not None for key in keys)
+            if not data:
+                self._data.pop(name, None)
+            return removed
+
+    def sadd(self, name, *values):
+        with self._lock:
+            members = self._data.setdefault(name, set())
+            added = len(set(map(str, values)) - members)
+            members.update(map(str, values))
+            return added
+
+    def spop(self, name, count=None):
+        with self._lock:
+            members = self._data.get(name, set())
+            popped = [members.pop() for _ in range(min(1 if count is None else count, len(members)))]
+            if not members:
+                self._data.pop(name, None)
+        if count is None:
+            return popped[0] if popped else None
+        return popped
+
+    def expire(self, name, time):
+        return name in self._data
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+
+
+class LocalPipeline:
+    """
+    Queues commands and runs them under the backend lock, like MULTI/EXEC.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.commands = list()
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.backend._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self.commands]
+        self.commands = list()
+        return results
+
+
+class CartStore:
+    """
+    Reads and quantity changes of carts, served from CART_STORE_URL (a redis URL) or, without it,
+    from a LocalCartBackend.
+    """
+
+    prefix = 'cart:'
+    pending_users_key = prefix + 'pending'
+
+    def __init__(self, url=None, timeout=None, batch_size=None):
+        self.url = url or getattr(settings, 'CART_STORE_URL', None)
+        self.timeout = timeout or getattr(settings, 'CART_STORE_TIMEOUT', 7 * 24 * 3600)
+        self.batch_size = batch_size or getattr(settings, 'CART_FLUSH_BATCH_SIZE', 500)
+        # {user id: ids of lines written to the database directly} of carts changed while redis failed
+        self._stale = dict()
+        self._stale_lock = threading.Lock()
+
+    @cached_property
+    def client(self):
+        if not self.url:
+            return LocalCartBackend()
+        return redis.Redis.from_url(self.url, decode_responses=True)
+
+    def cart_key(self, user_id):
+        return f'{self.prefix}{user_id}'
+
+    def pending_key(self, user_id):
+        return f'{self.prefix}{user_id}:pending'
+
+    def items(self, user_id):
+        """
+        The lines of the user's cart as CartItem instances, by id.
+        """
+        try:
+            self._drop_stale()
+            data = self.client.hgetall(self.cart_key(user_id))
+            if LOADED not in data:
+                data = self._load(user_id)
+        except redis.RedisError:
+            return list(CartItem.objects.filter(user_id=user_id).order_by('pk'))
+
+        items = list()
+        for item_id, value in data.items():
+            if item_id == LOADED:
+                continue
+            product_id, quantity = value.split(':')
+            item = CartItem(id=int(item_id), user_id=user_id, product_id=int(product_id), quantity=int(quantity))
+            item._state.adding = False
+            items.append(item)
+        return sorted(items, key=lambda item: item.pk)
+
+    def _load(self, user_id):
+        key = self.cart_key(user_id)
+        # Queued quantities are newer than the database, and changes written while loading win over both
+        pending = self.client.hgetall(self.pending_key(user_id))
+        pipe = self.client.pipeline()
+        for item_id, product_id, quantity in CartItem.objects.filter(user_id=user_id).values_list(
+            'id', 'product_id', 'quantity'
+        ):
+            pipe.hsetnx(key, item_id, f'{product_id}:{pending.get(str(item_id), quantity)}')
+        pipe.hset(key, LOADED, 1)
+        pipe.expire(key, self.timeout)
+        pipe.hgetall(key)
+        return pipe.execute()[-1]
+
+    def add_lines(self, user_id, items):
+        """
+        Put lines which were just inserted into the cached cart.
+        """
+        if any(item.pk is None for item in items):
+            # The database did not return the new ids
+            self.invalidate(user_id)
+            return
+        key = self.cart_key(user_id)
+        try:
+            self._drop_stale()
+            pipe = self.client.pipeline()
+            pipe.hset(key, mapping={item.pk: f'{item.product_id}:{item.quantity}' for item in items})
+            pipe.expire(key, self.timeout)
+            pipe.execute()
+        except redis.RedisError:
+            self._mark_stale(user_id)
+
+    def set_quantities(self, user_id, items):
+        """
+        Change the quantity of existing lines in the cache, CartItem follows on the next flush.
+        Without redis CartItem is updated right away.
+        """
+        if not items:
+            return
+        key = self.cart_key(user_id)
+        try:
+            self._drop_stale()
+            pipe = self.client.pipeline()
+            pipe.hset(key, mapping={item.pk: f'{item.product_id}:{item.quantity}' for item in items})
+            pipe.expire(key, self.timeout)
+            pipe.hset(self.pending_key(user_id), mapping={item.pk: item.quantity for item in items})
+            pipe.sadd(self.pending_users_key, user_id)
+            pipe.execute()
+        except redis.RedisError:
+            CartItem.objects.bulk_update(items, ['quantity'])
+            # Older queued quantities of these lines must not overwrite them on a later flush
+            self._mark_stale(user_id, [item.pk for item in items])
+
+    def remove_lines(self, user_id, item_ids):
+        if not item_ids:
+            return
+        try:
+            self._drop_stale()
+            pipe = self.client.pipeline()
+            pipe.hdel(self.cart_key(user_id), *item_ids)
+            pipe.hdel(self.pending_key(user_id), *item_ids)
+            pipe.execute()
+        except redis.RedisError:
+            self._mark_stale(user_id)
+
+    def invalidate(self, *user_ids):
+        """
+        Forget the cached carts, now and again after the current transaction commits, the next read loads
+        them from the database. Queued quantities are kept.
+        """
+        if not user_ids:
+            return
+
+        def invalidate():
+            try:
+                self._drop_stale()
+                self.client.delete(*[self.cart_key(user_id) for user_id in user_ids])
+            except redis.RedisError:
+                for user_id in user_ids:
+                    self._mark_stale(user_id)
+
+        invalidate()
+        transaction.on_commit(invalidate)
+
+    def clear(self, user_id):
+        """
+        Forget the cart and its queued quantities after the current transaction commits, a rollback keeps
+        the cart lines and must keep their queued quantities too.
+        """
+        def clear():
+            try:
+                self._drop_stale()
+                self.client.delete(self.cart_key(user_id), self.pending_key(user_id))
+            except redis.RedisError:
+                # Dropped once redis answers again, the cart lines are gone from the database already
+                self._mark_stale(user_id)
+
+        transaction.on_commit(clear)
+
+    def _mark_stale(self, user_id, item_ids=()):
+        with self._stale_lock:
+            self._stale.setdefault(user_id, set()).update(item_ids)
+
+    def _drop_stale(self):
+        """
+        Drop the cached copies of the carts changed while redis failed, raises RedisError while it still does.
+        """
+        if not self._stale:
+            return
+        with self._stale_lock:
+            stale, self._stale = self._stale, dict()
+        try:
+            pipe = self.client.pipeline()
+            for user_id, item_ids in stale.items():
+                pipe.delete(self.cart_key(user_id))
+                if item_ids:
+                    pipe.hdel(self.pending_key(user_id), *item_ids)
+            pipe.execute()
+        except redis.RedisError:
+            for user_id, item_ids in stale.items():
+                self._mark_stale(user_id, item_ids)
+            raise
+
+    def flush(self, user_ids=None, batch_size=None):
+        """
+        Write the queued quantities of the given users, or of up to `batch_size` waiting users, to CartItem
+        with a single ``UPDATE``. Returns the number of written lines, 0 once no waiting user has any left.
+
+        Run it outside of transactions: the queue is emptied before the ``UPDATE``, a rollback would lose it.
+        """
+        if user_ids is not None:
+            quantities, pending = self._take_pending(user_ids)
+        else:
+            # Checkout writes the queue of its user without removing them from the waiting users
+            quantities = None
+            while not quantities:
+                user_ids = self.client.spop(self.pending_users_key, batch_size or self.batch_size)
+                if not user_ids:
+                    return 0
+                quantities, pending = self._take_pending(user_ids)
+        if not quantities:
+            return 0
+
+        try:
+            CartItem.objects.filter(pk__in=quantities).update(quantity=Case(
+                *[When(pk=item_id, then=Value(quantity)) for item_id, quantity in quantities.items()],
+                output_field=IntegerField(),
+            ))
+        except Exception:
+            # Queue them again, without overwriting quantities changed in the meantime
+            pipe = self.client.pipeline()
+            for user_id, queued in pending.items():
+                for item_id, quantity in queued.items():
+                    pipe.hsetnx(self.pending_key(user_id), item_id, quantity)
+                if queued:
+                    pipe.sadd(self.pending_users_key, user_id)
+            pipe.execute()
+            raise
+
+        return len(quantities)
+
+    def _take_pending(self, user_ids):
+        pipe = self.client.pipeline()
+        for user_id in user_ids:
+            pipe.hgetall(self.pending_key(user_id))
+            pipe.delete(self.pending_key(user_id))
+        pending = dict(zip(user_ids, pipe.execute()[::2]))
+
+        quantities = {
+            int(item_id): int(quantity) for queued in pending.values() for item_id, quantity in queued.items()
+        }
+        return quantities, pending
+
+
+cart_store = CartStore()
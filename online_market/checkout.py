@@ -0,0 +1,83 @@
+import redis
+from django.db import transaction, OperationalError
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .cache import catalog_cache
+from .cart_store import cart_store
+from .models import Product, CartItem, ShopOrder, ShopOrderItem
+from .stock import stock_service
+
+
+class CheckoutConflict(Exception):
+    """
+    Raised when the cart can not be bought as a whole, nothing is written in that case.
+    `conflicts` is a list of ``{"id", "requested", "available"}`` dicts.
+    """
+
+    def __init__(self, message, conflicts=None):
+        super().__init__(message)
+        self.message = message
+        self.conflicts = conflicts or []
+
+
+def checkout(user):
+    """
+    Turn the user's cart into an order in one transaction.
+
+    The involved product rows are locked in primary key order, so concurrent checkouts queue up
+    instead of deadlocking. Stock is decremented with a single ``UPDATE`` based on ``F()`` and the
+    order lines are bulk inserted with the price at checkout time. The cart is read from CartItem
+    after the queued quantity changes of the cart store are flushed.
+    Returns the created order, or None if the cart is empty.
+    """
+    try:
+        # Outside of the transaction, a conflict must not roll the flushed quantities back
+        cart_store.flush([user.id])
+    except redis.RedisError:
+        # The queued changes are lost with the cache, CartItem still holds a consistent cart
+        pass
+
+    try:
+        with transaction.atomic():
+            items = list(CartItem.objects.select_for_update().filter(user=user).order_by('product_id'))
+            if not items:
+                return None
+
+            quantities = dict()
+            for item in items:
+                quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+            products = {
+                p.id: p for p in Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk')
+            }
+
+            conflicts = list()
+            for pid, quantity in quantities.items():
+                available = products[pid].product_quantity if pid in products else 0
+                if available < quantity:
+                    conflicts.append({"id": pid, "requested": quantity, "available": available})
+            if conflicts:
+                raise CheckoutConflict("There are not enough number of some products in the store!", conflicts)
+
+            Product.objects.filter(pk__in=quantities).update(
+                product_quantity=F('product_quantity') - Case(
+                    *[When(pk=pid, then=Value(quantity)) for pid, quantity in quantities.items()]
+                ),
+                modified_at=timezone.now(),
+            )
+
+            order = ShopOrder.objects.create(user=user)
+            ShopOrderItem.objects.bulk_create([
+                ShopOrderItem(order=order, product_id=pid, quantity=quantity, price=products[pid].price)
+                for pid, quantity in quantities.items()
+            ])
+            CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+            cart_store.clear(user.id)
+            stock_service.consume(user.id, quantities)
+            catalog_cache.invalidate_products(*quantities)
+    except OperationalError:
+        # Lock timeouts and deadlocks detected by the database, the transaction is already rolled back.
+        raise CheckoutConflict("The store is busy, please try again.")
+
+    return order
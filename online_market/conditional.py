@@ -0,0 +1,63 @@
+"""
+Validators for conditional GET requests, they are computed without serializing the response.
+Use them with `django.views.decorators.http.condition`.
+"""
+import hashlib
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, Max
+from django.utils.dateparse import parse_datetime
+
+from .cache import catalog_cache
+from .filters import list_facets
+from .models import Product, Comment, ShopOrder
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _modified_at(request, queryset):
+    # `condition` asks for the ETag and the Last-Modified separately, only query once per request
+    if not hasattr(request, '_conditional_modified_at'):
+        request._conditional_modified_at = queryset.values_list('modified_at', flat=True).first()
+    return request._conditional_modified_at
+
+
+def product_last_modified(request, pk):
+    payload = catalog_cache.peek_product(pk)
+    if payload is not None:
+        return parse_datetime(payload['modified_at'])
+    return _modified_at(request, Product.objects.filter(pk=pk))
+
+
+def product_etag(request, pk):
+    modified_at = product_last_modified(request, pk)
+    return make_etag(pk, modified_at.timestamp()) if modified_at else None
+
+
+def product_list_etag(request):
+    # The catalog list version changes whenever any product changes, the facets are refreshed on their own
+    counted_at = list_facets(request)[0]
+    return make_etag(catalog_cache.list_version(), counted_at, request.get_full_path())
+
+
+def comment_list_etag(request, pk):
+    comments = Comment.objects.filter(content_type=ContentType.objects.get_for_model(Product), object_id=pk)
+    if not request.user.is_staff:
+        comments = comments.filter(status=Comment.VALIDATED)
+    stats = comments.aggregate(last_modified=Max('modified_at'), count=Count('id'))
+
+    return make_etag(
+        stats['last_modified'] and stats['last_modified'].timestamp(), stats['count'],
+        request.user.is_staff, request.get_full_path()
+    )
+
+
+def order_last_modified(request, pk):
+    return _modified_at(request, ShopOrder.objects.filter(pk=pk, user=request.user))
+
+
+def order_etag(request, pk):
+    modified_at = order_last_modified(request, pk)
+    return make_etag(pk, modified_at.timestamp()) if modified_at else None
@@ -0,0 +1,56 @@
+from urllib.parse import urlencode
+
+from django.db.models import Count
+import django_filters
+
+from .cache import catalog_cache
+from .models import Product
+
+
+class ProductFilter(django_filters.FilterSet):
+    score_min = django_filters.NumberFilter(field_name='score', lookup_expr='gte')
+    score_max = django_filters.NumberFilter(field_name='score', lookup_expr='lte')
+    in_stock = django_filters.BooleanFilter(method='filter_in_stock')
+
+    class Meta:
+        model = Product
+        fields = ['type', 'brand']
+
+    def filter_in_stock(self, queryset, name, value):
+        if value:
+            return queryset.filter(product_quantity__gt=0)
+        return queryset.filter(product_quantity=0)
+
+
+def facet_filters(query_params):
+    """
+    The filter parameters of a product list query string in a canonical order, the facets only depend on them.
+    """
+    return urlencode([
+        (name, value) for name in sorted(ProductFilter.base_filters) for value in query_params.getlist(name)
+    ])
+
+
+def product_facets(queryset):
+    """
+    Number of products per type and per brand, computed with a single query grouped by (type, brand).
+    """
+    facets = {'type': dict(), 'brand': dict()}
+    for row in queryset.order_by().values('type', 'brand').annotate(count=Count('id')):
+        facets['type'][row['type']] = facets['type'].get(row['type'], 0) + row['count']
+        facets['brand'][row['brand']] = facets['brand'].get(row['brand'], 0) + row['count']
+
+    return facets
+
+
+def list_facets(request):
+    """
+    ``(counted_at, facets)`` of the products matching the filters of the request, see `CatalogCache.get_facets`.
+    """
+    # The ETag and the response both need them, only look them up once per request
+    if not hasattr(request, '_list_facets'):
+        request._list_facets = catalog_cache.get_facets(
+            facet_filters(request.GET),
+            lambda: product_facets(ProductFilter(request.GET, queryset=Product.objects.all()).qs)
+        )
+    return request._list_facets
@@ -0,0 +1,168 @@
+"""
+Bulk product import from CSV or NDJSON streams.
+
+Rows are read lazily and handled in batches, so memory does not grow with the file. Each batch is validated
+and written with a single ``INSERT ... ON CONFLICT DO UPDATE`` on PostgreSQL; other databases look up the
+existing products with one query, then ``bulk_update`` and ``bulk_create``. Invalid rows are written to the
+errors file as NDJSON.
+"""
+import csv
+import json
+import time
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .cache import catalog_cache
+from .models import Product
+from .stock import stock_service
+
+FORMATS = ('csv', 'ndjson')
+UPDATE_FIELDS = ['price', 'product_quantity', 'modified_at']
+
+
+class ProductImportSerializer(serializers.Serializer):
+    # A plain serializer, a ModelSerializer would check unique_together with one query per row
+    type = serializers.CharField(max_length=50)
+    brand = serializers.CharField(max_length=20)
+    name = serializers.CharField(max_length=20)
+    price = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0, required=False, default=0)
+    product_quantity = serializers.IntegerField(min_value=0, required=False, default=0)
+
+
+def read_rows(stream, fmt):
+    """
+    Yields ``(row_number, row)`` from a text stream, rows which can not be parsed are yielded as exceptions.
+    """
+    if fmt == 'csv':
+        # Row numbers are line numbers, the header is line 1
+        for number, row in enumerate(csv.DictReader(stream), 2):
+            # DictReader puts extra fields under None and fills missing ones with None, e.g. after
+            # an unquoted comma, the values would be shifted
+            if None in row:
+                yield number, ValueError(f"{len(row) - 1 + len(row[None])} fields, the header has {len(row) - 1}")
+            elif None in row.values():
+                yield number, ValueError(f"fewer fields than the {len(row)} of the header")
+            else:
+                yield number, {key: value for key, value in row.items() if value != ''}
+    else:
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, e
+
+
+def import_products(rows, errors_file, batch_size=1000):
+    """
+    Create or update products from ``(row_number, row)`` pairs, a later row wins over an earlier one
+    with the same type, brand and name. Returns the counts and the throughput; outside of PostgreSQL
+    ``created`` also counts rows which were skipped because someone inserted them concurrently.
+    """
+    result = {'rows': 0, 'created': 0, 'updated': 0, 'errors': 0}
+    start = time.perf_counter()
+
+    batch = list()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _import_batch(batch, errors_file, result)
+            batch = list()
+    if batch:
+        _import_batch(batch, errors_file, result)
+
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    result['rows_per_second'] = round(result['rows'] / result['seconds'], 1) if result['seconds'] else None
+    return result
+
+
+def write_error(errors_file, number, errors, row):
+    errors_file.write(json.dumps({'row': number, 'errors': errors, 'data': row}, default=str) + '\n')
+
+
+def _import_batch(batch, errors_file, result):
+    result['rows'] += len(batch)
+
+    # One serializer validates the whole batch, like the child of a ListSerializer
+    serializer = ProductImportSerializer()
+    valid = dict()
+    for number, row in batch:
+        if isinstance(row, Exception) or not isinstance(row, dict):
+            write_error(errors_file, number, {'non_field_errors': [f"Invalid row: {row}"]}, None)
+            result['errors'] += 1
+            continue
+
+        try:
+            data = serializer.run_validation(row)
+        except serializers.ValidationError as e:
+            write_error(errors_file, number, e.detail, row)
+            result['errors'] += 1
+            continue
+
+        valid[(data['type'], data['brand'], data['name'])] = data
+
+    if not valid:
+        return
+
+    with transaction.atomic():
+        connection = connections[router.db_for_write(Product)]
+        upsert = _upsert_postgresql if connection.vendor == 'postgresql' else _upsert
+        created, updated = upsert(connection, valid)
+        catalog_cache.invalidate_products(*updated)
+        stock_service.forget(updated)
+
+    result['created'] += created
+    result['updated'] += len(updated)
+
+
+def _upsert_postgresql(connection, valid):
+    """
+    One ``INSERT ... ON CONFLICT DO UPDATE`` for the whole batch, Django 4.0's bulk_create can not update
+    on conflict. Returns the number of created rows and the ids of the updated ones.
+    """
+    fields = [field for field in Product._meta.concrete_fields if not field.primary_key]
+    params = list()
+    for data in valid.values():
+        product = Product(**data)
+        params.extend(field.get_db_prep_save(field.pre_save(product, True), connection) for field in fields)
+
+    quote = connection.ops.quote_name
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    sql = (
+        f"INSERT INTO {quote(Product._meta.db_table)} ({', '.join(quote(field.column) for field in fields)}) "
+        f"VALUES {', '.join([row] * len(valid))} "
+        f"ON CONFLICT (type, brand, name) DO UPDATE SET "
+        f"{', '.join(f'{quote(name)} = EXCLUDED.{quote(name)}' for name in UPDATE_FIELDS)} "
+        # xmax is 0 for freshly inserted rows
+        f"RETURNING id, xmax = 0"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        returned = cursor.fetchall()
+
+    updated = [pk for pk, inserted in returned if not inserted]
+    return len(returned) - len(updated), updated
+
+
+def _upsert(connection, valid):
+    now = timezone.now()
+    condition = Q()
+    for product_type, brand, name in valid:
+        condition |= Q(type=product_type, brand=brand, name=name)
+    existing = list(Product.objects.filter(condition).only('id', 'type', 'brand', 'name', *UPDATE_FIELDS))
+
+    for product in existing:
+        data = valid.pop((product.type, product.brand, product.name))
+        product.price = data['price']
+        product.product_quantity = data['product_quantity']
+        product.modified_at = now
+    Product.objects.bulk_update(existing, UPDATE_FIELDS)
+
+    # Rows inserted concurrently by someone else are skipped instead of failing the batch, they are still
+    # counted as created: without RETURNING rows are not told apart, the count is approximate here
+    Product.objects.bulk_create([Product(**data) for data in valid.values()], ignore_conflicts=True)
+    return len(valid), [product.pk for product in existing]
@@ -0,0 +1,69 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from user_auth.models import User
+from online_market.checkout import checkout, CheckoutConflict
+from online_market.models import Product, CartItem, ShopOrder
+
+BENCH_PREFIX = 'bench_checkout'
+
+
+class Command(BaseCommand):
+    help = "Fire parallel checkouts at a few hot products and report throughput and overselling."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--products', type=int, default=3)
+        parser.add_argument('--stock', type=int, default=100)
+        parser.add_argument('--quantity', type=int, default=1, help="Quantity of each hot product per cart")
+        parser.add_argument('--workers', type=int, default=16)
+
+    def handle(self, *args, **options):
+        self.cleanup()
+        products = [
+            Product.objects.create(type=BENCH_PREFIX, brand='bench', name=f'hot{i}',
+                                   product_quantity=options['stock'], price=10)
+            for i in range(options['products'])
+        ]
+        User.objects.bulk_create([
+            User(username=f'{BENCH_PREFIX}_{i}', email=f'{BENCH_PREFIX}_{i}@bench.local')
+            for i in range(options['users'])
+        ])
+        users = list(User.objects.filter(username__startswith=BENCH_PREFIX))
+        CartItem.objects.bulk_create([
+            CartItem(user=u, product=p, quantity=options['quantity']) for u in users for p in reversed(products)
+        ])
+
+        def run(user):
+            try:
+                result = 'ok' if checkout(user) else 'empty'
+            except CheckoutConflict:
+                result = 'conflict'
+            finally:
+                connection.close()
+            return result
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(run, users))
+        elapsed = time.perf_counter() - start
+
+        sold = {p.id: options['stock'] - p.product_quantity for p in Product.objects.filter(type=BENCH_PREFIX)}
+        orders = ShopOrder.objects.filter(user__in=users).count()
+        self.stdout.write(f"checkouts: {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:.1f}/s)")
+        self.stdout.write(f"succeeded: {results.count('ok')}, conflicts: {results.count('conflict')}, "
+                          f"orders: {orders}")
+        expected = min(options['users'], options['stock'] // options['quantity']) * options['quantity']
+        for pid, count in sold.items():
+            state = "OK" if count == expected else "MISMATCH"
+            self.stdout.write(f"product {pid}: sold {count} of {options['stock']} ({state})")
+
+        self.cleanup()
+
+    @staticmethod
+    def cleanup():
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        Product.objects.filter(type=BENCH_PREFIX).delete()
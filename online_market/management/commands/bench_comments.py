@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from user_auth.models import User
+from online_market.models import Product, Comment
+from online_market.views import CommentListView
+
+BENCH_PREFIX = 'bench_comments'
+
+
+class Command(BaseCommand):
+    help = "Measure queries and latency of the comment list of a product with many comments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=100_000)
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--page-sizes', type=int, nargs='+', default=[5, 20, 100])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        self.cleanup()
+        product = Product.objects.create(type=BENCH_PREFIX, brand='bench', name='commented')
+        User.objects.bulk_create([
+            User(username=f'{BENCH_PREFIX}_{i}', email=f'{BENCH_PREFIX}_{i}@bench.local')
+            for i in range(options['authors'])
+        ])
+        authors = list(User.objects.filter(username__startswith=BENCH_PREFIX).values_list('pk', flat=True))
+        content_type = ContentType.objects.get_for_model(Product)
+        for start in range(0, options['comments'], options['batch_size']):
+            Comment.objects.bulk_create([
+                Comment(user_id=authors[i % len(authors)], content=f'comment {i}', content_type=content_type,
+                        object_id=product.pk, status=Comment.VALIDATED if i % 4 else Comment.WAITING)
+                for i in range(start, min(start + options['batch_size'], options['comments']))
+            ])
+
+        viewer = User.objects.get(pk=authors[0])
+        factory = APIRequestFactory()
+        view = CommentListView.as_view()
+
+        self.stdout.write(f"{'page size':>10} {'queries':>8} {'best ms':>10}")
+        for page_size in options['page_sizes']:
+            timings = list()
+            for _ in range(options['repeat']):
+                request = factory.get('/', {'page_size': page_size})
+                force_authenticate(request, user=viewer)
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    view(request, pk=product.pk).render()
+                    timings.append(time.perf_counter() - start)
+            self.stdout.write(f"{page_size:>10} {len(context):>8} {min(timings) * 1000:>10.2f}")
+
+        self.cleanup()
+
+    @staticmethod
+    def cleanup():
+        for product in Product.objects.filter(type=BENCH_PREFIX):
+            product.comments.all().delete()
+            product.delete()
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
@@ -0,0 +1,68 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction, IntegrityError
+
+from user_auth.models import User
+from online_market.models import ShopOrder
+
+BENCH_PREFIX = 'bench_order_insert'
+
+
+def derived_order(user):
+    ShopOrder.objects.create(user=user)
+
+
+def random_order(user):
+    # The former scheme: a random track id, checked against the table until it is free
+    with transaction.atomic():
+        track_id = random.randrange(10**10, 10**11)
+        while ShopOrder.objects.filter(track_id=track_id).exists():
+            track_id = random.randrange(10**10, 10**11)
+        ShopOrder.objects.create(user=user, track_id=track_id)
+
+
+class Command(BaseCommand):
+    help = "Insert orders in parallel with derived and with random track ids and report the throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=16)
+
+    def handle(self, *args, **options):
+        self.cleanup()
+        User.objects.bulk_create([
+            User(username=f'{BENCH_PREFIX}_{i}', email=f'{BENCH_PREFIX}_{i}@bench.local')
+            for i in range(options['users'])
+        ])
+        users = list(User.objects.filter(username__startswith=BENCH_PREFIX))
+
+        for name, insert in (('derived', derived_order), ('random', random_order)):
+            def run(i):
+                try:
+                    insert(users[i % len(users)])
+                    return True
+                except IntegrityError:
+                    return False
+                finally:
+                    connection.close()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(run, range(options['orders'])))
+            elapsed = time.perf_counter() - start
+
+            orders = ShopOrder.objects.filter(user__in=users)
+            distinct = orders.values('track_id').distinct().count()
+            self.stdout.write(f"{name}: {len(results)} orders in {elapsed:.2f}s ({len(results) / elapsed:.1f}/s), "
+                              f"failed: {results.count(False)}, distinct track ids: {distinct} of {orders.count()}")
+            orders.delete()
+
+        self.cleanup()
+
+    @staticmethod
+    def cleanup():
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
@@ -0,0 +1,83 @@
+import base64
+import time
+from urllib import parse
+
+from django.core.management.base import BaseCommand
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory
+
+from online_market.models import Product
+from online_market.views import ProductView
+
+BENCH_TYPE = 'bench_pagination'
+
+
+class OffsetPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+
+
+class Command(BaseCommand):
+    help = "Compare offset and cursor pagination latency of the product list from the first to the deepest page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--page-size', type=int, default=5)
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000, 10_000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded rows for the next run")
+
+    def handle(self, *args, **options):
+        self.seed(options['rows'], options['batch_size'])
+        page_size = options['page_size']
+        factory = APIRequestFactory()
+        offset_view = ProductView.as_view(
+            pagination_class=OffsetPagination, queryset=Product.objects.order_by('-created_at', '-id')
+        )
+        cursor_view = ProductView.as_view()
+        created_at = Product.objects.filter(type=BENCH_TYPE).order_by('-created_at', '-id').values_list(
+            'created_at', flat=True
+        )
+
+        self.stdout.write(f"{'page':>8} {'offset ms':>12} {'cursor ms':>12}")
+        for page in options['pages']:
+            position = (page - 1) * page_size
+            if position >= options['rows']:
+                continue
+            offset_ms = self.timeit(
+                offset_view, factory.get('/', {'page': page, 'page_size': page_size}), options['repeat']
+            )
+
+            params = {'page_size': page_size}
+            if position:
+                params['cursor'] = self.encode_cursor(created_at[position - 1])
+            cursor_ms = self.timeit(cursor_view, factory.get('/', params), options['repeat'])
+            self.stdout.write(f"{page:>8} {offset_ms:>12.2f} {cursor_ms:>12.2f}")
+
+        if not options['keep']:
+            Product.objects.filter(type=BENCH_TYPE).delete()
+
+    def seed(self, rows, batch_size):
+        existing = Product.objects.filter(type=BENCH_TYPE).count()
+        for start in range(existing, rows, batch_size):
+            Product.objects.bulk_create([
+                Product(type=BENCH_TYPE, brand='bench', name=f'p{i}')
+                for i in range(start, min(start + batch_size, rows))
+            ])
+        self.stdout.write(f"seeded {rows - min(existing, rows)} rows")
+
+    @staticmethod
+    def encode_cursor(created_at):
+        # Same format as rest_framework.pagination.CursorPagination.encode_cursor
+        querystring = parse.urlencode({'p': str(created_at)}, doseq=True)
+        return base64.b64encode(querystring.encode('ascii')).decode('ascii')
+
+    @staticmethod
+    def timeit(view, request, repeat):
+        timings = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append(time.perf_counter() - start)
+        return min(timings) * 1000
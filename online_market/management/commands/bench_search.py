@@ -0,0 +1,69 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from online_market.models import Product
+from online_market.search import search_products
+
+BENCH_TYPE = 'bench_search'
+WORDS = ['galaxy', 'iphone', 'pixel', 'redmi', 'xperia', 'nova', 'mate', 'note', 'pro', 'max', 'lite', 'ultra',
+         'mini', 'plus', 'edge', 'fold', 'flip', 'neo', 'zoom', 'prime']
+BRANDS = ['samsung', 'apple', 'google', 'xiaomi', 'sony', 'huawei', 'nokia', 'oppo', 'vivo', 'realme']
+
+
+class Command(BaseCommand):
+    help = "Compare full-text product search against icontains scans (p50/p99 latency in ms)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5_000_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded rows for the next run")
+
+    def handle(self, *args, **options):
+        self.seed(options['rows'], options['batch_size'])
+        rnd = random.Random(1)
+        texts = [
+            rnd.choice([f'{rnd.choice(BRANDS)} {rnd.choice(WORDS)}', rnd.choice(WORDS)[:4], rnd.choice(WORDS)])
+            for _ in range(options['queries'])
+        ]
+        products = Product.objects.filter(type=BENCH_TYPE)
+        size = options['page_size']
+
+        def icontains(text):
+            condition = Q()
+            for term in text.split():
+                condition &= Q(name__icontains=term) | Q(brand__icontains=term)
+            return list(products.filter(condition).order_by('-id')[:size])
+
+        def full_text(text):
+            return list(search_products(products, text).order_by('-rank', '-id')[:size])
+
+        self.stdout.write(f"{'method':>10} {'p50 ms':>10} {'p99 ms':>10}")
+        for name, method in (('icontains', icontains), ('full-text', full_text)):
+            timings = list()
+            for text in texts:
+                start = time.perf_counter()
+                method(text)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(f"{name:>10} {statistics.median(timings):>10.2f} {p99:>10.2f}")
+
+        if not options['keep']:
+            Product.objects.filter(type=BENCH_TYPE).delete()
+
+    def seed(self, rows, batch_size):
+        rnd = random.Random(0)
+        existing = Product.objects.filter(type=BENCH_TYPE).count()
+        for start in range(existing, rows, batch_size):
+            Product.objects.bulk_create([
+                Product(type=BENCH_TYPE, brand=rnd.choice(BRANDS),
+                        name=f'{rnd.choice(WORDS)} {rnd.choice(WORDS)[:3]}{i}')
+                for i in range(start, min(start + batch_size, rows))
+            ])
+        self.stdout.write(f"seeded {rows - min(existing, rows)} rows")
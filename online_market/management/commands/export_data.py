@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+
+from online_market.exports import EXPORTS, FORMATS, export_lines
+
+
+def datetime_argument(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Stream all products or orders as CSV or NDJSON, to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--output-format', choices=FORMATS, default='csv')
+        parser.add_argument('--created-after', type=datetime_argument, help="ISO datetime, inclusive")
+        parser.add_argument('--created-before', type=datetime_argument, help="ISO datetime, exclusive")
+        parser.add_argument('--output', help="File to write, defaults to stdout")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['kind'], options['output_format'], options['created_after'],
+                             options['created_before'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from online_market.cart_store import cart_store
+
+
+class Command(BaseCommand):
+    help = "Write the queued cart quantity changes to the database, once or every --interval seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Seconds to wait between passes, 0 runs a single pass")
+        parser.add_argument('--batch-size', type=int, default=None, help="Carts per UPDATE")
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = 0
+            while True:
+                written = cart_store.flush(batch_size=options['batch_size'])
+                if not written:
+                    break
+                flushed += written
+
+            if options['verbosity'] > 1 or not options['interval']:
+                self.stdout.write(f"flushed {flushed} cart lines")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
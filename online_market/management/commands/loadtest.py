@@ -0,0 +1,117 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent keep-alive GET requests at a running server and report throughput and latency, "
+        "e.g. against the WSGI and the ASGI worker with the same --url path."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', required=True,
+                            help="URL to request, repeat to round-robin over several URLs")
+        parser.add_argument('--concurrency', type=int, default=100, help="Number of concurrent connections")
+        parser.add_argument('--requests', type=int, default=10_000, help="Total number of requests")
+        parser.add_argument('--token', help="Send an Authorization: Token header")
+        parser.add_argument('--timeout', type=float, default=10)
+
+    def handle(self, *args, **options):
+        targets = [urlsplit(url) for url in options['url']]
+        if len({(t.scheme, t.netloc) for t in targets}) != 1 or targets[0].scheme != 'http':
+            raise CommandError("All URLs must be plain http:// URLs on the same host.")
+
+        result = asyncio.run(self.run(targets, options))
+        timings, errors, statuses, elapsed = result
+        timings.sort()
+
+        self.stdout.write(f"requests     {len(timings) + errors}")
+        self.stdout.write(f"errors       {errors}")
+        self.stdout.write(f"statuses     {dict(sorted(statuses.items()))}")
+        self.stdout.write(f"elapsed s    {elapsed:.2f}")
+        self.stdout.write(f"requests/s   {(len(timings) + errors) / elapsed:.1f}")
+        if timings:
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(f"p50 ms       {statistics.median(timings):.2f}")
+            self.stdout.write(f"p99 ms       {p99:.2f}")
+
+    async def run(self, targets, options):
+        host = targets[0].hostname
+        port = targets[0].port or 80
+        headers = f"Host: {targets[0].netloc}\r\nConnection: keep-alive\r\n"
+        if options['token']:
+            headers += f"Authorization: Token {options['token']}\r\n"
+        requests = [
+            f"GET {t.path or '/'}{'?' + t.query if t.query else ''} HTTP/1.1\r\n{headers}\r\n".encode()
+            for t in targets
+        ]
+
+        remaining = iter(range(options['requests']))
+        timings = list()
+        statuses = dict()
+        errors = 0
+
+        async def client():
+            nonlocal errors
+            reader = writer = None
+            for i in remaining:
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(host, port)
+                    start = time.perf_counter()
+                    writer.write(requests[i % len(requests)])
+                    status, keep_alive = await asyncio.wait_for(self.read_response(reader), options['timeout'])
+                    timings.append((time.perf_counter() - start) * 1000)
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if not keep_alive:
+                        writer.close()
+                        writer = None
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    errors += 1
+                    if writer is not None:
+                        writer.close()
+                    writer = None
+            if writer is not None:
+                writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(options['concurrency'])])
+        return timings, errors, statuses, time.perf_counter() - start
+
+    @staticmethod
+    async def read_response(reader):
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        length = None
+        chunked = False
+        keep_alive = status_line.startswith(b'HTTP/1.1')
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = 'chunked' in value
+            elif name == 'connection':
+                keep_alive = value != 'close'
+
+        if chunked:
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if not size:
+                    break
+        elif length is not None:
+            await reader.readexactly(length)
+        else:
+            await reader.read()
+            keep_alive = False
+
+        return status, keep_alive
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from online_market.stock import stock_service
+
+
+class Command(BaseCommand):
+    help = "Reset the stock counters to the product quantities and drop expired reservations, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Seconds to wait between passes, 0 runs a single pass")
+
+    def handle(self, *args, **options):
+        size = options['chunk_size']
+        while True:
+            pids = sorted(stock_service.backend.products())
+            drifted = 0
+            for start in range(0, len(pids), size):
+                for pid, (available, reserved) in stock_service.reconcile(pids[start:start + size]).items():
+                    drifted += 1
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"product {pid}: available off by {available}, reserved off by {reserved}")
+
+            self.stdout.write(f"reconciled {len(pids)} products, {drifted} had drifted")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from online_market.cache import catalog_cache
+from online_market.models import Product
+from online_market.stats import stat_expressions
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product comment counters and rating histograms from the comments and votes, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help="Seconds to wait between chunks")
+
+    def handle(self, *args, **options):
+        expressions = stat_expressions()
+        size = options['chunk_size']
+        last_pk = 0
+        recounted = 0
+
+        while True:
+            pks = list(Product.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:size])
+            if not pks:
+                break
+
+            # One UPDATE with correlated counts per chunk, each chunk is its own short transaction
+            with transaction.atomic():
+                Product.objects.filter(pk__in=pks).update(**expressions, modified_at=timezone.now())
+                catalog_cache.invalidate_products(*pks)
+            recounted += len(pks)
+            last_pk = pks[-1]
+
+            if len(pks) < size:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(f"Recounted {recounted} products")
@@ -0,0 +1,42 @@
+# Generated by Django 4.0.3 on 2026-10-18 19:47
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_score_sum(apps, schema_editor):
+    Product = apps.get_model('online_market', 'Product')
+    Product.objects.update(score_sum=models.F('score') * models.F('vote_quantity'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('online_market', '0006_product_price_shoporderitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='score_sum',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunPython(fill_score_sum, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ProductVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.DecimalField(decimal_places=2, max_digits=3, validators=[django.core.validators.MinValueValidator(-5), django.core.validators.MaxValueValidator(5)])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='online_market.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('product', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.3 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_market', '0007_productvote_product_score_sum'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='shoporder_user_created_idx'),
+        ),
+    ]
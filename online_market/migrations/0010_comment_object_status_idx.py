@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_market', '0009_shoporder_modified_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['content_type', 'object_id', 'status', '-created_at', '-id'], name='comment_object_status_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.0.3 on 2026-10-18 19:55
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The search vector is kept up to date by a trigger, so bulk_create and raw imports are covered too.
+CREATE_SEARCH_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE OR REPLACE FUNCTION online_market_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.brand, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(NEW.type, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER online_market_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, brand, type ON online_market_product
+    FOR EACH ROW EXECUTE PROCEDURE online_market_product_search_vector_update()
+    """,
+    "UPDATE online_market_product SET name = name",
+    "CREATE INDEX product_search_vector_idx ON online_market_product USING gin (search_vector)",
+    "CREATE INDEX product_name_trgm_idx ON online_market_product USING gin (name gin_trgm_ops)",
+    "CREATE INDEX product_brand_trgm_idx ON online_market_product USING gin (brand gin_trgm_ops)",
+]
+
+DROP_SEARCH_SQL = [
+    "DROP INDEX IF EXISTS product_brand_trgm_idx",
+    "DROP INDEX IF EXISTS product_name_trgm_idx",
+    "DROP INDEX IF EXISTS product_search_vector_idx",
+    "DROP TRIGGER IF EXISTS online_market_product_search_vector_trigger ON online_market_product",
+    "DROP FUNCTION IF EXISTS online_market_product_search_vector_update()",
+]
+
+
+def create_search(apps, schema_editor):
+    # Full-text search is PostgreSQL only, other databases fall back to icontains (see online_market.search)
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in CREATE_SEARCH_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_search(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in DROP_SEARCH_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_market', '0010_comment_object_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search, drop_search),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 4.0.3 on 2026-10-18 20:07
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+# Frozen copies of the values in online_market.stats, the migration must not change when they do
+COMMENT_COUNTERS = {
+    'v': 'validated_comments',
+    'w': 'pending_comments',
+}
+RATING_BOUNDS = (-3, -1, 1, 3)
+RATING_FIELDS = ('rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+
+def _count(queryset, group_by):
+    return Coalesce(
+        Subquery(queryset.order_by().values(group_by).annotate(count=Count('pk')).values('count')[:1]),
+        Value(0),
+    )
+
+
+def fill_product_stats(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='online_market', model='product').first()
+    if content_type is None:
+        # Content types are created after the first migrate, there can not be any comments yet
+        return
+
+    Product = apps.get_model('online_market', 'Product')
+    Comment = apps.get_model('online_market', 'Comment')
+    ProductVote = apps.get_model('online_market', 'ProductVote')
+
+    comments = Comment.objects.filter(content_type=content_type, object_id=OuterRef('pk'))
+    expressions = {
+        field: _count(comments.filter(status=status), 'object_id') for status, field in COMMENT_COUNTERS.items()
+    }
+
+    votes = ProductVote.objects.filter(product=OuterRef('pk'))
+    for i, field in enumerate(RATING_FIELDS):
+        bucket = votes
+        if i > 0:
+            bucket = bucket.filter(score__gte=RATING_BOUNDS[i - 1])
+        if i < len(RATING_BOUNDS):
+            bucket = bucket.filter(score__lt=RATING_BOUNDS[i])
+        expressions[field] = _count(bucket, 'product_id')
+
+    Product.objects.update(**expressions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('online_market', '0012_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='pending_comments',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='validated_comments',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_product_stats, migrations.RunPython.noop),
+    ]
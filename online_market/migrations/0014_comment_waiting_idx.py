@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_market', '0013_product_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('status', 'w')), fields=['created_at', 'id'], name='comment_waiting_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.0.3 on 2026-10-18 20:28
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+# A copy of online_market.track_ids as of this migration, later changes to it must not change the ids given here
+OFFSET = 10 ** 11
+DOMAIN = 9 * 10 ** 11
+HALF_BITS = 20
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+def _permute(value, key):
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for number in range(ROUNDS):
+        digest = hashlib.blake2b(right.to_bytes(3, 'big'), key=key, person=bytes([number]), digest_size=4).digest()
+        left, right = right, left ^ (int.from_bytes(digest, 'big') & HALF_MASK)
+    return (left << HALF_BITS) | right
+
+
+def track_id_for(number):
+    key = settings.TRACK_ID_KEY.encode()
+    value = _permute(number, key)
+    while value >= DOMAIN:
+        value = _permute(value, key)
+    return value + OFFSET
+
+
+def renumber_duplicate_track_ids(apps, schema_editor):
+    # The random track ids could collide, every order but the first of a collision gets a derived one
+    ShopOrder = apps.get_model('online_market', 'ShopOrder')
+    duplicates = (
+        ShopOrder.objects.values('track_id').annotate(count=Count('id')).filter(count__gt=1)
+        .values_list('track_id', flat=True)
+    )
+    for track_id in list(duplicates):
+        for pk in ShopOrder.objects.filter(track_id=track_id).order_by('pk').values_list('pk', flat=True)[1:]:
+            ShopOrder.objects.filter(pk=pk).update(track_id=track_id_for(pk))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_market', '0014_comment_waiting_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_track_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='shoporder',
+            name='track_id',
+            field=models.BigIntegerField(editable=False, null=True, unique=True),
+        ),
+    ]
@@ -1,10 +1,11 @@
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 
-import random
+from .track_ids import track_id_for
 
 
 class Comment(models.Model):
@@ -25,9 +26,34 @@ class Comment(models.Model):
     modified_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=1, choices=COMMENT_STATUS, default=WAITING)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'status', '-created_at', '-id'],
+                         name='comment_object_status_idx'),
+            # The moderation queue, oldest first, only waiting comments are indexed
+            models.Index(fields=['created_at', 'id'], condition=models.Q(status='w'), name='comment_waiting_idx'),
+        ]
+
     def __str__(self):
         return self.content
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The product comment counters need the stored status when it changes, see online_market.signals
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The post_save receiver updates the product counters in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_status = self.status
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
 
 class Product(models.Model):
     type = models.CharField(max_length=50)
@@ -36,17 +62,63 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     modified_at = models.DateTimeField(auto_now=True)
     comments = GenericRelation(Comment, related_query_name='comments')
+    # score is maintained from score_sum / vote_quantity whenever a ProductVote changes, never set it directly.
     score = models.DecimalField(default=0, decimal_places=2, max_digits=3,
                                 validators=[MinValueValidator(-5), MaxValueValidator(5)])
+    score_sum = models.DecimalField(default=0, decimal_places=2, max_digits=14)
     vote_quantity = models.IntegerField(default=0)
     product_quantity = models.PositiveIntegerField(default=0)
+    # Maintained when comments and votes change, see online_market.stats
+    validated_comments = models.IntegerField(default=0)
+    pending_comments = models.IntegerField(default=0)
+    # Number of votes per score range: [-5, -3), [-3, -1), [-1, 1), [1, 3) and [3, 5]
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+    price = models.DecimalField(default=0, decimal_places=2, max_digits=12, validators=[MinValueValidator(0)])
+    # Maintained by a database trigger from name, brand and type, see migration 0011
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         unique_together = ['type', 'brand', 'name']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            # Storefront filters, each followed by the list ordering
+            models.Index(fields=['type', '-created_at', '-id'], name='product_type_created_idx'),
+            models.Index(fields=['brand', '-created_at', '-id'], name='product_brand_created_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(product_quantity__gt=0),
+                         name='product_in_stock_idx'),
+            models.Index(fields=['score'], name='product_score_idx'),
+        ]
 
     def __str__(self):
         return f"Type: {self.type}, Brand: {self.brand}, Name: {self.name}"
 
+    @property
+    def rating_histogram(self):
+        return [self.rating_1, self.rating_2, self.rating_3, self.rating_4, self.rating_5]
+
+
+class ProductVote(models.Model):
+    """
+    The score a user gave to a product, each user has one vote per product and can change it.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='votes', on_delete=models.CASCADE)
+    score = models.DecimalField(decimal_places=2, max_digits=3,
+                                validators=[MinValueValidator(-5), MaxValueValidator(5)])
+    created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['product', 'user']
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.product_id}: {self.score}"
+
 
 class CartItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -70,13 +142,38 @@ class ShopOrder(models.Model):
     ]
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    track_id = models.BigIntegerField()
+    # Derived from the primary key right after the insert, see online_market.track_ids
+    track_id = models.BigIntegerField(unique=True, null=True, editable=False)
     status = models.CharField(max_length=1, choices=ORDER_STATUS, default=REGISTERED)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    modified_at = models.DateTimeField(auto_now=True)
 
-    @staticmethod
-    def generate_track_id():
-        return random.randrange(10**10, 10**11)
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='shoporder_user_created_idx'),
+        ]
 
     def __str__(self):
         return str(self.track_id)
+
+    def save(self, *args, **kwargs):
+        # The track id is set in the same transaction as the row, without a savepoint of its own
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if self.track_id is None:
+                self.track_id = track_id_for(self.pk)
+                type(self).objects.filter(pk=self.pk).update(track_id=self.track_id)
+
+
+class ShopOrderItem(models.Model):
+    """
+    A product bought in an order, with the price and quantity at checkout time.
+    """
+
+    order = models.ForeignKey(ShopOrder, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='order_items', null=True, on_delete=models.SET_NULL)
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(decimal_places=2, max_digits=12)
+
+    def __str__(self):
+        return f"{self.order}: {self.product_id} x {self.quantity}"
@@ -0,0 +1,48 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, Comment
+from .stats import comment_status_deltas, update_comment_counters
+
+CHUNK_SIZE = 1000
+
+
+def moderate_comments(approve=(), reject=(), chunk_size=CHUNK_SIZE):
+    """
+    Validate the `approve` and reject the `reject` comment ids, only comments still waiting are changed.
+
+    Each chunk of ids is one short transaction: the waiting comments are locked, moved with a single
+    ``UPDATE ... WHERE id IN`` and the product counters follow with one more ``UPDATE``.
+    Returns the number of approved and rejected comments.
+    """
+    product_type = ContentType.objects.get_for_model(Product)
+    result = dict()
+
+    for new_status, ids, name in ((Comment.VALIDATED, approve, 'approved'), (Comment.REJECTED, reject, 'rejected')):
+        ids = sorted(set(ids))
+        result[name] = 0
+        for start in range(0, len(ids), chunk_size):
+            with transaction.atomic():
+                waiting = list(
+                    Comment.objects.select_for_update()
+                    .filter(pk__in=ids[start:start + chunk_size], status=Comment.WAITING)
+                    .order_by('pk').values_list('pk', 'content_type_id', 'object_id')
+                )
+                if not waiting:
+                    continue
+
+                Comment.objects.filter(pk__in=[pk for pk, _, _ in waiting]).update(
+                    status=new_status, modified_at=timezone.now()
+                )
+
+                moved = dict()
+                for _, content_type_id, object_id in waiting:
+                    if content_type_id == product_type.id:
+                        moved[object_id] = moved.get(object_id, 0) + 1
+                update_comment_counters({
+                    pid: comment_status_deltas(Comment.WAITING, new_status, count) for pid, count in moved.items()
+                })
+            result[name] += len(waiting)
+
+    return result
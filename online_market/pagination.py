@@ -0,0 +1,75 @@
+from operator import attrgetter
+
+from rest_framework import pagination
+
+
+class CreatedAtCursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination over the indexed `created_at` column, newest first.
+    No COUNT(*) and no OFFSET scan, so deep pages cost the same as the first one.
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class IdCursorPagination(CreatedAtCursorPagination):
+    """
+    Keyset pagination for models without a `created_at` column.
+    """
+
+    ordering = ('-id',)
+
+
+class RankCursorPagination(CreatedAtCursorPagination):
+    """
+    Keyset pagination over search results, best match first.
+    """
+
+    ordering = ('-rank', '-id')
+
+
+class OldestFirstCursorPagination(CreatedAtCursorPagination):
+    """
+    Keyset pagination over `created_at`, oldest first, for work queues.
+    """
+
+    ordering = ('created_at', 'id')
+
+
+class KeysetList:
+    """
+    Objects already in memory, which the cursor paginations page through like a queryset.
+    Only ordering and ``__lt``/``__gt`` filters on attributes are supported, as used by CursorPagination.
+    """
+
+    def __init__(self, items):
+        self.items = list(items)
+
+    def order_by(self, *fields):
+        items = self.items
+        for field in reversed(fields):
+            items = sorted(items, key=attrgetter(field.lstrip('-')), reverse=field.startswith('-'))
+        return KeysetList(items)
+
+    def filter(self, **lookups):
+        items = self.items
+        for lookup, position in lookups.items():
+            name, operator = lookup.rsplit('__', 1)
+            get = attrgetter(name)
+            # Cursor positions are strings, compare them as the attribute type
+            if operator == 'lt':
+                items = [item for item in items if get(item) < type(get(item))(position)]
+            else:
+                items = [item for item in items if get(item) > type(get(item))(position)]
+        return KeysetList(items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,40 @@
+import re
+from decimal import Decimal
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connection
+from django.db.models import DecimalField, F, Q, Value
+from django.db.models.functions import Cast
+
+RANK_PLACES = 6
+RANK_FIELD = DecimalField(max_digits=RANK_PLACES + 4, decimal_places=RANK_PLACES)
+
+
+def search_products(queryset, text):
+    """
+    Filter products matching `text` and annotate them with a `rank`.
+
+    On PostgreSQL every word matches as a prefix against the trigger maintained `search_vector`
+    (GIN index), and names or brands within trigram distance catch typos (pg_trgm GIN indexes).
+    Other databases fall back to icontains, with the same rank for every result.
+
+    The rank is a ``numeric`` rounded to RANK_PLACES: the cursor pagination compares its textual position with
+    the rank recomputed by the next query, a ``real`` would not survive that round trip exactly.
+    """
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return queryset.none().annotate(rank=Value(Decimal(0), output_field=RANK_FIELD))
+
+    if connection.vendor != 'postgresql':
+        condition = Q()
+        for term in terms:
+            condition &= Q(name__icontains=term) | Q(brand__icontains=term) | Q(type__icontains=term)
+        return queryset.filter(condition).annotate(rank=Value(Decimal(1), output_field=RANK_FIELD))
+
+    text = ' '.join(terms)
+    query = SearchQuery(' & '.join(f'{term}:*' for term in terms), config='simple', search_type='raw')
+    return queryset.filter(
+        Q(search_vector=query) | Q(name__trigram_similar=text) | Q(brand__trigram_similar=text)
+    ).annotate(
+        rank=Cast(SearchRank(F('search_vector'), query) + TrigramSimilarity('name', text), RANK_FIELD)
+    )
@@ -1,9 +1,17 @@
 from rest_framework import serializers
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
 from user_auth.serializers import UserSerializer
-from .models import Product, Comment, CartItem, ShopOrder
+from .cache import catalog_cache
+from .cart_store import cart_store
+from .models import Product, ProductVote, Comment, CartItem, ShopOrder, ShopOrderItem
+from .stats import RATING_FIELDS, rating_field
+from .stock import stock_service
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -38,6 +46,35 @@ class CommentCreateSerializer(serializers.ModelSerializer):
         return product.comments.create(content=validated_data['content'], user=user)
 
 
+class ModerationCommentSerializer(serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ["id", "user", "object_id", "content", "created_at"]
+
+
+class ModerationSerializer(serializers.Serializer):
+    approve = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False,
+                                    default=list, max_length=10000)
+    reject = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False,
+                                   default=list, max_length=10000)
+
+    def validate(self, data):
+        if not data['approve'] and not data['reject']:
+            raise serializers.ValidationError("One of the 'approve' or 'reject' fields must be prepared")
+        if set(data['approve']) & set(data['reject']):
+            raise serializers.ValidationError("A comment can not be approved and rejected together!")
+
+        return data
+
+
+class ExportSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
@@ -45,9 +82,12 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
+    rating_histogram = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+
     class Meta:
         model = Product
-        exclude = ['id', 'vote_quantity', 'product_quantity']
+        exclude = ['id', 'score_sum', 'vote_quantity', 'product_quantity', 'search_vector', 'pending_comments',
+                   'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
         read_only = ['created_at', 'modified_at']
 
 
@@ -60,12 +100,36 @@ class ProductScoreSerializer(serializers.ModelSerializer):
         fields = ['score']
 
     def update(self, instance, validated_data):
-        instance.vote_quantity += 1
-        instance.score = (
-                ((instance.score * (instance.vote_quantity - 1)) + validated_data.get('score')) / instance.vote_quantity
-        )
-        instance.save()
-
+        """
+        Record the user's vote and fold it into the product aggregates with one ``UPDATE``,
+        so concurrent votes never overwrite each other.
+        """
+        user = self.context['request'].user
+        score = validated_data.get('score')
+
+        with transaction.atomic():
+            vote, created = ProductVote.objects.select_for_update().get_or_create(
+                product=instance, user=user, defaults={'score': score}
+            )
+            ratings = {rating_field(score): 1}
+            if created:
+                delta, votes_delta = score, 1
+            else:
+                delta, votes_delta = score - vote.score, 0
+                ratings[rating_field(vote.score)] = ratings.get(rating_field(vote.score), 0) - 1
+                vote.score = score
+                vote.save(update_fields=['score', 'modified_at'])
+
+            Product.objects.filter(pk=instance.pk).update(
+                score_sum=F('score_sum') + delta,
+                vote_quantity=F('vote_quantity') + votes_delta,
+                score=Cast(F('score_sum') + delta, FloatField()) / (F('vote_quantity') + votes_delta),
+                modified_at=timezone.now(),
+                **{field: F(field) + change for field, change in ratings.items() if change},
+            )
+            catalog_cache.invalidate_products(instance.pk)
+
+        instance.refresh_from_db(fields=['score', 'score_sum', 'vote_quantity', *RATING_FIELDS])
         return instance
 
 
@@ -81,12 +145,11 @@ class CartItemCreateSerializer(serializers.ModelSerializer):
         if self.context:
             if self.context['request'].method == 'POST':    # for AddCartItemSerializer's nested serializer!
                 return data
-        try:
-            p = Product.objects.get(pk=data['product_id'])
-        except Product.DoesNotExist:
+        sellable = stock_service.sellable([data['product_id']])
+        if data['product_id'] not in sellable:
             raise serializers.ValidationError("There is no product with the entered id")
 
-        if p.product_quantity < data['quantity']:
+        if sellable[data['product_id']] < data['quantity']:
             raise serializers.ValidationError("There are not enough number of this product in the store!")
 
         return data
@@ -114,12 +177,19 @@ class CartItemEditSerializer(serializers.ModelSerializer):
         fields = ['product_id', 'quantity']
 
     def validate(self, data):
-        p = Product.objects.get(pk=self.instance.product_id)
-        if p.product_quantity < data['quantity']:
+        # Reserves the new quantity right away, checking and holding the stock is one atomic step
+        added = stock_service.reserve(self.instance.user_id, {self.instance.product_id: (0, [data['quantity']])})
+        if not (added[self.instance.product_id] or [False])[0]:
             raise serializers.ValidationError("There are not enough number of this product in the store!")
 
         return data
 
+    def update(self, instance, validated_data):
+        # Only the cached cart changes, CartItem follows with the next flush of the cart store
+        instance.quantity = validated_data['quantity']
+        cart_store.set_quantities(instance.user_id, [instance])
+        return instance
+
 
 class AddCartItemSerializer(serializers.Serializer):
     items_list = serializers.ListField(child=CartItemCreateSerializer(), required=True, allow_empty=False)
@@ -143,10 +213,9 @@ class RemoveCartItemSerializer(serializers.Serializer):
             if data['delete_all']:
                 raise serializers.ValidationError("Don't use 'items_list' and 'delete_all' options together!")
 
+        cart_ids = {item.pk for item in cart_store.items(user.id)}
         for item_id in data['items_list']:
-            try:
-                CartItem.objects.get(pk=item_id, user=user)
-            except CartItem.DoesNotExist:
+            if item_id not in cart_ids:
                 raise serializers.ValidationError(f'There is no cart item with id={item_id}!')
 
         return data
@@ -157,11 +226,28 @@ class ShopOrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ShopOrder
-        exclude = ['user', 'status']
+        exclude = ['user', 'status', 'modified_at']
+
+
+class ShopOrderStatusSerializer(serializers.ModelSerializer):
+    # Public, so only what the track id holder needs to know
+    status = serializers.CharField(source='get_status_display', read_only=True)
+    created_at = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S', read_only=True)
+
+    class Meta:
+        model = ShopOrder
+        fields = ['track_id', 'status', 'created_at']
+
+
+class ShopOrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShopOrderItem
+        fields = ['product_id', 'quantity', 'price']
 
 
 class ShopOrderDetailSerializer(ShopOrderSerializer):
     status = serializers.CharField(source='get_status_display', read_only=True)
+    items = ShopOrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = ShopOrder
@@ -0,0 +1,66 @@
+from django.contrib.contenttypes.models import ContentType
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .cache import catalog_cache
+from .cart_store import cart_store
+from .models import Product, Comment, CartItem
+from .stats import comment_status_deltas, update_comment_counters
+from .stock import stock_service
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    catalog_cache.invalidate_products(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def reload_product_stock(sender, instance, created, **kwargs):
+    # A new product can not have reservations, drop any left over from a deleted one with the same id
+    stock_service.forget([instance.pk], reservations=created)
+
+
+@receiver(post_delete, sender=Product)
+def drop_product_stock(sender, instance, **kwargs):
+    stock_service.forget([instance.pk], reservations=True)
+
+
+def _is_product_comment(comment):
+    return comment.content_type_id == ContentType.objects.get_for_model(Product).id
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if not _is_product_comment(instance):
+        return
+    old_status = None if created else getattr(instance, '_loaded_status', instance.status)
+    update_comment_counters({instance.object_id: comment_status_deltas(old_status, instance.status)})
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    if not _is_product_comment(instance):
+        return
+    status = getattr(instance, '_loaded_status', instance.status)
+    update_comment_counters({instance.object_id: comment_status_deltas(status, None)})
+
+
+@receiver(post_save, sender=CartItem)
+def invalidate_cart(sender, instance, **kwargs):
+    # Lines saved outside of the cart store, e.g. in the admin. No post_delete receiver, it would turn
+    # the bulk deletes of checkout into a SELECT and one signal per line; the admin and the cascades
+    # below invalidate the carts themselves.
+    cart_store.invalidate(instance.user_id)
+
+
+@receiver(pre_delete, sender=Product)
+def invalidate_product_carts(sender, instance, **kwargs):
+    # The cart lines of the product are deleted by the cascade
+    cart_store.invalidate(*CartItem.objects.filter(product=instance).values_list('user_id', flat=True).distinct())
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def clear_user_cart(sender, instance, **kwargs):
+    cart_store.clear(instance.pk)
@@ -0,0 +1,99 @@
+"""
+Denormalized product statistics: comment counters and the rating histogram.
+
+They are kept up to date with relative ``F()`` updates in the transaction which changes the comments or
+votes, `recount_product_stats` rebuilds them from scratch.
+"""
+from bisect import bisect_right
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Case, Count, DateTimeField, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import catalog_cache
+from .models import Product, ProductVote, Comment
+
+COMMENT_COUNTERS = {
+    Comment.VALIDATED: 'validated_comments',
+    Comment.WAITING: 'pending_comments',
+}
+
+# Upper bounds (exclusive) of the first four rating buckets, the last one takes everything from 3 up
+RATING_BOUNDS = (-3, -1, 1, 3)
+RATING_FIELDS = ('rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+
+def rating_field(score):
+    return RATING_FIELDS[bisect_right(RATING_BOUNDS, score)]
+
+
+def comment_status_deltas(old_status, new_status, count=1):
+    """
+    The counter changes for `count` comments moving from `old_status` to `new_status`,
+    None stands for a comment being created or deleted.
+    """
+    deltas = dict()
+    if old_status in COMMENT_COUNTERS:
+        deltas[COMMENT_COUNTERS[old_status]] = -count
+    if new_status in COMMENT_COUNTERS:
+        field = COMMENT_COUNTERS[new_status]
+        deltas[field] = deltas.get(field, 0) + count
+    return {field: delta for field, delta in deltas.items() if delta}
+
+
+def update_comment_counters(deltas):
+    """
+    Apply ``{product_id: {counter: delta}}`` to many products with a single ``UPDATE``.
+    """
+    deltas = {pid: changes for pid, changes in deltas.items() if changes}
+    if not deltas:
+        return
+
+    fields = dict()
+    for field in COMMENT_COUNTERS.values():
+        whens = [When(pk=pid, then=Value(changes[field])) for pid, changes in deltas.items() if changes.get(field)]
+        if whens:
+            fields[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+
+    # Only the validated count is public, the product detail and its validators stay valid otherwise
+    public = [pid for pid, changes in deltas.items() if changes.get(COMMENT_COUNTERS[Comment.VALIDATED])]
+    if public:
+        fields['modified_at'] = Case(
+            When(pk__in=public, then=Value(timezone.now())), default=F('modified_at'), output_field=DateTimeField()
+        )
+
+    Product.objects.filter(pk__in=deltas).update(**fields)
+    if public:
+        # The counters are only part of the product detail, the list pages stay valid
+        catalog_cache.invalidate_products(*public, lists=False)
+
+
+def _count(queryset, group_by):
+    # A correlated COUNT(*) subquery, grouped by the column it is correlated on
+    return Coalesce(
+        Subquery(queryset.order_by().values(group_by).annotate(count=Count('pk')).values('count')[:1]),
+        Value(0),
+    )
+
+
+def stat_expressions():
+    """
+    Expressions computing every statistic of the product being updated, for ``Product.objects.update()``.
+    """
+    content_type = ContentType.objects.get_for_model(Product)
+    comments = Comment.objects.filter(content_type=content_type, object_id=OuterRef('pk'))
+    expressions = {
+        field: _count(comments.filter(status=status), 'object_id') for status, field in COMMENT_COUNTERS.items()
+    }
+
+    votes = ProductVote.objects.filter(product=OuterRef('pk'))
+    for i, field in enumerate(RATING_FIELDS):
+        bucket = votes
+        if i > 0:
+            bucket = bucket.filter(score__gte=RATING_BOUNDS[i - 1])
+        if i < len(RATING_BOUNDS):
+            bucket = bucket.filter(score__lt=RATING_BOUNDS[i])
+        expressions[field] = _count(bucket, 'product_id')
+
+    return expressions
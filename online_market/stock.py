@@ -0,0 +1,339 @@
+"""
+Stock counters for carts: how much of a product is available and how much of it carts hold.
+
+``stock:<product id>`` keeps ``available``, a copy of ``Product.product_quantity`` loaded on first use, and
+``reserved``, the sum of the reservations in ``stock:<product id>:held`` (user id to quantity). Each
+reservation expires STOCK_RESERVATION_TTL seconds after the user last changed that line of their cart, so
+abandoned carts give their stock back. Reserving is a single decrement-if-sufficient step, a Lua script on
+redis and a locked section in process.
+
+The counters only decide what carts can hold, checkout still checks and decrements ``product_quantity``
+under row locks. Drift from missed updates is repaired by `reconcile_stock`, and when redis is unreachable
+the checks fall back to reading ``product_quantity``.
+"""
+import threading
+import time
+from functools import cached_property
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from .models import Product
+
+# Drops the expired reservations of KEYS[2] (held) and KEYS[3] (expiry) from KEYS[1] (counters), ARGV[1] is now
+PURGE = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+for _, user in ipairs(expired) do
+    redis.call('HINCRBY', KEYS[1], 'reserved', -tonumber(redis.call('HGET', KEYS[2], user) or '0'))
+    redis.call('HDEL', KEYS[2], user)
+    redis.call('ZREM', KEYS[3], user)
+end
+"""
+
+# ARGV: now, user id, ttl, base, quantities. Starting from base, adds each quantity in turn if that much is
+# free and sets the user's reservation to the total, returns 1 or 0 per quantity, -1 for unknown products.
+RESERVE = PURGE + """
+local available = redis.call('HGET', KEYS[1], 'available')
+if not available then
+    return -1
+end
+local held = tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or '0')
+local free = tonumber(available) - tonumber(redis.call('HGET', KEYS[1], 'reserved') or '0') + held
+local total = tonumber(ARGV[4])
+local results = {}
+for i = 5, #ARGV do
+    local quantity = tonumber(ARGV[i])
+    if total + quantity <= free then
+        total = total + quantity
+        results[#results + 1] = 1
+    else
+        results[#results + 1] = 0
+    end
+end
+if total > 0 then
+    redis.call('HSET', KEYS[2], ARGV[2], total)
+    redis.call('ZADD', KEYS[3], tonumber(ARGV[1]) + tonumber(ARGV[3]), ARGV[2])
+else
+    redis.call('HDEL', KEYS[2], ARGV[2])
+    redis.call('ZREM', KEYS[3], ARGV[2])
+end
+redis.call('HINCRBY', KEYS[1], 'reserved', total - held)
+return results
+"""
+
+# ARGV: user id, quantity. Drops the user's reservation and takes quantity off the available stock.
+CONSUME = """
+local held = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'reserved', -held)
+if tonumber(ARGV[2]) > 0 and redis.call('HEXISTS', KEYS[1], 'available') == 1 then
+    redis.call('HINCRBY', KEYS[1], 'available', -tonumber(ARGV[2]))
+end
+return held
+"""
+
+# ARGV: now, available. Replaces both counters, returns how far they were off.
+RECONCILE = PURGE + """
+local reserved = 0
+for _, quantity in ipairs(redis.call('HVALS', KEYS[2])) do
+    reserved = reserved + tonumber(quantity)
+end
+local old = redis.call('HMGET', KEYS[1], 'available', 'reserved')
+redis.call('HSET', KEYS[1], 'available', ARGV[2], 'reserved', reserved)
+return {tonumber(old[1] or ARGV[2]) - tonumber(ARGV[2]), tonumber(old[2] or '0') - reserved}
+"""
+
+
+class RedisStockBackend:
+    prefix = 'stock:'
+    products_key = prefix + 'products'
+
+    def __init__(self, client):
+        self.client = client
+        self.reserve_script = client.register_script(RESERVE)
+        self.consume_script = client.register_script(CONSUME)
+        self.reconcile_script = client.register_script(RECONCILE)
+
+    def keys(self, pid):
+        return [f'{self.prefix}{pid}', f'{self.prefix}{pid}:held', f'{self.prefix}{pid}:expiry']
+
+    def counts(self, pids):
+        pipe = self.client.pipeline(transaction=False)
+        for pid in pids:
+            pipe.hmget(self.keys(pid)[0], 'available', 'reserved')
+        return {
+            pid: (int(available), int(reserved or 0))
+            for pid, (available, reserved) in zip(pids, pipe.execute()) if available is not None
+        }
+
+    def load(self, values):
+        pipe = self.client.pipeline(transaction=False)
+        for pid, available in values.items():
+            pipe.hsetnx(self.keys(pid)[0], 'available', available)
+        if values:
+            pipe.sadd(self.products_key, *values)
+        pipe.execute()
+
+    def reserve(self, user_id, requests, now, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        for pid, (base, quantities) in requests.items():
+            self.reserve_script(keys=self.keys(pid), args=[now, user_id, ttl, base, *quantities], client=pipe)
+        return {
+            pid: None if result == -1 else [bool(ok) for ok in result]
+            for pid, result in zip(requests, pipe.execute())
+        }
+
+    def consume(self, user_id, quantities):
+        pipe = self.client.pipeline(transaction=False)
+        for pid, quantity in quantities.items():
+            self.consume_script(keys=self.keys(pid), args=[user_id, quantity], client=pipe)
+        pipe.execute()
+
+    def reconcile(self, values, now):
+        pipe = self.client.pipeline(transaction=False)
+        for pid, available in values.items():
+            self.reconcile_script(keys=self.keys(pid), args=[now, available], client=pipe)
+        return {pid: tuple(drift) for pid, drift in zip(values, pipe.execute())}
+
+    def products(self):
+        return [int(pid) for pid in self.client.sscan_iter(self.products_key, count=1000)]
+
+    def forget(self, pids, reservations=False):
+        pipe = self.client.pipeline(transaction=False)
+        for pid in pids:
+            if reservations:
+                pipe.delete(*self.keys(pid))
+                pipe.srem(self.products_key, pid)
+            else:
+                pipe.hdel(self.keys(pid)[0], 'available')
+        pipe.execute()
+
+
+class LocalStockBackend:
+    """
+    The same counters in process memory, for tests and single process development servers.
+    """
+
+    def __init__(self):
+        self.available = dict()
+        # {product id: {user id: (quantity, expires)}}
+        self.held = dict()
+        self._lock = threading.Lock()
+
+    def _purge(self, pid, now):
+        held = self.held.get(pid, {})
+        for user_id in [user_id for user_id, (_, expires) in held.items() if expires <= now]:
+            del held[user_id]
+
+    def _reserved(self, pid):
+        return sum(quantity for quantity, _ in self.held.get(pid, {}).values())
+
+    def counts(self, pids):
+        with self._lock:
+            return {pid: (self.available[pid], self._reserved(pid)) for pid in pids if pid in self.available}
+
+    def load(self, values):
+        with self._lock:
+            for pid, available in values.items():
+                self.available.setdefault(pid, available)
+
+    def reserve(self, user_id, requests, now, ttl):
+        results = dict()
+        with self._lock:
+            for pid, (base, quantities) in requests.items():
+                if pid not in self.available:
+                    results[pid] = None
+                    continue
+                self._purge(pid, now)
+                held = self.held.setdefault(pid, dict())
+                free = self.available[pid] - self._reserved(pid) + held.get(user_id, (0, 0))[0]
+                total = base
+                results[pid] = list()
+                for quantity in quantities:
+                    ok = total + quantity <= free
+                    total += quantity if ok else 0
+                    results[pid].append(ok)
+                if total > 0:
+                    held[user_id] = (total, now + ttl)
+                else:
+                    held.pop(user_id, None)
+        return results
+
+    def consume(self, user_id, quantities):
+        with self._lock:
+            for pid, quantity in quantities.items():
+                self.held.get(pid, {}).pop(user_id, None)
+                if quantity and pid in self.available:
+                    self.available[pid] -= quantity
+
+    def reconcile(self, values, now):
+        drift = dict()
+        with self._lock:
+            for pid, available in values.items():
+                self._purge(pid, now)
+                drift[pid] = (self.available.get(pid, available) - available, 0)
+                self.available[pid] = available
+        return drift
+
+    def products(self):
+        with self._lock:
+            return list(set(self.available) | set(self.held))
+
+    def forget(self, pids, reservations=False):
+        with self._lock:
+            for pid in pids:
+                self.available.pop(pid, None)
+                if reservations:
+                    self.held.pop(pid, None)
+
+    def clear(self):
+        with self._lock:
+            self.available.clear()
+            self.held.clear()
+
+
+class StockService:
+    """
+    Stock checks and reservations for carts, on STOCK_STORE_URL (a redis URL) or, without it,
+    on a LocalStockBackend.
+    """
+
+    def __init__(self, url=None, ttl=None):
+        self.url = url or getattr(settings, 'STOCK_STORE_URL', None)
+        self.ttl = ttl or getattr(settings, 'STOCK_RESERVATION_TTL', 1800)
+
+    @cached_property
+    def backend(self):
+        if not self.url:
+            return LocalStockBackend()
+        return RedisStockBackend(redis.Redis.from_url(self.url, decode_responses=True))
+
+    def _load_missing(self, pids):
+        """
+        Load the counters which are not in the store yet, returns the ids of products which do not exist.
+        """
+        missing = set(pids) - set(self.backend.counts(pids))
+        if not missing:
+            return set()
+        values = dict(Product.objects.filter(pk__in=missing).values_list('id', 'product_quantity'))
+        self.backend.load(values)
+        return missing - set(values)
+
+    def sellable(self, pids):
+        """
+        ``{product id: quantity}`` which is neither sold nor held by a cart, unknown products are left out.
+        """
+        pids = list(set(pids))
+        try:
+            self._load_missing(pids)
+            return {pid: available - reserved for pid, (available, reserved) in self.backend.counts(pids).items()}
+        except redis.RedisError:
+            return dict(Product.objects.filter(pk__in=pids).values_list('id', 'product_quantity'))
+
+    def reserve(self, user_id, requests):
+        """
+        Reserve stock for the user's cart, `requests` maps product ids to ``(base, quantities)``: the quantity
+        already in the cart and the quantities to add in turn. Each quantity is added only if that much is free,
+        the reservation becomes the total. Returns ``{product id: [added, ...]}``, None for unknown products.
+        """
+        try:
+            unknown = self._load_missing(list(requests))
+            results = self.backend.reserve(user_id, requests, time.time(), self.ttl)
+        except redis.RedisError:
+            # Nothing is held without the store, only compare with the stock
+            stock = dict(Product.objects.filter(pk__in=requests).values_list('id', 'product_quantity'))
+            unknown = set(requests) - set(stock)
+            results = dict()
+            for pid, (base, quantities) in requests.items():
+                results[pid] = list()
+                for quantity in quantities:
+                    results[pid].append(base + quantity <= stock.get(pid, 0))
+                    base += quantity if results[pid][-1] else 0
+        return {pid: None if pid in unknown else results[pid] for pid in requests}
+
+    def release(self, user_id, pids):
+        """
+        Drop the user's reservations of the products, e.g. when the lines leave the cart.
+        """
+        try:
+            self.backend.consume(user_id, {pid: 0 for pid in pids})
+        except redis.RedisError:
+            pass
+
+    def consume(self, user_id, quantities):
+        """
+        Turn the user's reservations into sold stock, after the order committed.
+        """
+        def consume():
+            try:
+                self.backend.consume(user_id, quantities)
+            except redis.RedisError:
+                # reconcile_stock repairs the counters
+                pass
+
+        transaction.on_commit(consume)
+
+    def forget(self, pids, reservations=False):
+        """
+        Drop the available counts, which are loaded again on the next use, and with `reservations`
+        the reservations too.
+        """
+        try:
+            self.backend.forget(pids, reservations)
+        except redis.RedisError:
+            pass
+
+    def reconcile(self, pids):
+        """
+        Reset the counters of the products to ``product_quantity`` and drop expired reservations.
+        Returns ``{product id: (available drift, reserved drift)}`` of the products which were off.
+        """
+        values = dict(Product.objects.filter(pk__in=pids).values_list('id', 'product_quantity'))
+        self.forget(set(pids) - set(values), reservations=True)
+        drift = self.backend.reconcile(values, time.time())
+        return {pid: offsets for pid, offsets in drift.items() if any(offsets)}
+
+
+stock_service = StockService()
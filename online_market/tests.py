@@ -1,16 +1,40 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APIClient
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import StringIO
 import json
-
+import os
+import tempfile
+import time
+from unittest import mock, skipUnless
+import redis
+
+from store import db
+from store.testing import QueryBudgetMixin
+from user_auth.cache import token_cache
 from user_auth.models import Token, User
-from online_market.models import Product, CartItem, ShopOrder
+from online_market import exports
+from online_market.models import Product, ProductVote, Comment, CartItem, ShopOrder
+from online_market.cache import catalog_cache
+from online_market.cart_store import cart_store
+from online_market.moderation import moderate_comments
+from online_market.search import search_products
+from online_market.stock import stock_service
+from online_market.track_ids import track_id_for
 
 ONLINE_MARKET_URL = "/api/v1/online-market/"
 
 
 class ProductViewTestCase(TestCase):
 	def setUp(self):
+		cache.clear()
 		self.admin_user = User.objects.create_superuser(username='admin', password='admin1234', email='admin@test.com')
 		self.client = APIClient()
 		token = Token.objects.create(user=self.admin_user)
@@ -39,6 +63,110 @@ class ProductViewTestCase(TestCase):
 
 		self.assertEqual(resp.status_code, status.HTTP_200_OK)
 
+	def test_list_pagination(self):
+		for i in range(10):
+			Product.objects.create(type='type3', brand='brand3', name=f'name{i}')
+		self.client.credentials()
+
+		resp = self.client.get(ONLINE_MARKET_URL + "products/", {"page_size": 4})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		names = [p["name"] for p in resp.json()["results"]]
+		self.assertEqual(names, ['name9', 'name8', 'name7', 'name6'])
+		self.assertNotIn("count", resp.json())
+
+		seen = list()
+		url = ONLINE_MARKET_URL + "products/"
+		while url:
+			data = self.client.get(url).json()
+			seen.extend((p["type"], p["name"]) for p in data["results"])
+			url = data["next"]
+		self.assertEqual(len(seen), 12)
+		self.assertEqual(len(set(seen)), 12)
+
+		capped_resp = self.client.get(ONLINE_MARKET_URL + "products/", {"page_size": 1000})
+		self.assertEqual(len(capped_resp.json()["results"]), 12)
+
+	def test_filters_and_facets(self):
+		Product.objects.create(type='phone', brand='Samsung', name='Galaxy', score=4, product_quantity=3)
+		Product.objects.create(type='phone', brand='Apple', name='iPhone', score=2)
+		Product.objects.create(type='laptop', brand='Apple', name='MacBook', score=5, product_quantity=1)
+		self.client.credentials()
+		url = ONLINE_MARKET_URL + "products/"
+
+		resp = self.client.get(url, {"brand": "Apple"})
+		self.assertEqual(sorted(p["name"] for p in resp.json()["results"]), ['MacBook', 'iPhone'])
+		self.assertEqual(resp.json()["facets"], {"type": {"phone": 1, "laptop": 1}, "brand": {"Apple": 2}})
+
+		resp = self.client.get(url, {"type": "phone", "in_stock": "true"})
+		self.assertEqual([p["name"] for p in resp.json()["results"]], ['Galaxy'])
+
+		resp = self.client.get(url, {"score_min": 3, "score_max": 4.5})
+		self.assertEqual([p["name"] for p in resp.json()["results"]], ['Galaxy'])
+
+		resp = self.client.get(url)
+		self.assertEqual(resp.json()["facets"]["type"], {"type1": 1, "type2": 1, "phone": 2, "laptop": 1})
+
+	def test_cached_facets(self):
+		self.client.credentials()
+		url = ONLINE_MARKET_URL + "products/"
+		self.assertEqual(self.client.get(url).json()["facets"]["type"], {"type1": 1, "type2": 1})
+
+		Product.objects.create(type='type1', brand='brand3', name='name3')
+		with CaptureQueriesContext(connection) as queries:
+			resp = self.client.get(url, {"page_size": 5})
+		self.assertEqual(len(resp.json()["results"]), 3)
+		self.assertEqual(resp.json()["facets"]["type"], {"type1": 1, "type2": 1})
+		self.assertFalse(any('GROUP BY' in query['sql'] for query in queries))
+
+		resp = self.client.get(url, {"type": "type1"})
+		self.assertEqual(resp.json()["facets"]["brand"], {"brand1": 1, "brand3": 1})
+
+		stale_resp = self.client.get(url)
+		self.assertEqual(stale_resp.json()["facets"]["type"], {"type1": 1, "type2": 1})
+
+		# Expired, the cached page is served with the new counts and a new ETag
+		cache.delete(catalog_cache.facets_key(''))
+		resp = self.client.get(url, HTTP_IF_NONE_MATCH=stale_resp['ETag'])
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp.json()["facets"]["type"], {"type1": 2, "type2": 1})
+		self.assertEqual(len(resp.json()["results"]), 3)
+
+	def test_search(self):
+		Product.objects.create(type='phone', brand='Samsung', name='Galaxy S21')
+		Product.objects.create(type='phone', brand='Apple', name='iPhone 13')
+		self.client.credentials()
+		url = ONLINE_MARKET_URL + "products/search/"
+
+		resp = self.client.get(url, {"q": "galaxy sams"})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual([p["name"] for p in resp.json()["results"]], ['Galaxy S21'])
+
+		resp = self.client.get(url, {"q": "phone"})
+		self.assertEqual(len(resp.json()["results"]), 2)
+
+		empty_resp = self.client.get(url, {"q": "  "})
+		self.assertEqual(empty_resp.json()["results"], [])
+
+	@skipUnless(connection.vendor == 'postgresql', "ranks are only computed on PostgreSQL")
+	def test_search_pages(self):
+		for i in range(12):
+			Product.objects.create(type='phone', brand=f'Brand{i % 3}', name=f'Galaxy {"S" * (i % 4)}{i}')
+		self.client.credentials()
+		url = ONLINE_MARKET_URL + "products/search/"
+
+		seen = list()
+		resp = self.client.get(url, {"q": "galaxy", "page_size": 5}).json()
+		while True:
+			seen.extend(p["name"] for p in resp["results"])
+			if not resp["next"]:
+				break
+			resp = self.client.get(resp["next"]).json()
+
+		self.assertEqual(sorted(seen), sorted(set(seen)))
+		self.assertEqual(len(seen), Product.objects.filter(name__startswith='Galaxy').count())
+		ranks = dict(search_products(Product.objects.all(), "galaxy").values_list('name', 'rank'))
+		self.assertEqual([ranks[name] for name in seen], sorted((ranks[name] for name in seen), reverse=True))
+
 	def test_add_product(self):
 		url = ONLINE_MARKET_URL + "products/"
 
@@ -92,6 +220,198 @@ class ProductDetailViewTestCase(TestCase):
 		bad_resp = self.client.get(url + '2/')
 		self.assertEqual(bad_resp.status_code, status.HTTP_404_NOT_FOUND)
 
+	def test_conditional_get(self):
+		url = ONLINE_MARKET_URL + f'products/{self.p.id}/'
+
+		resp = self.client.get(url)
+		self.assertTrue(resp.has_header('ETag'))
+		self.assertTrue(resp.has_header('Last-Modified'))
+		not_modified_resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(not_modified_resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+		self.client.patch(ONLINE_MARKET_URL + f'score/{self.p.id}/', {"score": 4})
+		modified_resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(modified_resp.status_code, status.HTTP_200_OK)
+
+		list_url = ONLINE_MARKET_URL + 'products/'
+		list_resp = self.client.get(list_url)
+		not_modified_resp = self.client.get(list_url, HTTP_IF_NONE_MATCH=list_resp['ETag'])
+		self.assertEqual(not_modified_resp.status_code, status.HTTP_304_NOT_MODIFIED)
+		Product.objects.create(type='A2', brand='B2', name='C2')
+		modified_resp = self.client.get(list_url, HTTP_IF_NONE_MATCH=list_resp['ETag'])
+		self.assertEqual(modified_resp.status_code, status.HTTP_200_OK)
+
+	def test_detail_cache(self):
+		url = ONLINE_MARKET_URL + f'products/{self.p.id}/'
+
+		self.client.get(url)
+		with self.assertNumQueries(0):
+			cached_resp = self.client.get(url)
+		self.assertEqual(cached_resp.json()["score"], "0.00")
+
+		self.client.patch(ONLINE_MARKET_URL + f'score/{self.p.id}/', {"score": 4})
+		self.assertEqual(self.client.get(url).json()["score"], "4.00")
+
+		self.p.name = 'C2'
+		self.p.save()
+		self.assertEqual(self.client.get(url).json()["name"], "C2")
+		list_resp = self.client.get(ONLINE_MARKET_URL + 'products/')
+		self.assertEqual(list_resp.json()["results"][0]["name"], "C2")
+
+
+class AsyncViewsTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		token_cache.local.clear()
+		self.u = User.objects.create(username='user', password='user1234', email='user@test.com')
+		self.token = Token.objects.create(user=self.u)
+		self.p = Product.objects.create(type='A1', brand='B1', name='C1')
+
+	async def test_product_detail(self):
+		url = f'/api/v1/async/online-market/products/{self.p.id}/'
+
+		miss_resp = await self.async_client.get(url)
+		self.assertEqual(miss_resp.status_code, status.HTTP_200_OK)
+		hit_resp = await self.async_client.get(url)
+		self.assertEqual(hit_resp.json(), miss_resp.json())
+		self.assertEqual(hit_resp['ETag'], miss_resp['ETag'])
+		not_modified_resp = await self.async_client.get(url, IF_NONE_MATCH=hit_resp['ETag'])
+		self.assertEqual(not_modified_resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+		bad_resp = await self.async_client.get(f'/api/v1/async/online-market/products/{self.p.id + 1}/')
+		self.assertEqual(bad_resp.status_code, status.HTTP_404_NOT_FOUND)
+
+		# Cached payloads are not served to invalid credentials, like the regular view
+		for header in ("Token invalid", "Token", "Token a b"):
+			invalid_resp = await self.async_client.get(url, AUTHORIZATION=header)
+			self.assertEqual(invalid_resp.status_code, status.HTTP_401_UNAUTHORIZED)
+		valid_resp = await self.async_client.get(url, AUTHORIZATION="Token " + self.token.key)
+		self.assertEqual(valid_resp.status_code, status.HTTP_200_OK)
+
+	async def test_product_list(self):
+		url = '/api/v1/async/online-market/products/'
+
+		miss_resp = await self.async_client.get(url)
+		hit_resp = await self.async_client.get(url)
+		self.assertEqual(hit_resp.json(), miss_resp.json())
+		self.assertEqual(hit_resp.json()["results"][0]["name"], "C1")
+		self.assertEqual(hit_resp.json()["facets"], {"type": {"A1": 1}, "brand": {"B1": 1}})
+		self.assertEqual(hit_resp['ETag'], miss_resp['ETag'])
+
+	async def test_authentication(self):
+		url = '/api/v1/async/online-market/track/'
+
+		anon_resp = await self.async_client.get(url)
+		self.assertEqual(anon_resp.status_code, status.HTTP_401_UNAUTHORIZED)
+		bad_resp = await self.async_client.get(url, AUTHORIZATION="Token invalid")
+		self.assertEqual(bad_resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+		resp = await self.async_client.get(url, AUTHORIZATION="Token " + self.token.key)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		comment_resp = await self.async_client.get(f'/api/v1/async/online-market/opinion/{self.p.id}/',
+												   AUTHORIZATION="Token " + self.token.key)
+		self.assertEqual(comment_resp.status_code, status.HTTP_200_OK)
+
+
+class ProductImportTestCase(TestCase):
+	def setUp(self):
+		self.admin = User.objects.create_superuser(username='admin', password='admin1234', email='admin@test.com')
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + Token.objects.create(user=self.admin).key)
+		self.p = Product.objects.create(type='A1', brand='B1', name='C1', price=1, product_quantity=1)
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+
+	def test_import_command(self):
+		path = os.path.join(self.tmp.name, 'products.csv')
+		with open(path, 'w') as f:
+			f.write("type,brand,name,price,product_quantity\n"
+					"A1,B1,C1,10.50,7\n"
+					"A2,B2,C2,3,\n"
+					"A3,B3,a name longer than twenty,3,1\n"
+					"A2,B2,C2,4,2\n"
+					"A4,B4,C,4,10.50,1\n"
+					"A5,B5,C5\n")
+
+		out = StringIO()
+		call_command('import_products', path, '--batch-size', '2', stdout=out)
+		self.assertIn("6 rows: 1 created, 2 updated, 3 errors", out.getvalue())
+		self.assertFalse(Product.objects.filter(type__in=['A4', 'A5']).exists())
+		self.p.refresh_from_db()
+		self.assertEqual((self.p.price, self.p.product_quantity), (Decimal('10.50'), 7))
+		self.assertEqual(Product.objects.get(name='C2').price, 4)
+
+		with open(path + '.errors.ndjson') as f:
+			errors = [json.loads(line) for line in f]
+		self.assertEqual([e["row"] for e in errors], [4, 6, 7])
+		self.assertIn("name", errors[0]["errors"])
+
+	def test_import_endpoint(self):
+		url = ONLINE_MARKET_URL + 'products/import/'
+		content = b'{"type": "A2", "brand": "B2", "name": "C2", "price": "2"}\nnot json\n{"type": "A1"}\n'
+
+		with override_settings(MEDIA_ROOT=self.tmp.name):
+			resp = self.client.post(url, {"file": SimpleUploadedFile('products.ndjson', content)})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual((resp.json()["created"], resp.json()["errors"]), (1, 2))
+		self.assertTrue(resp.json()["errors_file"].endswith('.errors.ndjson'))
+		self.assertTrue(Product.objects.filter(type='A2', brand='B2', name='C2').exists())
+
+		bad_resp = self.client.post(url, {"file": SimpleUploadedFile('products.xml', content)})
+		self.assertEqual(bad_resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+		self.client.credentials()
+		anon_resp = self.client.post(url, {"file": SimpleUploadedFile('products.ndjson', content)})
+		self.assertEqual(anon_resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ExportTestCase(TestCase):
+	def setUp(self):
+		self.admin = User.objects.create_superuser(username='admin', password='admin1234', email='admin@test.com')
+		self.client = APIClient()
+		self.key = Token.objects.create(user=self.admin).key
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + self.key)
+		self.products = [Product.objects.create(type='A', brand='B', name=f'C{i}', price=i) for i in range(5)]
+		Product.objects.filter(pk=self.products[0].pk).update(created_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+
+	def test_export_endpoint(self):
+		url = ONLINE_MARKET_URL + 'export/products/'
+
+		resp = self.client.get(url)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertTrue(resp.streaming)
+		lines = b''.join(resp.streaming_content).decode().splitlines()
+		self.assertEqual(lines[0].split(',')[:4], ['id', 'type', 'brand', 'name'])
+		self.assertEqual(len(lines), 6)
+
+		resp = self.client.get(url, {"output": "ndjson", "created_after": "2021-01-01T00:00:00Z"})
+		rows = [json.loads(line) for line in b''.join(resp.streaming_content).decode().splitlines()]
+		self.assertEqual([row["name"] for row in rows], [f'C{i}' for i in range(1, 5)])
+
+		self.assertEqual(self.client.get(ONLINE_MARKET_URL + 'export/users/').status_code, status.HTTP_404_NOT_FOUND)
+		self.assertEqual(self.client.get(url, {"output": "xml"}).status_code, status.HTTP_400_BAD_REQUEST)
+		self.client.credentials()
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+	async def test_export_under_asgi(self):
+		# Django 4.0 iterates streaming responses inside the event loop under ASGI
+		resp = await self.async_client.get(ONLINE_MARKET_URL + 'export/products/', AUTHORIZATION="Token " + self.key)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp['Content-Disposition'], 'attachment; filename="products.csv"')
+		lines = b''.join(resp.streaming_content).decode().splitlines()
+		self.assertEqual(len(lines), 6)
+
+	def test_export_command(self):
+		out = StringIO()
+		call_command('export_data', 'products', '--created-before', '2021-01-01T00:00:00Z', stdout=out)
+		self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+		# The primary key walk used behind pgbouncer
+		queryset, fields = exports.export_queryset('products')
+		with mock.patch.dict(connection.settings_dict, DISABLE_SERVER_SIDE_CURSORS=True):
+			rows = list(exports.iterate(queryset, chunk_size=2))
+		self.assertEqual([row[0] for row in rows], [p.pk for p in self.products])
+
 
 class ScoreViewTestCase(TestCase):
 	def setUp(self):
@@ -100,7 +420,7 @@ class ScoreViewTestCase(TestCase):
 		self.client = APIClient()
 		self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
 
-		self.p = Product.objects.create(type='A1', brand='B1', name='C1', score=1, vote_quantity=5)
+		self.p = Product.objects.create(type='A1', brand='B1', name='C1', score=1, score_sum=5, vote_quantity=5)
 
 	def test_get_score(self):
 		url = ONLINE_MARKET_URL + 'score/'
@@ -121,6 +441,18 @@ class ScoreViewTestCase(TestCase):
 		self.assertTrue(pr.score == 1.5)
 		self.assertTrue(pr.vote_quantity == 6)
 
+		# Voting again changes the user's vote instead of adding a new one
+		auth_user_resp = self.client.patch(url + f'{self.p.id}/', {"score": -2})
+		pr = Product.objects.get(pk=self.p.id)
+		self.assertEqual(auth_user_resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(auth_user_resp.json()["score"], "0.50")
+		self.assertTrue(pr.score == 0.5)
+		self.assertTrue(pr.vote_quantity == 6)
+		self.assertEqual(ProductVote.objects.get(product=self.p, user=self.u).score, -2)
+		self.assertEqual(pr.rating_histogram, [0, 1, 0, 0, 0])
+		detail_resp = self.client.get(ONLINE_MARKET_URL + f'products/{self.p.id}/')
+		self.assertEqual(detail_resp.json()["rating_histogram"], [0, 1, 0, 0, 0])
+
 		self.client.credentials()
 		anon_user_resp = self.client.patch(url + f'{self.p.id}/', {"score": 4})
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -146,6 +478,9 @@ class CommentViewTestCase(TestCase):
 		self.assertEqual(auth_user_resp.status_code, status.HTTP_200_OK)
 		self.assertTrue(len(data) == 1)
 
+		not_modified_resp = self.client.get(url, HTTP_IF_NONE_MATCH=auth_user_resp['ETag'])
+		self.assertEqual(not_modified_resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
 		self.client.credentials()
 		anon_user_resp = self.client.get(url)
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -159,6 +494,9 @@ class CommentViewTestCase(TestCase):
 		self.assertEqual(admin_user_resp.status_code, status.HTTP_200_OK)
 		self.assertTrue(len(data) == 2)
 
+		missing_product_resp = self.client.get(ONLINE_MARKET_URL + 'opinion/1000/')
+		self.assertEqual(missing_product_resp.status_code, status.HTTP_404_NOT_FOUND)
+
 	def test_comment_create(self):
 		url = ONLINE_MARKET_URL + 'opinion/'
 
@@ -169,6 +507,55 @@ class CommentViewTestCase(TestCase):
 		anon_user_resp = self.client.post(url, {"id": self.p.id, "content": "test2"})
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
 
+	def test_comment_counters(self):
+		def counters():
+			p = Product.objects.get(pk=self.p.id)
+			return p.validated_comments, p.pending_comments
+
+		self.assertEqual(counters(), (1, 1))
+		self.client.post(ONLINE_MARKET_URL + 'opinion/', {"id": self.p.id, "content": "test3"})
+		self.assertEqual(counters(), (1, 2))
+
+		self.c.status = Comment.VALIDATED
+		self.c.save()
+		self.assertEqual(counters(), (2, 1))
+		comment = Comment.objects.get(pk=self.c.pk)
+		comment.status = Comment.REJECTED
+		comment.save()
+		self.assertEqual(counters(), (1, 1))
+		Comment.objects.get(user=self.u2).delete()
+		self.assertEqual(counters(), (0, 1))
+
+		Product.objects.filter(pk=self.p.id).update(validated_comments=100, pending_comments=100, rating_1=100)
+		call_command('recount_product_stats', stdout=StringIO())
+		self.assertEqual(counters(), (0, 1))
+		self.assertEqual(Product.objects.get(pk=self.p.id).rating_1, 0)
+
+		detail = self.client.get(ONLINE_MARKET_URL + f'products/{self.p.id}/').json()
+		self.assertEqual(detail["validated_comments"], 0)
+		self.assertNotIn("pending_comments", detail)
+
+	def test_comment_keeps_list_cache(self):
+		detail_url = ONLINE_MARKET_URL + f'products/{self.p.id}/'
+		resp = self.client.get(detail_url)
+		self.assertEqual(resp.json()["validated_comments"], 1)
+		version = catalog_cache.list_version()
+		modified_at = Product.objects.get(pk=self.p.id).modified_at
+
+		# Waiting comments are not public, the product does not change
+		self.client.post(ONLINE_MARKET_URL + 'opinion/', {"id": self.p.id, "content": "test3"})
+		self.assertEqual(Product.objects.get(pk=self.p.id).pending_comments, 2)
+		self.assertEqual(Product.objects.get(pk=self.p.id).modified_at, modified_at)
+		self.assertEqual(self.client.get(detail_url, HTTP_IF_NONE_MATCH=resp['ETag']).status_code,
+						 status.HTTP_304_NOT_MODIFIED)
+
+		self.c.status = Comment.VALIDATED
+		self.c.save()
+
+		self.assertEqual(catalog_cache.list_version(), version)
+		self.assertGreater(Product.objects.get(pk=self.p.id).modified_at, modified_at)
+		self.assertEqual(self.client.get(detail_url).json()["validated_comments"], 2)
+
 	def test_comment_edit(self):
 		url = ONLINE_MARKET_URL + 'opinion/edit/'
 
@@ -199,8 +586,61 @@ class CommentViewTestCase(TestCase):
 		self.assertEqual(auth_user_resp.status_code, status.HTTP_204_NO_CONTENT)
 
 
+class ModerationViewTestCase(TestCase):
+	def setUp(self):
+		self.admin = User.objects.create_superuser(username='admin', password='admin1234', email='admin@test.com')
+		self.u = User.objects.create(username='user', password='user1234', email='user@test.com')
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + Token.objects.create(user=self.admin).key)
+
+		self.p1 = Product.objects.create(type='A1', brand='B1', name='C1')
+		self.p2 = Product.objects.create(type='A2', brand='B2', name='C2')
+		self.waiting = [self.p1.comments.create(user=self.u, content=f'test{i}') for i in range(3)]
+		self.waiting.append(self.p2.comments.create(user=self.u, content='test3'))
+		self.validated = self.p1.comments.create(user=self.u, content='test4', status=Comment.VALIDATED)
+
+	def test_queue(self):
+		url = ONLINE_MARKET_URL + 'moderation/comments/'
+
+		resp = self.client.get(url)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual([c["id"] for c in resp.json()["results"]], [c.id for c in self.waiting])
+
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + Token.objects.create(user=self.u).key)
+		user_resp = self.client.get(url)
+		self.assertEqual(user_resp.status_code, status.HTTP_403_FORBIDDEN)
+
+	def test_batch(self):
+		url = ONLINE_MARKET_URL + 'moderation/comments/'
+		approve = [self.waiting[0].id, self.waiting[1].id, self.waiting[3].id]
+		reject = [self.waiting[2].id, self.validated.id]
+
+		resp = self.client.post(url, {"approve": approve, "reject": reject}, format='json')
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp.json(), {"approved": 3, "rejected": 1})
+		self.assertEqual(Comment.objects.get(pk=self.validated.id).status, Comment.VALIDATED)
+		self.assertFalse(Comment.objects.filter(status=Comment.WAITING).exists())
+
+		p1, p2 = Product.objects.get(pk=self.p1.id), Product.objects.get(pk=self.p2.id)
+		self.assertEqual((p1.validated_comments, p1.pending_comments), (3, 0))
+		self.assertEqual((p2.validated_comments, p2.pending_comments), (1, 0))
+
+		empty_resp = self.client.post(url, {"approve": [], "reject": []}, format='json')
+		self.assertEqual(empty_resp.status_code, status.HTTP_400_BAD_REQUEST)
+		both_resp = self.client.post(url, {"approve": [1], "reject": [1]}, format='json')
+		self.assertEqual(both_resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_chunks(self):
+		result = moderate_comments(reject=[c.id for c in self.waiting], chunk_size=2)
+		self.assertEqual(result, {"approved": 0, "rejected": 4})
+		p1 = Product.objects.get(pk=self.p1.id)
+		self.assertEqual((p1.validated_comments, p1.pending_comments), (1, 0))
+
+
 class CartItemViewTestCase(TestCase):
 	def setUp(self):
+		cart_store.client.flushdb()
+		stock_service.backend.clear()
 		self.u1 = User.objects.create(username='user1', password='user1234', email='user1@test.com')
 		token = Token.objects.create(user=self.u1)
 		self.client = APIClient()
@@ -242,6 +682,7 @@ class CartItemViewTestCase(TestCase):
 			]}
 		), content_type='application/json')
 		self.assertEqual(same_item_resp.status_code, status.HTTP_200_OK)
+		cart_store.flush()
 		self.assertTrue(CartItem.objects.get(product_id=self.p1.id).quantity == 15)
 		self.assertTrue(CartItem.objects.all().count() == 3)
 
@@ -249,6 +690,38 @@ class CartItemViewTestCase(TestCase):
 		anon_user_resp = self.client.post(url, {})
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
 
+	def test_add_cart_item_bulk(self):
+		url = ONLINE_MARKET_URL + 'cart/add/'
+		CartItem.objects.create(user=self.u1, product=self.p1, quantity=45)
+		data = {
+			"items_list": [
+				{"product_id": self.p1.id, "quantity": 10},
+				{"product_id": self.p2.id, "quantity": 30},
+				{"product_id": self.p2.id, "quantity": 30},
+				{"product_id": self.p2.id, "quantity": 5},
+				{"product_id": self.p3.id, "quantity": 60},
+				{"product_id": 1000, "quantity": 1},
+			]
+		}
+
+		resp = self.client.post(url, json.dumps(data), content_type='application/json')
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual([item["success"] for item in resp.json()], [False, True, False, True, False, False])
+		self.assertEqual(CartItem.objects.get(product=self.p1).quantity, 45)
+		self.assertEqual(CartItem.objects.get(product=self.p2).quantity, 35)
+		self.assertFalse(CartItem.objects.filter(product=self.p3).exists())
+
+		# The number of queries must not depend on the number of items
+		products = [
+			Product.objects.create(type='T', brand='B', name=f'N{i}', product_quantity=10) for i in range(20)
+		]
+		items = [{"product_id": p.id, "quantity": 1} for p in products]
+		with CaptureQueriesContext(connection) as small_ctx:
+			self.client.post(url, json.dumps({"items_list": items[:2]}), content_type='application/json')
+		with CaptureQueriesContext(connection) as large_ctx:
+			self.client.post(url, json.dumps({"items_list": items[2:]}), content_type='application/json')
+		self.assertEqual(len(small_ctx), len(large_ctx))
+
 	def test_remove_cart_item(self):
 		url = ONLINE_MARKET_URL + 'cart/remove/'
 
@@ -289,6 +762,100 @@ class CartItemViewTestCase(TestCase):
 		anon_user_resp = self.client.get(url)
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
 
+	def test_flush_skips_flushed_users(self):
+		# Checkout flushes the queue of its user, who stays among the waiting users
+		for i in range(5):
+			user = User.objects.create(username=f'buyer{i}', email=f'buyer{i}@test.com')
+			cart_store.set_quantities(user.id, [CartItem.objects.create(user=user, product=self.p1, quantity=2)])
+			cart_store.flush([user.id])
+		item = CartItem.objects.create(user=self.u1, product=self.p2, quantity=1)
+		item.quantity = 4
+		cart_store.set_quantities(self.u1.id, [item])
+
+		call_command('flush_carts', batch_size=1, stdout=StringIO())
+		self.assertEqual(CartItem.objects.get(pk=item.pk).quantity, 4)
+
+	def test_cart_write_behind(self):
+		items = [CartItem.objects.create(user=self.u1, product=p, quantity=1) for p in (self.p1, self.p2, self.p3)]
+		url = ONLINE_MARKET_URL + 'cart/'
+
+		resp = self.client.patch(url + f'{items[0].id}/', {"quantity": 7})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(CartItem.objects.get(pk=items[0].id).quantity, 1)
+
+		# Reads come from the cart store, page by page like from the database
+		with CaptureQueriesContext(connection) as ctx:
+			first = self.client.get(url, {"page_size": 2}).json()
+		self.assertEqual(len(ctx), 0)
+		self.assertEqual([item["id"] for item in first["results"]], [items[2].id, items[1].id])
+		second = self.client.get(first["next"]).json()
+		self.assertEqual([(item["id"], item["quantity"]) for item in second["results"]], [(items[0].id, 7)])
+		self.assertIsNone(second["next"])
+
+		self.assertEqual(cart_store.flush(), 1)
+		self.assertEqual(CartItem.objects.get(pk=items[0].id).quantity, 7)
+		self.assertEqual(cart_store.flush(), 0)
+
+		# A lost cache only loses the changes which were not flushed yet
+		self.client.patch(url + f'{items[1].id}/', {"quantity": 9})
+		cart_store.client.flushdb()
+		stock_service.backend.clear()
+		resp = self.client.get(url)
+		self.assertEqual(
+			{item["id"]: item["quantity"] for item in resp.json()["results"]},
+			{items[0].id: 7, items[1].id: 1, items[2].id: 1}
+		)
+
+		# A failed checkout keeps the queued changes, even those queued after its flush
+		self.client.patch(url + f'{items[2].id}/', {"quantity": 4})
+		with mock.patch.object(cart_store, 'flush'), \
+				mock.patch('online_market.checkout.stock_service.consume', side_effect=RuntimeError):
+			with self.assertRaises(RuntimeError), self.captureOnCommitCallbacks(execute=True):
+				self.client.post(ONLINE_MARKET_URL + 'shop/')
+		self.assertEqual(cart_store.client.hgetall(cart_store.pending_key(self.u1.id)), {str(items[2].id): '4'})
+
+		# Checkout flushes the queued changes first
+		with self.captureOnCommitCallbacks(execute=True):
+			resp = self.client.post(ONLINE_MARKET_URL + 'shop/')
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		order = ShopOrder.objects.get(track_id=resp.json()["track_id"])
+		self.assertEqual(
+			sorted(order.items.values_list('product_id', 'quantity')),
+			[(self.p1.id, 7), (self.p2.id, 1), (self.p3.id, 4)]
+		)
+		self.assertEqual(self.client.get(url).json()["results"], [])
+
+	def test_cart_store_unavailable(self):
+		items = [CartItem.objects.create(user=self.u1, product=p, quantity=1) for p in (self.p1, self.p2)]
+		url = ONLINE_MARKET_URL + 'cart/'
+		self.client.get(url)
+
+		down = {name: mock.Mock(side_effect=redis.ConnectionError) for name in ('hgetall', 'pipeline', 'delete')}
+		with mock.patch.multiple(cart_store.client, **down):
+			resp = self.client.patch(url + f'{items[0].id}/', {"quantity": 5})
+			self.assertEqual(resp.status_code, status.HTTP_200_OK)
+			self.assertEqual(CartItem.objects.get(pk=items[0].id).quantity, 5)
+			resp = self.client.get(url)
+			self.assertEqual(
+				{item["id"]: item["quantity"] for item in resp.json()["results"]}, {items[0].id: 5, items[1].id: 1}
+			)
+
+			resp = self.client.post(ONLINE_MARKET_URL + 'shop/')
+			self.assertEqual(resp.status_code, status.HTTP_200_OK)
+			self.assertFalse(CartItem.objects.filter(user=self.u1).exists())
+
+		# The cart cached before the outage is not served once redis is back
+		self.assertEqual(self.client.get(url).json()["results"], [])
+
+	def test_deleted_product_leaves_carts(self):
+		item = CartItem.objects.create(user=self.u1, product=self.p1, quantity=1)
+		CartItem.objects.create(user=self.u1, product=self.p2, quantity=1)
+		url = ONLINE_MARKET_URL + 'cart/'
+		self.assertEqual(len(self.client.get(url).json()["results"]), 2)
+
+		self.p2.delete()
+		self.assertEqual([line["id"] for line in self.client.get(url).json()["results"]], [item.id])
+
 	def test_update_cart_item(self):
 		item = CartItem.objects.create(product=self.p1, user=self.u1, quantity=15)
 		url = ONLINE_MARKET_URL + 'cart/'
@@ -313,8 +880,68 @@ class CartItemViewTestCase(TestCase):
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class StockServiceTestCase(TestCase):
+	def setUp(self):
+		cart_store.client.flushdb()
+		stock_service.backend.clear()
+		self.u1 = User.objects.create(username='user1', password='user1234', email='user1@test.com')
+		self.u2 = User.objects.create(username='user2', password='user1234', email='user2@test.com')
+		token = Token.objects.create(user=self.u2)
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+		self.p = Product.objects.create(type='A1', brand='B1', name='C1', product_quantity=10)
+
+	def test_reservations(self):
+		self.assertEqual(stock_service.reserve(self.u1.id, {self.p.id: (0, [4, 4, 4])}), {self.p.id: [True, True, False]})
+		self.assertEqual(stock_service.sellable([self.p.id, 1000]), {self.p.id: 2})
+		self.assertEqual(stock_service.reserve(self.u1.id, {1000: (0, [1])}), {1000: None})
+
+		# Carts of other users only get what is not held
+		resp = self.client.post(ONLINE_MARKET_URL + 'cart/add/', json.dumps(
+			{"items_list": [{"product_id": self.p.id, "quantity": 3}, {"product_id": self.p.id, "quantity": 2}]}
+		), content_type='application/json')
+		self.assertEqual([item["success"] for item in resp.json()], [False, True])
+		item = CartItem.objects.get(user=self.u2)
+		resp = self.client.patch(ONLINE_MARKET_URL + f'cart/{item.id}/', {"quantity": 3})
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+		# Abandoned reservations expire
+		with mock.patch('online_market.stock.time.time', return_value=time.time() + stock_service.ttl + 1):
+			resp = self.client.patch(ONLINE_MARKET_URL + f'cart/{item.id}/', {"quantity": 10})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+		# Removing the line gives the stock back
+		self.client.delete(ONLINE_MARKET_URL + 'cart/remove/', json.dumps({"items_list": [item.id]}),
+						   content_type='application/json')
+		self.assertEqual(stock_service.sellable([self.p.id]), {self.p.id: 10})
+
+	def test_checkout_and_reconcile(self):
+		CartItem.objects.create(user=self.u2, product=self.p, quantity=3)
+		stock_service.reserve(self.u2.id, {self.p.id: (0, [3])})
+		with self.captureOnCommitCallbacks(execute=True):
+			resp = self.client.post(ONLINE_MARKET_URL + 'shop/')
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(stock_service.sellable([self.p.id]), {self.p.id: 7})
+
+		Product.objects.filter(pk=self.p.id).update(product_quantity=5)
+		self.assertEqual(stock_service.reconcile([self.p.id]), {self.p.id: (2, 0)})
+		self.assertEqual(stock_service.sellable([self.p.id]), {self.p.id: 5})
+		self.assertEqual(stock_service.reconcile([self.p.id]), {})
+
+		out = StringIO()
+		call_command('reconcile_stock', stdout=out)
+		self.assertIn("reconciled 1 products, 0 had drifted", out.getvalue())
+
+	def test_store_unavailable(self):
+		with mock.patch.object(stock_service.backend, 'counts', side_effect=redis.ConnectionError):
+			self.assertEqual(stock_service.sellable([self.p.id]), {self.p.id: 10})
+			self.assertEqual(stock_service.reserve(self.u1.id, {self.p.id: (8, [2, 1])}), {self.p.id: [True, False]})
+
+
 class ShopViewTestCase(TestCase):
 	def setUp(self):
+		cart_store.client.flushdb()
+		stock_service.backend.clear()
 		self.u1 = User.objects.create(username='user1', password='user1234', email='user1@test.com')
 		token = Token.objects.create(user=self.u1)
 		self.client = APIClient()
@@ -323,13 +950,42 @@ class ShopViewTestCase(TestCase):
 	def test_shop(self):
 		url = ONLINE_MARKET_URL + 'shop/'
 
-		auth_user_resp = self.client.get(url)
+		auth_user_resp = self.client.post(url)
 		self.assertEqual(auth_user_resp.status_code, status.HTTP_200_OK)
 
 		self.client.credentials()
-		anon_user_resp = self.client.get(url)
+		anon_user_resp = self.client.post(url)
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
 
+	def test_checkout(self):
+		url = ONLINE_MARKET_URL + 'shop/'
+		p1 = Product.objects.create(type='A1', brand='B1', name='C1', product_quantity=10, price=100)
+		p2 = Product.objects.create(type='A2', brand='B2', name='C2', product_quantity=3, price=20)
+		CartItem.objects.create(user=self.u1, product=p1, quantity=4)
+		CartItem.objects.create(user=self.u1, product=p2, quantity=5)
+
+		conflict_resp = self.client.post(url)
+		self.assertEqual(conflict_resp.status_code, status.HTTP_409_CONFLICT)
+		self.assertEqual(conflict_resp.json()["conflicts"], [{"id": p2.id, "requested": 5, "available": 3}])
+		self.assertEqual(Product.objects.get(pk=p1.id).product_quantity, 10)
+		self.assertEqual(CartItem.objects.filter(user=self.u1).count(), 2)
+		self.assertFalse(ShopOrder.objects.exists())
+
+		CartItem.objects.filter(product=p2).update(quantity=3)
+		resp = self.client.post(url)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		order = ShopOrder.objects.get(track_id=resp.json()["track_id"])
+		self.assertEqual(Product.objects.get(pk=p1.id).product_quantity, 6)
+		self.assertEqual(Product.objects.get(pk=p2.id).product_quantity, 0)
+		self.assertFalse(CartItem.objects.filter(user=self.u1).exists())
+		self.assertEqual(
+			sorted(order.items.values_list('product_id', 'quantity', 'price')),
+			[(p1.id, 4, 100), (p2.id, 3, 20)]
+		)
+
+		detail_resp = self.client.get(ONLINE_MARKET_URL + f'track/{order.id}/')
+		self.assertEqual(len(detail_resp.json()["items"]), 2)
+
 	def test_orders_track(self):
 		url = ONLINE_MARKET_URL + 'track/'
 
@@ -342,12 +998,219 @@ class ShopViewTestCase(TestCase):
 
 	def test_order_detail(self):
 		# item = CartItem.objects.create(product=self.p1, user=self.u1, quantity=15)
-		order = ShopOrder.objects.create(user=self.u1, track_id=ShopOrder.generate_track_id())
+		order = ShopOrder.objects.create(user=self.u1)
 		url = ONLINE_MARKET_URL + f'track/{order.id}/'
 
 		auth_user_resp = self.client.get(url)
 		self.assertEqual(auth_user_resp.status_code, status.HTTP_200_OK)
 
+		not_modified_resp = self.client.get(url, HTTP_IF_NONE_MATCH=auth_user_resp['ETag'])
+		self.assertEqual(not_modified_resp.status_code, status.HTTP_304_NOT_MODIFIED)
+		order.status = ShopOrder.SENT
+		order.save()
+		modified_resp = self.client.get(url, HTTP_IF_NONE_MATCH=auth_user_resp['ETag'])
+		self.assertEqual(modified_resp.status_code, status.HTTP_200_OK)
+
 		self.client.credentials()
 		anon_user_resp = self.client.get(url)
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_order_track_code(self):
+		order = ShopOrder.objects.create(user=self.u1)
+		other = ShopOrder.objects.create(user=self.u1)
+		self.assertNotEqual(order.track_id, other.track_id)
+		self.assertEqual(ShopOrder.objects.get(pk=order.pk).track_id, order.track_id)
+
+		self.client.credentials()
+		resp = self.client.get(ONLINE_MARKET_URL + f'track/code/{order.track_id}/')
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(set(resp.json()), {'track_id', 'status', 'created_at'})
+		self.assertEqual(resp.json()["status"], order.get_status_display())
+
+		missing_resp = self.client.get(ONLINE_MARKET_URL + f'track/code/{order.track_id + 10**12}/')
+		self.assertEqual(missing_resp.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_track_ids(self):
+		track_ids = [track_id_for(number) for number in range(1, 20001)]
+		self.assertEqual(len(set(track_ids)), len(track_ids))
+		self.assertTrue(all(10**11 <= track_id < 10**12 for track_id in track_ids))
+		self.assertNotEqual(track_id_for(1), track_id_for(1, key='other'))
+		with self.assertRaises(ValueError):
+			track_id_for(9 * 10**11)
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+	query_budgets = {
+		'product_list': 2,
+		'product_detail': 2,
+		'comment_list': 3,
+		'cart_add': 2,
+		'cart_list': 0,
+		'shop': 9,
+		'order_list': 1,
+		'order_detail': 3,
+	}
+
+	def setUp(self):
+		cache.clear()
+		token_cache.local.clear()
+		cart_store.client.flushdb()
+		stock_service.backend.clear()
+		self.u = User.objects.create(username='user1', password='user1234', email='user1@test.com')
+		token = Token.objects.create(user=self.u)
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+		self.client.get(ONLINE_MARKET_URL + 'cart/')  # Warm up the token cache
+
+		self.products = [
+			Product.objects.create(type='A', brand='B', name=f'C{i}', product_quantity=100) for i in range(10)
+		]
+		for i in range(5):
+			author = User.objects.create(username=f'author{i}', email=f'author{i}@test.com')
+			self.products[0].comments.create(user=author, content='test', status=Comment.VALIDATED)
+
+	def test_product_budgets(self):
+		self.assertQueryBudget('product_list', self.client.get, ONLINE_MARKET_URL + 'products/')
+		self.assertQueryBudget('product_detail', self.client.get, ONLINE_MARKET_URL + f'products/{self.products[0].id}/')
+		self.assertQueryBudget('comment_list', self.client.get, ONLINE_MARKET_URL + f'opinion/{self.products[0].id}/')
+
+	def test_cart_and_order_budgets(self):
+		items = [{"product_id": p.id, "quantity": 1} for p in self.products]
+		self.assertQueryBudget('cart_add', self.client.post, ONLINE_MARKET_URL + 'cart/add/',
+							   json.dumps({"items_list": items}), content_type='application/json')
+		self.assertQueryBudget('cart_list', self.client.get, ONLINE_MARKET_URL + 'cart/')
+		self.assertQueryBudget('shop', self.client.post, ONLINE_MARKET_URL + 'shop/')
+		self.assertQueryBudget('order_list', self.client.get, ONLINE_MARKET_URL + 'track/')
+		order = ShopOrder.objects.get(user=self.u)
+		self.assertQueryBudget('order_detail', self.client.get, ONLINE_MARKET_URL + f'track/{order.id}/')
+
+	def test_metrics_headers(self):
+		resp = self.client.get(ONLINE_MARKET_URL + 'products/')
+		self.assertIn('X-DB-Queries', resp)
+		self.assertIn('X-Serializer-Time-ms', resp)
+
+
+class ReplicaRouterTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		db.replica_pool.reset()
+
+	@override_settings(DATABASE_REPLICAS={'replica_1': 3, 'replica_2': 1})
+	def test_weighted_round_robin(self):
+		pool = db.ReplicaPool()
+		with mock.patch.object(pool, 'measure_lag', return_value=0.0):
+			picks = [pool.choose() for _ in range(8)]
+		self.assertEqual(picks.count('replica_1'), 6)
+		self.assertEqual(picks[:4].count('replica_2'), 1)
+
+	@override_settings(DATABASE_REPLICAS={'replica_1': 3, 'replica_2': 1}, DATABASE_REPLICA_MAX_LAG=2)
+	def test_lag_ejection(self):
+		pool = db.ReplicaPool()
+		lags = {'replica_1': 10.0, 'replica_2': 0.5}
+		with mock.patch.object(pool, 'measure_lag', side_effect=lags.get):
+			self.assertEqual({pool.choose() for _ in range(4)}, {'replica_2'})
+
+		pool.reset()
+		with mock.patch.object(pool, 'measure_lag', return_value=float('inf')):
+			self.assertIsNone(pool.choose())
+
+	def test_routing(self):
+		router = db.ReplicaRouter()
+		with override_settings(DATABASE_REPLICAS={'replica_1': 1}), \
+				mock.patch.object(db.replica_pool, 'measure_lag', return_value=0.0):
+			self.assertIsNone(router.db_for_read(Product))
+
+			state = db.RoutingState(read_only=True)
+			token = db._state.set(state)
+			try:
+				self.assertEqual(router.db_for_read(Product), 'replica_1')
+				self.assertEqual(router.db_for_read(ShopOrder), 'replica_1')
+				self.assertIsNone(router.db_for_read(CartItem))
+				self.assertIsNone(router.db_for_read(User))
+				self.assertEqual(router.db_for_write(CartItem), 'default')
+				self.assertEqual(router.db_for_read(Product), 'replica_1')
+				# Only statements which change data pin the request to the primary
+				CartItem.objects.filter(pk=0).delete()
+				self.assertIsNone(router.db_for_read(Product))
+			finally:
+				db._state.reset(token)
+
+			self.assertFalse(router.allow_migrate('replica_1', 'online_market'))
+
+	# The primary stands in for the replica, the test checks where reads are routed, not replication
+	@override_settings(DATABASE_REPLICAS={'default': 1})
+	def test_read_your_writes(self):
+		u = User.objects.create(username='user', password='user1234', email='user@test.com')
+		client = APIClient()
+		client.credentials(HTTP_AUTHORIZATION="Token " + Token.objects.create(user=u).key)
+		other_client = APIClient()
+		other_client.credentials(HTTP_AUTHORIZATION="Token " + Token.objects.create(user=u).key)
+		p = Product.objects.create(type='A1', brand='B1', name='C1', product_quantity=10)
+		CartItem.objects.create(user=u, product=p, quantity=1)
+
+		with mock.patch.object(db.replica_pool, 'choose', wraps=db.replica_pool.choose) as choose:
+			client.get(ONLINE_MARKET_URL + 'track/')
+			self.assertTrue(choose.called)
+
+			client.post(ONLINE_MARKET_URL + 'shop/')
+			choose.reset_mock()
+			resp = client.get(ONLINE_MARKET_URL + 'track/')
+			self.assertFalse(choose.called)
+			self.assertEqual(len(resp.json()["results"]), 1)
+
+			# The user's other tokens see the write too, other users read from the replica
+			other_client.get(ONLINE_MARKET_URL + 'track/')
+			self.assertFalse(choose.called)
+			stranger = User.objects.create(username='stranger', password='user1234', email='stranger@test.com')
+			client.credentials(HTTP_AUTHORIZATION="Token " + Token.objects.create(user=stranger).key)
+			client.get(ONLINE_MARKET_URL + 'track/')
+			self.assertTrue(choose.called)
+
+	@override_settings(DATABASE_REPLICAS={'default': 1})
+	def test_cached_token_reads_the_replica(self):
+		u = User.objects.create(username='user', password='user1234', email='user@test.com')
+		client = APIClient()
+		client.credentials(HTTP_AUTHORIZATION="Token " + Token.objects.create(user=u).key)
+		token_cache.local.clear()
+
+		with mock.patch.object(db.replica_pool, 'choose', wraps=db.replica_pool.choose) as choose:
+			for _ in range(3):
+				choose.reset_mock()
+				resp = client.get(ONLINE_MARKET_URL + 'track/')
+				self.assertEqual(resp.status_code, status.HTTP_200_OK)
+				self.assertTrue(choose.called)
+		self.assertIsNone(db.sticky_cache().get(db.RoutingState.pin_prefix + f'user:{u.pk}'))
+
+	@override_settings(DATABASE_REPLICAS={'default': 1})
+	def test_cache_fills_read_the_primary(self):
+		cache.clear()
+		Product.objects.create(type='A1', brand='B1', name='C1', product_quantity=10)
+		client = APIClient()
+		with mock.patch.object(db.replica_pool, 'choose', wraps=db.replica_pool.choose) as choose:
+			resp = client.get(ONLINE_MARKET_URL + 'products/')
+			self.assertEqual(resp.status_code, status.HTTP_200_OK)
+			self.assertEqual(len(resp.json()["results"]), 1)
+
+			# Clients which gave up waiting for another one to fill the cache read the primary too
+			url = 'http://testserver' + ONLINE_MARKET_URL + 'products/?page_size=5'
+			cache.add(catalog_cache.list_key(url) + ':lock', 1)
+			with mock.patch.object(catalog_cache, 'wait', 0):
+				resp = client.get(url)
+			self.assertEqual(len(resp.json()["results"]), 1)
+			self.assertIsNone(cache.get(catalog_cache.list_key(url)))
+		self.assertFalse(choose.called)
+
+	@override_settings(DATABASE_HEALTH_CHECKS=True, DATABASE_HEALTH_CHECK_INTERVAL=60)
+	def test_health_check_interval(self):
+		connection.ensure_connection()
+		connection.__dict__.pop('health_checked_at', None)
+		with mock.patch.object(connection, 'is_usable', return_value=True) as is_usable:
+			db.check_connections()
+			db.check_connections()
+			self.assertEqual(is_usable.call_count, 1)
+
+			# A failed query gets the connection checked at the next request
+			connection.errors_occurred = True
+			db.check_connections()
+			self.assertEqual(is_usable.call_count, 2)
+			self.assertFalse(connection.errors_occurred)
@@ -5,10 +5,14 @@ from . import views
 
 urlpatterns = [
 	path('products/', views.ProductView.as_view(), name='api_product'),
+	path('products/import/', views.ProductImportView.as_view(), name='api_product_import'),
+	path('products/search/', views.ProductSearchView.as_view(), name='api_product_search'),
 	path('products/<int:pk>/', views.ProductDetailView.as_view(), name='api_product_detail'),
 	path('opinion/', views.CommentCreateView.as_view(), name='api_comment_create'),
 	path('opinion/<int:pk>/', views.CommentListView.as_view(), name='api_comment_list'),
 	path('opinion/edit/<int:pk>/', views.CommentEditView.as_view(), name='api_comment_list'),
+	path('export/<str:kind>/', views.ExportView.as_view(), name='api_export'),
+	path('moderation/comments/', views.ModerationQueueView.as_view(), name='api_comment_moderation'),
 	path('score/<int:pk>/', views.ProductScoreView.as_view(), name='api_score'),
 	path('cart/add/', views.CartItemView.as_view(), name='api_cart_add_item'),
 	path('cart/remove/', views.CartItemView.as_view(), name='api_cart_remove_item'),
@@ -17,6 +21,7 @@ urlpatterns = [
 	path('shop/', views.ShopView.as_view(), name='api_shop'),
 	path('track/', views.TrackShopOrderView.as_view(), name='api_orders'),
 	path('track/<int:pk>/', views.ShopOrderDetailView.as_view(), name='api_order_detail'),
+	path('track/code/<int:track_id>/', views.ShopOrderStatusView.as_view(), name='api_order_status'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
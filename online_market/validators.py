@@ -1,6 +1,7 @@
-from django.shortcuts import get_object_or_404
+from django.http import Http404
 
 from .models import Product, CartItem
+from .stock import stock_service
 
 
 def check_product_existence(pid):
@@ -22,8 +23,10 @@ def check_item_existence(pid):
 
 
 def check_product_quantity(pid, quantity):
-	product = get_object_or_404(Product, pk=pid)
-	if product.product_quantity < quantity:
+	sellable = stock_service.sellable([pid])
+	if pid not in sellable:
+		raise Http404
+	if sellable[pid] < quantity:
 		return False
 
 	return True
@@ -1,18 +1,119 @@
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
+import codecs
+import os
+import uuid
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticatedOrReadOnly, IsAuthenticated
 from rest_framework import status, generics, permissions
+from rest_framework.parsers import MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from . import serializers
+from . import serializers, conditional
 from .permissions import IsAdminUserOrReadOnly, IsAdminUserOrObjectCreator, IsObjectOwner
 from .models import Product, Comment, CartItem, ShopOrder
-from .validators import check_product_existence, check_item_existence, check_product_quantity
+from .cache import catalog_cache
+from .cart import add_items_to_cart
+from .cart_store import cart_store
+from .exports import EXPORTS, export_lines, spool
+from .filters import ProductFilter, list_facets
+from .imports import FORMATS, import_products, read_rows
+from .moderation import moderate_comments
+from .pagination import IdCursorPagination, KeysetList, OldestFirstCursorPagination, RankCursorPagination
+from .search import search_products
+from .stock import stock_service
+from .checkout import checkout, CheckoutConflict
 
 
 class ProductView(generics.ListCreateAPIView):
     permission_classes = [IsAdminUserOrReadOnly]
     queryset = Product.objects.all()
     serializer_class = serializers.ProductSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
+
+    @method_decorator(condition(etag_func=conditional.product_list_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        data = catalog_cache.get_list(
+            request.build_absolute_uri(), lambda: super(ProductView, self).list(request, *args, **kwargs).data
+        )
+        # Pages live longer than the facets, they are added to the cached page
+        return Response({**data, 'facets': list_facets(request)[1]})
+
+
+class ProductImportView(APIView):
+    """
+    Create or update products from an uploaded CSV or NDJSON file, invalid rows are written to an errors file
+    under MEDIA_ROOT. Use the import_products command for very large files.
+    """
+
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"message": "Upload the products as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = os.path.splitext(upload.name)[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            return Response({"message": f"The file must be one of: {', '.join(FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        errors_name = f"imports/{uuid.uuid4().hex}.errors.ndjson"
+        errors_path = os.path.join(settings.MEDIA_ROOT, errors_name)
+        os.makedirs(os.path.dirname(errors_path), exist_ok=True)
+        with open(errors_path, 'w') as errors_file:
+            result = import_products(read_rows(codecs.iterdecode(upload, 'utf-8'), fmt), errors_file)
+
+        if result['errors']:
+            result['errors_file'] = settings.MEDIA_URL + errors_name
+        else:
+            os.remove(errors_path)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class ExportView(APIView):
+    """
+    Stream all products or orders as CSV or NDJSON, optionally only those created in
+    [created_after, created_before).
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, kind):
+        if kind not in EXPORTS:
+            raise Http404
+        serializer = serializers.ExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        lines = export_lines(kind, data['output'], data.get('created_after'), data.get('created_before'))
+        content_type = 'text/csv' if data['output'] == 'csv' else 'application/x-ndjson'
+        filename = f'{kind}.{data["output"]}'
+        if isinstance(request._request, ASGIRequest):
+            # The ORM can not run where ASGI iterates the response, see online_market.exports
+            return FileResponse(spool(lines), content_type=content_type, as_attachment=True, filename=filename)
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ProductSearchView(generics.ListAPIView):
+    permission_classes = [AllowAny]
+    serializer_class = serializers.ProductSerializer
+    pagination_class = RankCursorPagination
+
+    def get_queryset(self):
+        return search_products(Product.objects.all(), self.request.query_params.get('q', ''))
 
 
 class ProductDetailView(generics.RetrieveAPIView):
@@ -20,6 +121,18 @@ class ProductDetailView(generics.RetrieveAPIView):
     queryset = Product.objects.all()
     serializer_class = serializers.ProductDetailSerializer
 
+    @method_decorator(condition(etag_func=conditional.product_etag,
+                                last_modified_func=conditional.product_last_modified))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        data = catalog_cache.get_product(
+            self.kwargs['pk'],
+            lambda: super(ProductDetailView, self).retrieve(request, *args, **kwargs).data
+        )
+        return Response(data)
+
 
 class ProductScoreView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
@@ -31,13 +144,24 @@ class CommentListView(generics.ListAPIView):
     permission_classes = [IsAdminUserOrObjectCreator]
     serializer_class = serializers.CommentSerializer
 
+    @method_decorator(condition(etag_func=conditional.comment_list_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
-        p = Product.objects.get(pk=self.kwargs.get('pk'))
-        comments = p.comments.all()
+        pk = self.kwargs.get('pk')
+        if not Product.objects.filter(pk=pk).exists():
+            raise Http404
+
+        comments = Comment.objects.filter(
+            content_type=ContentType.objects.get_for_model(Product), object_id=pk
+        ).select_related('user').only(
+            'content', 'created_at', 'modified_at', 'user__first_name', 'user__last_name', 'user__email'
+        )
         if self.request.user.is_staff:
             return comments
         elif self.request.method in permissions.SAFE_METHODS:
-            return comments.filter(status='v')
+            return comments.filter(status=Comment.VALIDATED)
 
 
 class CommentCreateView(APIView):
@@ -57,48 +181,33 @@ class CommentEditView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Comment.objects.all()
 
 
+class ModerationQueueView(generics.ListAPIView):
+    """
+    Waiting comments oldest first, POST approves and rejects them in batches.
+    """
+
+    permission_classes = [IsAdminUser]
+    serializer_class = serializers.ModerationCommentSerializer
+    pagination_class = OldestFirstCursorPagination
+    queryset = Comment.objects.filter(status=Comment.WAITING).select_related('user').only(
+        'object_id', 'content', 'created_at', 'user__first_name', 'user__last_name', 'user__email'
+    )
+
+    def post(self, request):
+        serializer = serializers.ModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = moderate_comments(serializer.validated_data['approve'], serializer.validated_data['reject'])
+
+        return Response(result, status=status.HTTP_200_OK)
+
+
 class CartItemView(APIView):
     def post(self, request):
         add_serializer = serializers.AddCartItemSerializer(data=request.data, context={'request': request})
         add_serializer.is_valid(raise_exception=True)
 
-        data = list()
         items_list = list(map(lambda x: dict(x), add_serializer.validated_data['items_list']))
-        for item in items_list:
-            pid = item['product_id']
-            quantity = item['quantity']
-            if not check_product_existence(pid):
-                data.append(
-                    {"id": pid, "success": False, "message": "There is no product with the entered id!"}
-                )
-            elif check_item_existence(pid):
-                tmp_item = CartItem.objects.get(product_id=pid)
-                product = Product.objects.get(pk=pid)
-                if tmp_item.quantity + quantity > product.product_quantity:
-                    data.append(
-                        {"id": pid, "success": False, "message": f"There is an item with product_id={pid} and "
-                                                                 f"the total quantity is more than available items"
-                                                                 f" in the store!"}
-                    )
-                else:
-                    tmp_item.quantity += quantity
-                    tmp_item.save()
-                    data.append(
-                        {"id": pid, "success": True, "message": f"There is an item with product_id={pid} and "
-                                                                f"the quantity is updated"}
-                    )
-            elif not check_product_quantity(pid, quantity):
-                data.append(
-                    {"id": pid, "success": False,
-                     "message": "There are not enough number of this product in the store!"}
-                )
-            else:
-                serializer = serializers.CartItemCreateSerializer(data=item, context={'request': request})
-                serializer.is_valid(raise_exception=True)
-                serializer.save()
-                data.append(
-                    {"id": pid, "success": True, "message": "The product added to the cart, successfully"}
-                )
+        data = add_items_to_cart(request.user, items_list)
 
         return Response(data, status=status.HTTP_200_OK)
 
@@ -107,19 +216,25 @@ class CartItemView(APIView):
         serializer.is_valid(raise_exception=True)
         items_id = serializer.validated_data['items_list']
 
+        lines = {item.pk: item.product_id for item in cart_store.items(request.user.id)}
         if items_id:
             CartItem.objects.filter(id__in=items_id, user=request.user).delete()
+            cart_store.remove_lines(request.user.id, items_id)
+            stock_service.release(request.user.id, [lines[item_id] for item_id in items_id if item_id in lines])
         else:
             CartItem.objects.filter(user=request.user).delete()
+            cart_store.clear(request.user.id)
+            stock_service.release(request.user.id, lines.values())
 
         return Response({"message": "Items are successfully deleted"}, status=status.HTTP_200_OK)
 
 
 class CartItemListView(generics.ListAPIView):
     serializer_class = serializers.CartItemListSerializer
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
-        return CartItem.objects.filter(user=self.request.user)
+        return KeysetList(cart_store.items(self.request.user.id))
 
 
 class CartItemEditView(generics.RetrieveUpdateAPIView):
@@ -127,20 +242,28 @@ class CartItemEditView(generics.RetrieveUpdateAPIView):
     serializer_class = serializers.CartItemEditSerializer
     queryset = CartItem.objects.all()
 
+    def get_object(self):
+        # The user's own lines come from the cart store, other ids are looked up for the 403 or 404
+        item = next((item for item in cart_store.items(self.request.user.id) if item.pk == self.kwargs['pk']), None)
+        if item is None:
+            return super().get_object()
+        item.user = self.request.user
+        self.check_object_permissions(self.request, item)
+        return item
+
 
 class ShopView(APIView):
-    def get(self, request):
-        user = request.user
-        track_id = ShopOrder.generate_track_id()
+    def post(self, request):
         data = dict()
 
-        items = CartItem.objects.filter(user=user)
-        if items:
-            order = ShopOrder.objects.create(user=user, track_id=track_id)
-            items.delete()
+        try:
+            order = checkout(request.user)
+        except CheckoutConflict as e:
+            return Response({"message": e.message, "conflicts": e.conflicts}, status=status.HTTP_409_CONFLICT)
 
+        if order:
             date, time = str(order.created_at).split(' ')
-            data["track_id"] = track_id
+            data["track_id"] = order.track_id
             data["date"] = date
             data["time"] = time.split('.')[0]
         else:
@@ -159,5 +282,17 @@ class TrackShopOrderView(generics.ListAPIView):
 class ShopOrderDetailView(generics.RetrieveAPIView):
     serializer_class = serializers.ShopOrderDetailSerializer
 
+    @method_decorator(condition(etag_func=conditional.order_etag,
+                                last_modified_func=conditional.order_last_modified))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
-        return ShopOrder.objects.filter(user=self.request.user)
+        return ShopOrder.objects.filter(user=self.request.user).prefetch_related('items')
+
+
+class ShopOrderStatusView(generics.RetrieveAPIView):
+    permission_classes = [AllowAny]
+    serializer_class = serializers.ShopOrderStatusSerializer
+    queryset = ShopOrder.objects.only('track_id', 'status', 'created_at')
+    lookup_field = 'track_id'
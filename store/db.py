@@ -0,0 +1,284 @@
+"""
+Database connection handling for the production profile.
+
+`check_connections` closes persistent connections (CONN_MAX_AGE) which the server or a pooler dropped while
+they were idle, before the request uses them. Django 4.0 has no CONN_HEALTH_CHECKS, it only notices a dead
+connection when a query fails. Each connection is pinged at most once per DATABASE_HEALTH_CHECK_INTERVAL
+seconds, and at the next request after a query on it failed.
+
+`ReplicaRouter` sends catalog and order tracking reads of GET requests to the replicas in DATABASE_REPLICAS,
+everything else goes to the primary. Replicas are picked by weighted round-robin and skipped while their
+replication lag is above DATABASE_REPLICA_MAX_LAG. A user who wrote reads from the primary for the next
+DATABASE_STICKY_WINDOW seconds, with any of their tokens, so they always see their own writes.
+`ReplicaRoutingMiddleware` tracks both. Reads whose results are cached for longer than replicas may lag
+go to the primary within `primary_reads`.
+"""
+import asyncio
+import contextvars
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.backends.signals import connection_created
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Statements after which the client must read its own writes from the primary
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+# (app_label, model_name) of the models whose reads may be served by a replica
+REPLICA_MODELS = {
+    ('online_market', 'product'),
+    ('online_market', 'comment'),
+    ('online_market', 'shoporder'),
+    ('online_market', 'shoporderitem'),
+}
+
+# Zero while the replica replayed everything it received, the age of the last replayed transaction otherwise
+POSTGRES_LAG_SQL = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+_state = contextvars.ContextVar('database_routing', default=None)
+
+
+def check_connections(**kwargs):
+    if not getattr(settings, 'DATABASE_HEALTH_CHECKS', False):
+        return
+
+    interval = getattr(settings, 'DATABASE_HEALTH_CHECK_INTERVAL', 10)
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        if not connection.errors_occurred and now - getattr(connection, 'health_checked_at', 0) < interval:
+            continue
+
+        if connection.is_usable():
+            connection.errors_occurred = False
+            connection.health_checked_at = now
+        else:
+            connection.close()
+
+
+request_started.connect(check_connections)
+
+
+def replica_weights():
+    replicas = getattr(settings, 'DATABASE_REPLICAS', {})
+    if isinstance(replicas, dict):
+        return replicas
+    return {alias: 1 for alias in replicas}
+
+
+class ReplicaPool:
+    """
+    Picks a replica by smooth weighted round-robin among the replicas whose lag is acceptable.
+    Lag is measured at most once per DATABASE_REPLICA_CHECK_INTERVAL seconds per replica and process.
+    """
+
+    def __init__(self):
+        self._current = dict()
+        self._lag = dict()
+        self._lock = threading.Lock()
+
+    def choose(self):
+        max_lag = getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 2)
+        weights = {alias: weight for alias, weight in replica_weights().items() if self.lag(alias) <= max_lag}
+        if not weights:
+            return None
+
+        total = sum(weights.values())
+        with self._lock:
+            for alias, weight in weights.items():
+                self._current[alias] = self._current.get(alias, 0) + weight
+            alias = max(weights, key=lambda a: self._current[a])
+            self._current[alias] -= total
+        return alias
+
+    def lag(self, alias):
+        interval = getattr(settings, 'DATABASE_REPLICA_CHECK_INTERVAL', 5)
+        now = time.monotonic()
+        checked = self._lag.get(alias)
+        if checked is None or now - checked[0] >= interval:
+            checked = self._lag[alias] = (now, self.measure_lag(alias))
+        return checked[1]
+
+    def measure_lag(self, alias):
+        """
+        Replication lag of the replica in seconds, infinite while it is unreachable.
+        """
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            # Stand-in replicas (e.g. SQLite aliases in tests) do not replicate
+            return 0.0
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(POSTGRES_LAG_SQL)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            return float('inf')
+        return float(lag or 0)
+
+    def reset(self):
+        with self._lock:
+            self._current.clear()
+            self._lag.clear()
+
+
+replica_pool = ReplicaPool()
+
+
+def sticky_cache():
+    return caches[getattr(settings, 'DATABASE_STICKY_CACHE_ALIAS', 'default')]
+
+
+def client_key(request):
+    """
+    The authenticated user, or the Authorization header or session cookie before authentication.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    return hashlib.md5(credentials.encode()).hexdigest() if credentials else None
+
+
+class RoutingState:
+    pin_prefix = 'db_pin:'
+
+    def __init__(self, read_only, request=None):
+        self.read_only = read_only
+        self.wrote = False
+        self.request = request
+        self._pinned = None
+
+    def pinned(self):
+        """
+        Whether the client wrote within the last DATABASE_STICKY_WINDOW seconds. Looked up on the first
+        replica read, after the view authenticated the user.
+        """
+        if self._pinned is None:
+            key = client_key(self.request) if self.request is not None else None
+            self._pinned = key is not None and sticky_cache().get(self.pin_prefix + key) is not None
+        return self._pinned
+
+    def pin_key(self):
+        key = client_key(self.request) if self.wrote and self.request is not None else None
+        return self.pin_prefix + key if key else None
+
+
+@contextmanager
+def primary_reads():
+    """
+    Route the reads of the block to the primary, e.g. when their results are cached for longer than the
+    replicas may lag behind.
+    """
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    read_only, state.read_only = state.read_only, False
+    try:
+        yield
+    finally:
+        state.read_only = read_only
+
+
+def record_writes(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection, it marks the current request as having written once a
+    data changing statement ran. Routing a model for writing is not enough, it is also asked for lookups.
+    """
+    result = execute(sql, params, many, context)
+    state = _state.get()
+    if state is not None and not state.wrote and sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+        state.wrote = True
+    return result
+
+
+def install_write_recorder(connection, **kwargs):
+    if record_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_writes)
+
+
+connection_created.connect(install_write_recorder)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.read_only or state.wrote:
+            return None
+        if (model._meta.app_label, model._meta.model_name) not in REPLICA_MODELS:
+            return None
+        if state.pinned():
+            return None
+        return replica_pool.choose()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_weights()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Marks GET requests as read only and pins users who wrote to the primary for DATABASE_STICKY_WINDOW seconds.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not replica_weights():
+            return self.get_response(request)
+
+        state = RoutingState(request.method in SAFE_METHODS, request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        key = state.pin_key()
+        if key:
+            sticky_cache().set(key, 1, getattr(settings, 'DATABASE_STICKY_WINDOW', 5))
+        return response
+
+    async def __acall__(self, request):
+        if not replica_weights():
+            return await self.get_response(request)
+
+        state = RoutingState(request.method in SAFE_METHODS, request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        # request.user may be a lazy object which queries the database
+        key = await sync_to_async(state.pin_key)() if state.wrote else None
+        if key:
+            await sticky_cache().aset(key, 1, getattr(settings, 'DATABASE_STICKY_WINDOW', 5))
+        return response
@@ -0,0 +1,183 @@
+"""
+Per request query count, database time, serializer time and total time.
+
+`RequestMetricsMiddleware` adds them as response headers when DEBUG (or REQUEST_METRICS_HEADERS) is on,
+and always aggregates them per endpoint in process, staff can read the aggregates from `RequestMetricsView`.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers, status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection, it records into the metrics of the current request.
+    The request is found through a context variable, so queries run in sync_to_async threads are counted too.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - start
+        metrics.queries += 1
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+class MetricsRegistry:
+    """
+    Aggregated metrics per endpoint of the current process.
+    """
+
+    def __init__(self):
+        self._data = dict()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, metrics, total_time):
+        with self._lock:
+            stats = self._data.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_time': 0.0, 'serializer_time': 0.0, 'total_time': 0.0, 'max_total_time': 0.0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += metrics.queries
+            stats['max_queries'] = max(stats['max_queries'], metrics.queries)
+            stats['db_time'] += metrics.db_time
+            stats['serializer_time'] += metrics.serializer_time
+            stats['total_time'] += total_time
+            stats['max_total_time'] = max(stats['max_total_time'], total_time)
+
+    def snapshot(self):
+        with self._lock:
+            data = {endpoint: dict(stats) for endpoint, stats in self._data.items()}
+
+        for stats in data.values():
+            requests = stats['requests']
+            stats['avg_queries'] = round(stats['queries'] / requests, 2)
+            for name in ('db_time', 'serializer_time', 'total_time'):
+                stats[f'avg_{name}_ms'] = round(stats.pop(name) / requests * 1000, 3)
+            stats['max_total_time_ms'] = round(stats.pop('max_total_time') * 1000, 3)
+        return data
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _timed_data(prop):
+    def data(self):
+        metrics = _current.get()
+        if metrics is None:
+            return prop.fget(self)
+
+        # Nested serializers are part of the outermost one
+        metrics.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return prop.fget(self)
+        finally:
+            metrics.serializer_depth -= 1
+            if not metrics.serializer_depth:
+                metrics.serializer_time += time.perf_counter() - start
+
+    data._request_metrics = True
+    return property(data)
+
+
+def instrument_serializers():
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(cls.data.fget, '_request_metrics', False):
+            cls.data = _timed_data(cls.data)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.headers = getattr(settings, 'REQUEST_METRICS_HEADERS', settings.DEBUG)
+        instrument_serializers()
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function, like django.utils.deprecation.MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    def finish(self, request, response, metrics, total_time):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = f"{request.method} /{match.route}" if match else f"{request.method} <unresolved>"
+        registry.record(endpoint, metrics, total_time)
+
+        if self.headers:
+            response['X-DB-Queries'] = str(metrics.queries)
+            response['X-DB-Time-ms'] = f"{metrics.db_time * 1000:.3f}"
+            response['X-Serializer-Time-ms'] = f"{metrics.serializer_time * 1000:.3f}"
+            response['X-Total-Time-ms'] = f"{total_time * 1000:.3f}"
+
+        return response
+
+
+class RequestMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(registry.snapshot(), status=status.HTTP_200_OK)
@@ -10,11 +10,31 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 import os
+from datetime import timedelta
 from pathlib import Path
 
 from configurations import Configuration, values
 
 
+def replica_databases(primary, hosts):
+    """
+    Database settings and weights of read replicas from "host[:port][=weight],...",
+    e.g. "replica1:5432=2,replica2" gives replica_1 with weight 2 and replica_2 with weight 1.
+    """
+    databases, weights = dict(), dict()
+    for number, replica in enumerate(filter(None, hosts.split(',')), 1):
+        address, _, weight = replica.strip().partition('=')
+        host, _, port = address.partition(':')
+        databases[f'replica_{number}'] = {
+            **primary,
+            'HOST': host,
+            'PORT': int(port or 5432),
+            'TEST': {'MIRROR': 'default'},
+        }
+        weights[f'replica_{number}'] = int(weight or 1)
+    return databases, weights
+
+
 class Dev(Configuration):
     # Build paths inside the project like this: BASE_DIR / 'subdir'.
     BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,13 +64,17 @@ class Dev(Configuration):
         'django.contrib.sessions',
         'django.contrib.messages',
         'django.contrib.staticfiles',
+        'django.contrib.postgres',
 
         'rest_framework',
+        'django_filters',
         'user_auth',
         'online_market',
     ]
 
     MIDDLEWARE = [
+        'store.metrics.RequestMetricsMiddleware',
+        'store.db.ReplicaRoutingMiddleware',
         'django.middleware.security.SecurityMiddleware',
         'django.contrib.sessions.middleware.SessionMiddleware',
         'django.middleware.common.CommonMiddleware',
@@ -95,6 +119,20 @@ class Dev(Configuration):
         }
     }
 
+    # Read replica aliases and their weights, catalog and order tracking reads of GET requests go there.
+    # Replicas lagging more than DATABASE_REPLICA_MAX_LAG seconds are skipped, clients read from the primary
+    # for DATABASE_STICKY_WINDOW seconds after they wrote, see store.db
+    DATABASE_REPLICAS = {}
+    DATABASE_ROUTERS = ['store.db.ReplicaRouter']
+    DATABASE_REPLICA_MAX_LAG = 2
+    DATABASE_REPLICA_CHECK_INTERVAL = 5
+    DATABASE_STICKY_WINDOW = 5
+    DATABASE_STICKY_CACHE_ALIAS = 'default'
+    # Ping persistent connections at the start of requests, at most once per DATABASE_HEALTH_CHECK_INTERVAL
+    # seconds per connection unless a query failed on it, see store.db.check_connections
+    DATABASE_HEALTH_CHECKS = False
+    DATABASE_HEALTH_CHECK_INTERVAL = 10
+
     # Password validation
     # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -134,24 +172,134 @@ class Dev(Configuration):
 
     DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
     PASSWORD_HASHERS = [
-        'django.contrib.auth.hashers.Argon2PasswordHasher',
+        'user_auth.hashers.Argon2PasswordHasher',
         'django.contrib.auth.hashers.PBKDF2PasswordHasher',
         'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
         'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
     ]
 
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+    # Send query count and timings of each request as X-DB-Queries, X-DB-Time-ms,
+    # X-Serializer-Time-ms and X-Total-Time-ms response headers, see store.metrics
+    REQUEST_METRICS_HEADERS = True
+
+    # Serialized product payloads and product list pages, see online_market.cache. The list facets are
+    # counted at most once per CATALOG_FACETS_TIMEOUT seconds for each filter, product changes do not reset them,
+    # so their counts may lag product changes by up to that long
+    CATALOG_CACHE_ALIAS = 'default'
+    CATALOG_CACHE_TIMEOUT = 600
+    CATALOG_FACETS_TIMEOUT = 60
+
+    # Carts are served from CART_STORE_URL (redis, in process memory without it) and quantity changes are
+    # written to the database by `manage.py flush_carts` in batches of CART_FLUSH_BATCH_SIZE carts, see
+    # online_market.cart_store
+    CART_STORE_URL = None
+    CART_STORE_TIMEOUT = 7 * 24 * 3600
+    CART_FLUSH_BATCH_SIZE = 500
+
+    # Available and reserved stock per product for carts, on STOCK_STORE_URL (redis, in process memory without
+    # it). Cart reservations are released STOCK_RESERVATION_TTL seconds after the line last changed and
+    # `manage.py reconcile_stock` resets the counters to the database, see online_market.stock
+    STOCK_STORE_URL = None
+    STOCK_RESERVATION_TTL = 1800
+
+    # Key of the order track id permutation, anyone knowing it can compute the track ids of all orders.
+    # Changing it once orders exist can produce duplicate track ids.
+    TRACK_ID_KEY = 'online-market-track-ids'
+
+    # Authentication tokens are cached in process for TOKEN_CACHE_LOCAL_TIMEOUT seconds
+    # and in the TOKEN_CACHE_ALIAS cache for TOKEN_CACHE_TIMEOUT seconds.
+    TOKEN_CACHE_ALIAS = 'default'
+    TOKEN_CACHE_TIMEOUT = 300
+    TOKEN_CACHE_LOCAL_TIMEOUT = 5
+    TOKEN_CACHE_LOCAL_SIZE = 10000
+
+    # Tokens expire when they are not used for TOKEN_EXPIRE_AFTER, their last usage is
+    # written at most once per TOKEN_LAST_USED_INTERVAL.
+    TOKEN_EXPIRE_AFTER = timedelta(days=14)
+    TOKEN_LAST_USED_INTERVAL = timedelta(minutes=10)
+    TOKEN_MAX_PER_USER = 10
+
+    # Counters of the login, register and change password throttles
+    THROTTLE_CACHE_ALIAS = 'default'
+
+    # Argon2 cost of new password hashes, hashes made with other parameters are replaced on login.
+    # Passwords are hashed on PASSWORD_HASHING_WORKERS threads (the cores divided by ARGON2_PARALLELISM when
+    # None) with PASSWORD_HASHING_QUEUE more waiting, further requests are answered 503, see user_auth.hashing
+    ARGON2_TIME_COST = 1
+    ARGON2_MEMORY_COST = 19456
+    ARGON2_PARALLELISM = 1
+    PASSWORD_HASHING_WORKERS = None
+    PASSWORD_HASHING_QUEUE = 16
+    PASSWORD_HASHING_TIMEOUT = 10
+
     REST_FRAMEWORK = {
         "DEFAULT_AUTHENTICATION_CLASSES": [
-            "user_auth.authentication.TokenAuthentication",
+            "user_auth.authentication.CachedTokenAuthentication",
         ],
         "DEFAULT_PERMISSION_CLASSES": [
             "rest_framework.permissions.IsAuthenticated",
         ],
-        "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+        "DEFAULT_PAGINATION_CLASS": "online_market.pagination.CreatedAtCursorPagination",
         "PAGE_SIZE": 5,
+        # Attempts per client IP and per username of the views hashing passwords, see user_auth.throttling
+        "DEFAULT_THROTTLE_RATES": {
+            "login_ip": "30/min",
+            "login_user": "10/min",
+            "register_ip": "20/hour",
+            "register_user": "10/hour",
+            "change_password_ip": "30/min",
+            "change_password_user": "5/min",
+        },
+        # Proxies in front of the app whose X-Forwarded-For entries are trusted, with 0 throttles use REMOTE_ADDR
+        "NUM_PROXIES": 0,
     }
 
 
 class Prod(Dev):
     DEBUG = False
     SECRET_KEY = values.SecretValue()
+    TRACK_ID_KEY = values.SecretValue()
+    REQUEST_METRICS_HEADERS = False
+
+    # Behind pgbouncer in transaction pooling mode a transaction may run on another server connection than
+    # the previous one, server-side cursors (used by QuerySet.iterator) do not survive that.
+    PGBOUNCER = os.environ.get('DJANGO_PGBOUNCER', '') == '1'
+
+    DATABASES = {
+        'default': {
+            **Dev.DATABASES['default'],
+            'HOST': os.environ.get('DJANGO_DB_HOST', 'db'),
+            'PORT': int(os.environ.get('DJANGO_DB_PORT', 5432)),
+            'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 600)),
+            'DISABLE_SERVER_SIDE_CURSORS': PGBOUNCER,
+        }
+    }
+    REPLICA_DATABASES, DATABASE_REPLICAS = replica_databases(
+        DATABASES['default'], os.environ.get('DJANGO_REPLICA_HOSTS', '')
+    )
+    DATABASES.update(REPLICA_DATABASES)
+    DATABASE_HEALTH_CHECKS = True
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('DJANGO_REDIS_URL', 'redis://redis:6379/0'),
+        }
+    }
+    CART_STORE_URL = os.environ.get('DJANGO_REDIS_URL', 'redis://redis:6379/0')
+    STOCK_STORE_URL = os.environ.get('DJANGO_REDIS_URL', 'redis://redis:6379/0')
+
+    REST_FRAMEWORK = {
+        **Dev.REST_FRAMEWORK,
+        "NUM_PROXIES": int(os.environ.get('DJANGO_NUM_PROXIES', 0)),
+    }
+
+    ARGON2_TIME_COST = int(os.environ.get('DJANGO_ARGON2_TIME_COST', 3))
+    ARGON2_MEMORY_COST = int(os.environ.get('DJANGO_ARGON2_MEMORY_COST', 65536))
+    ARGON2_PARALLELISM = int(os.environ.get('DJANGO_ARGON2_PARALLELISM', 4))
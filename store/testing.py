@@ -0,0 +1,33 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin which fails when an endpoint runs more SQL queries than its declared budget,
+    or does not answer with the expected status code.
+
+        query_budgets = {'product_list': 2}
+
+        resp = self.assertQueryBudget('product_list', self.client.get, url)
+    """
+
+    query_budgets = {}
+
+    def assertQueryBudget(self, endpoint, request, *args, status_code=200, **kwargs):
+        """
+        Send ``request(*args, **kwargs)`` and return the response. An error response usually runs fewer
+        queries than a successful one, so its status code is checked before the budget.
+        """
+        budget = self.query_budgets[endpoint]
+        with CaptureQueriesContext(connection) as context:
+            response = request(*args, **kwargs)
+
+        self.assertEqual(
+            response.status_code, status_code, f"{endpoint} answered {response.status_code}, expected {status_code}"
+        )
+        if len(context) > budget:
+            queries = '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, 1))
+            self.fail(f"{endpoint} ran {len(context)} queries, its budget is {budget}:\n{queries}")
+
+        return response
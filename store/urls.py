@@ -16,9 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import RequestMetricsView
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/auth/', include('user_auth.urls')),
     path('api/v1/online-market/', include('online_market.urls')),
+    path('api/v1/async/online-market/', include('online_market.async_urls')),
+    path('api/v1/metrics/', RequestMetricsView.as_view(), name='api_request_metrics'),
 ]
@@ -9,9 +9,9 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'store.settings')
 os.environ.setdefault("DJANGO_CONFIGURATION", "Prod")
 
+from configurations.wsgi import get_wsgi_application  # noqa: E402
+
 application = get_wsgi_application()
@@ -1,7 +1,66 @@
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
 import rest_framework.authentication
 
+from .cache import token_cache
 from .models import Token
 
 
 class TokenAuthentication(rest_framework.authentication.TokenAuthentication):
     model = Token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Resolves the token from `token_cache` and only queries the database on a miss.
+    Deleted tokens and changed users are evicted from the cache by signals.
+
+    Expired tokens are rejected and deleted, the last usage time is written lazily.
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(token)
+        elif not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        now = timezone.now()
+        if token.is_expired(now):
+            token.delete()
+            token_cache.evict(key)
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        if token.touch(now):
+            token_cache.set(token)
+
+        return token.user, token
+
+    async def aauthenticate(self, request):
+        """
+        Async variant of `authenticate` for plain Django async views, valid cached tokens
+        are resolved without leaving the event loop.
+        """
+        auth = rest_framework.authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain invalid '
+                                                    'characters.'))
+
+        token = await token_cache.aget(key)
+        now = timezone.now()
+        if token is None or token.is_expired(now) or token.needs_touch(now) or not token.user.is_active:
+            return await sync_to_async(self.authenticate_credentials)(key)
+
+        return token.user, token
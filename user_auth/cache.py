@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+
+
+class LocalLRUCache:
+    """
+    A small thread safe in-process LRU cache where every entry expires after `timeout` seconds.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TokenCache:
+    """
+    Resolves token keys to tokens (with their user) through an in-process LRU in front of the shared cache.
+
+    Only the field values of the token and of its user are cached, without the password hash: the user comes
+    back with a deferred password field which is loaded from the database when it is used.
+    The local LRU is not invalidated across processes, so its timeout must stay short;
+    `evict` removes a key from this process and from the shared cache.
+    """
+
+    prefix = 'auth_token:'
+
+    def __init__(self):
+        self.local = LocalLRUCache(
+            getattr(settings, 'TOKEN_CACHE_LOCAL_SIZE', 10000),
+            getattr(settings, 'TOKEN_CACHE_LOCAL_TIMEOUT', 5),
+        )
+        self.timeout = getattr(settings, 'TOKEN_CACHE_TIMEOUT', 300)
+        self.alias = getattr(settings, 'TOKEN_CACHE_ALIAS', 'default')
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _fields(model, exclude=()):
+        return [field for field in model._meta.concrete_fields if field.attname not in exclude]
+
+    def _values(self, instance, fields):
+        return tuple(field.get_prep_value(field.value_from_object(instance)) for field in fields)
+
+    def _dump(self, token):
+        # models imports this module
+        from .models import Token, User
+
+        return self._values(token, self._fields(Token)), self._values(token.user, self._fields(User, ['password']))
+
+    def _load(self, values):
+        from .models import Token, User
+
+        token_values, user_values = values
+        db = router.db_for_read(User)
+        user = User.from_db(db, [field.attname for field in self._fields(User, ['password'])], user_values)
+        token = Token.from_db(db, [field.attname for field in self._fields(Token)], token_values)
+        token.user = user
+        return token
+
+    def get(self, key):
+        values = self.local.get(key)
+        if values is not None:
+            self._count('local_hits')
+            return self._load(values)
+
+        values = self.shared.get(self.prefix + key)
+        if values is not None:
+            self._count('shared_hits')
+            self.local.set(key, values)
+            return self._load(values)
+
+        self._count('misses')
+        return None
+
+    async def aget(self, key):
+        values = self.local.get(key)
+        if values is not None:
+            self._count('local_hits')
+            return self._load(values)
+
+        values = await self.shared.aget(self.prefix + key)
+        if values is not None:
+            self._count('shared_hits')
+            self.local.set(key, values)
+            return self._load(values)
+
+        self._count('misses')
+        return None
+
+    def set(self, token):
+        values = self._dump(token)
+        self.shared.set(self.prefix + token.key, values, self.timeout)
+        self.local.set(token.key, values)
+
+    def evict(self, *keys):
+        if not keys:
+            return
+        for key in keys:
+            self.local.delete(key)
+        self.shared.delete_many([self.prefix + key for key in keys])
+        self._count('evictions', len(keys))
+
+    def evict_user(self, user_id):
+        """
+        Evict all tokens of the user, e.g. after the user changed.
+        """
+        from .models import Token
+
+        self.evict(*Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 4) if lookups else None
+        return stats
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+
+token_cache = TokenCache()
@@ -0,0 +1,104 @@
+"""
+Password hashing off the request threads.
+
+Argon2 is slow on purpose, a burst of logins hashing on the request threads takes every core from the other
+requests of the process. Hashes are computed and verified on a pool of PASSWORD_HASHING_WORKERS threads
+instead, with up to PASSWORD_HASHING_QUEUE more waiting; beyond that a request is answered 503 right away
+rather than piling up. argon2 releases the GIL while hashing, so the pool threads hash in parallel.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The server is busy, please try again."
+    default_code = 'hashing_unavailable'
+    # Sent as Retry-After
+    wait = 1
+
+
+class HashingPool:
+    """
+    Runs hashing functions on a bounded pool, `run` raises HashingUnavailable when every worker
+    and queue slot is taken or the result takes longer than `timeout` seconds.
+    """
+
+    def __init__(self, workers=None, queue=None, timeout=None):
+        # Each hash already uses ARGON2_PARALLELISM threads
+        cores = max(1, (os.cpu_count() or 1) // getattr(settings, 'ARGON2_PARALLELISM', 1))
+        self.workers = workers or getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or cores
+        self.queue = queue if queue is not None else getattr(settings, 'PASSWORD_HASHING_QUEUE', 4 * self.workers)
+        self.timeout = timeout or getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 10)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hashing')
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue)
+        self._stats = {'hashed': 0, 'shed': 0, 'timeouts': 0}
+        self._stats_lock = threading.Lock()
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count('shed')
+            raise HashingUnavailable()
+
+        def task():
+            try:
+                return fn(*args)
+            finally:
+                # Before the result is set, a caller seeing it sees the free slot too
+                self._slots.release()
+
+        try:
+            future = self.executor.submit(task)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        try:
+            result = future.result(self.timeout)
+        except TimeoutError:
+            self._count('timeouts')
+            raise HashingUnavailable()
+        self._count('hashed')
+        return result
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(workers=self.workers, queue=self.queue)
+        return stats
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+
+hashing_pool = HashingPool()
+
+
+def _verify(password, encoded):
+    outdated = list()
+    correct = check_password(password, encoded, setter=outdated.append)
+    # An outdated hash is replaced, compute the new one while on the pool
+    return correct, make_password(password) if outdated else None
+
+
+def verify_password(user, password):
+    """
+    The user's check_password on the hashing pool. A hash made by another hasher or with other
+    parameters is replaced, the row is saved on the calling thread.
+    """
+    correct, encoded = hashing_pool.run(_verify, password, user.password)
+    if encoded:
+        user.password = encoded
+        user.save(update_fields=['password'])
+    return correct
+
+
+def hash_password(password):
+    return hashing_pool.run(make_password, password)
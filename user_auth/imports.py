@@ -0,0 +1,143 @@
+"""
+Bulk user provisioning from CSV or NDJSON streams, e.g. when moving a customer base from another system.
+
+Rows are read lazily and written in batches, each batch in its own transaction with one query looking up
+the usernames, emails and phone numbers which are taken and one ``bulk_create``. When a concurrent signup
+takes one of them in between, the batch is inserted row by row and the conflicting rows are reported.
+
+``password`` is a hash in any format of PASSWORD_HASHERS and is stored as is, hashing millions of passwords
+would take days; hashes of older hashers are replaced on the user's next login. Users without one get an
+unusable password.
+"""
+import time
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from rest_framework import serializers
+
+from online_market.imports import write_error
+from .models import User
+from .validators import phone_regex_validator
+
+UNIQUE_FIELDS = ('username', 'email', 'phone_number')
+
+
+class UserImportSerializer(serializers.Serializer):
+    # A plain serializer, a ModelSerializer would check each unique field with one query per row
+    username = serializers.CharField(max_length=150, validators=[UnicodeUsernameValidator()])
+    email = serializers.EmailField(max_length=254)
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True, default='')
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True, default='')
+    phone_number = serializers.CharField(max_length=11, required=False, allow_null=True, default=None,
+                                         validators=[phone_regex_validator])
+    password = serializers.CharField(max_length=128, required=False, allow_null=True, default=None)
+
+    def validate_password(self, value):
+        if value is None:
+            return value
+        try:
+            # identify_hasher only looks at the algorithm prefix, decoding checks the whole hash
+            decoded = identify_hasher(value).decode(value)
+        except (ValueError, IndexError):
+            raise serializers.ValidationError("Not a password hash of a known hasher.")
+        if not decoded.get('hash'):
+            raise serializers.ValidationError("The password hash is incomplete.")
+        return value
+
+
+def import_users(rows, errors_file, batch_size=1000):
+    """
+    Create active users from ``(row_number, row)`` pairs. Rows whose username, email or phone number is
+    taken, by an existing user or an earlier row, are written to the errors file. Returns the counts and
+    the throughput.
+    """
+    result = {'rows': 0, 'created': 0, 'errors': 0}
+    start = time.perf_counter()
+
+    batch = list()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _import_batch(batch, errors_file, result)
+            batch = list()
+    if batch:
+        _import_batch(batch, errors_file, result)
+
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    result['rows_per_second'] = round(result['rows'] / result['seconds'], 1) if result['seconds'] else None
+    return result
+
+
+def _import_batch(batch, errors_file, result):
+    result['rows'] += len(batch)
+
+    serializer = UserImportSerializer()
+    valid = list()
+    seen = {field: set() for field in UNIQUE_FIELDS}
+    for number, row in batch:
+        if isinstance(row, Exception) or not isinstance(row, dict):
+            write_error(errors_file, number, {'non_field_errors': [f"Invalid row: {row}"]}, None)
+            result['errors'] += 1
+            continue
+
+        try:
+            data = serializer.run_validation(row)
+        except serializers.ValidationError as e:
+            write_error(errors_file, number, e.detail, row)
+            result['errors'] += 1
+            continue
+
+        duplicates = [field for field in UNIQUE_FIELDS if data[field] is not None and data[field] in seen[field]]
+        if duplicates:
+            write_error(errors_file, number, {field: ["Repeats an earlier row."] for field in duplicates}, row)
+            result['errors'] += 1
+            continue
+        for field in UNIQUE_FIELDS:
+            if data[field] is not None:
+                seen[field].add(data[field])
+        valid.append((number, row, data))
+
+    if not valid:
+        return
+
+    with transaction.atomic():
+        condition = Q()
+        for field in UNIQUE_FIELDS:
+            if seen[field]:
+                condition |= Q(**{f'{field}__in': seen[field]})
+        taken = {field: set() for field in UNIQUE_FIELDS}
+        for values in User.objects.filter(condition).values_list(*UNIQUE_FIELDS):
+            for field, value in zip(UNIQUE_FIELDS, values):
+                taken[field].add(value)
+
+        users = list()
+        for number, row, data in valid:
+            conflicts = [field for field in UNIQUE_FIELDS if data[field] is not None and data[field] in taken[field]]
+            if conflicts:
+                write_error(errors_file, number, {field: ["Already exists."] for field in conflicts}, row)
+                result['errors'] += 1
+                continue
+            # bulk_create skips User.save, the password is set here
+            user = User(**dict(data, password=data['password'] or make_password(None)), is_active=True)
+            users.append((number, row, user))
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create([user for _, _, user in users])
+        except IntegrityError:
+            # Someone registered one of the users since the lookup, insert them one by one
+            created = list()
+            for number, row, user in users:
+                try:
+                    with transaction.atomic():
+                        user.save(force_insert=True)
+                except IntegrityError:
+                    write_error(errors_file, number, {'non_field_errors': ["Already exists."]}, row)
+                    result['errors'] += 1
+                else:
+                    created.append(user)
+            users = created
+
+    result['created'] += len(users)
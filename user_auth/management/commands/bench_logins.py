@@ -0,0 +1,64 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory
+
+from user_auth.hashing import hashing_pool
+from user_auth.models import User
+from user_auth.views import LoginView
+
+BENCH_PREFIX = 'bench_login'
+BENCH_PASSWORD = 'bench-login-password'
+
+
+class Command(BaseCommand):
+    help = "Fire parallel logins and report logins per second and per core with the current Argon2 parameters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--logins', type=int, default=1000)
+        parser.add_argument('--clients', type=int, default=32, help="Concurrent login requests")
+
+    def handle(self, *args, **options):
+        self.cleanup()
+        # All users share one hash, hashing it once per user would take longer than the benchmark
+        password = make_password(BENCH_PASSWORD)
+        User.objects.bulk_create([
+            User(username=f'{BENCH_PREFIX}_{i}', email=f'{BENCH_PREFIX}_{i}@bench.local', password=password)
+            for i in range(options['users'])
+        ])
+
+        view = LoginView.as_view(throttle_classes=[])
+        factory = APIRequestFactory()
+
+        def run(i):
+            request = factory.post('/login/', {
+                'username': f'{BENCH_PREFIX}_{i % options["users"]}', 'password': BENCH_PASSWORD,
+            }, format='json')
+            try:
+                return view(request).status_code
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['clients']) as executor:
+            results = list(executor.map(run, range(options['logins'])))
+        elapsed = time.perf_counter() - start
+
+        succeeded = results.count(200)
+        cores = os.cpu_count() or 1
+        self.stdout.write(f"hashing workers: {hashing_pool.workers}, queue: {hashing_pool.queue}, cores: {cores}")
+        self.stdout.write(f"logins: {succeeded} of {len(results)} in {elapsed:.2f}s "
+                          f"({succeeded / elapsed:.1f}/s, {succeeded / elapsed / cores:.1f}/s per core)")
+        shed = results.count(503)
+        self.stdout.write(f"shed (503): {shed}, other failures: {len(results) - succeeded - shed}")
+
+        self.cleanup()
+
+    @staticmethod
+    def cleanup():
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
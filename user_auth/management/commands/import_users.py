@@ -0,0 +1,33 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from online_market.imports import FORMATS, read_rows
+from user_auth.imports import import_users
+
+
+class Command(BaseCommand):
+    help = "Create users from a CSV or NDJSON file in batches, invalid rows are written to an errors file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--errors', help="Defaults to <path>.errors.ndjson")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f"Unknown format {fmt!r}, use --format {'/'.join(FORMATS)}")
+        errors_path = options['errors'] or path + '.errors.ndjson'
+
+        with open(path, newline='', encoding='utf-8') as stream, open(errors_path, 'w') as errors_file:
+            result = import_users(read_rows(stream, fmt), errors_file, options['batch_size'])
+
+        self.stdout.write(
+            f"{result['rows']} rows: {result['created']} created, {result['errors']} errors "
+            f"in {result['seconds']}s ({result['rows_per_second']} rows/s)"
+        )
+        if result['errors']:
+            self.stdout.write(f"Errors are written to {errors_path}")
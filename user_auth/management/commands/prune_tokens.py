@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from user_auth.cache import token_cache
+from user_auth.models import Token
+
+
+class Command(BaseCommand):
+    help = "Delete expired authentication tokens in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help="Seconds to wait between batches")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - settings.TOKEN_EXPIRE_AFTER
+        expired = Token.objects.filter(last_used__lt=cutoff).order_by('last_used')
+        deleted = 0
+
+        while True:
+            batch = list(expired.values_list('pk', 'key')[:options['batch_size']])
+            if not batch:
+                break
+
+            pks, keys = zip(*batch)
+            # Each batch is its own short transaction, so the table is never locked for long
+            Token.objects.filter(pk__in=pks).delete()
+            token_cache.evict(*keys)
+            deleted += len(batch)
+
+            if len(batch) < options['batch_size']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(f"Deleted {deleted} expired tokens")
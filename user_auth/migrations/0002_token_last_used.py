@@ -0,0 +1,23 @@
+# Generated by Django 4.0.3 on 2026-10-18 19:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_auth', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='last_used',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Last used'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['user', 'created'], name='token_user_created_idx'),
+        ),
+    ]
@@ -1,9 +1,11 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import rest_framework.authtoken.models
 
+from .cache import token_cache
 from .validators import phone_regex_validator
 
 
@@ -36,3 +38,48 @@ class Token(rest_framework.authtoken.models.Token):
         settings.AUTH_USER_MODEL, related_name='auth_tokens',
         on_delete=models.CASCADE, verbose_name=_("User")
     )
+    last_used = models.DateTimeField(_("Last used"), default=timezone.now, db_index=True)
+
+    class Meta(rest_framework.authtoken.models.Token.Meta):
+        indexes = [
+            models.Index(fields=['user', 'created'], name='token_user_created_idx'),
+        ]
+
+    @classmethod
+    def issue(cls, user):
+        """
+        Create a new token for the user and delete the oldest ones above TOKEN_MAX_PER_USER.
+        """
+        token = cls.objects.create(user=user)
+
+        keys = list(
+            cls.objects.filter(user=user).order_by('-created', '-id').values_list('key', flat=True)
+            [settings.TOKEN_MAX_PER_USER:]
+        )
+        if keys:
+            cls.objects.filter(key__in=keys).delete()
+            token_cache.evict(*keys)
+
+        return token
+
+    def is_expired(self, now=None):
+        """
+        Tokens expire TOKEN_EXPIRE_AFTER after they were last used.
+        """
+        return self.last_used < (now or timezone.now()) - settings.TOKEN_EXPIRE_AFTER
+
+    def needs_touch(self, now=None):
+        return (now or timezone.now()) - self.last_used >= settings.TOKEN_LAST_USED_INTERVAL
+
+    def touch(self, now=None):
+        """
+        Store the last usage time, at most once per TOKEN_LAST_USED_INTERVAL.
+        Returns whether the token was written.
+        """
+        now = now or timezone.now()
+        if not self.needs_touch(now):
+            return False
+
+        self.last_used = now
+        type(self).objects.filter(pk=self.pk).update(last_used=now)
+        return True
@@ -4,6 +4,7 @@ from rest_framework.validators import UniqueValidator
 from rest_framework import serializers
 
 from user_auth.models import User
+from .hashing import hash_password
 from .validators import phone_regex_validator
 
 
@@ -33,17 +34,20 @@ class RegisterSerializer(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        user = User.objects.create(
+        """
+        Insert the active user with its password hash in a single query.
+        """
+        user = User(
             username=validated_data['username'],
             email=validated_data['email'],
             first_name=validated_data['first_name'],
             last_name=validated_data['last_name'],
             phone_number=validated_data['phone_number'],
-            profile_image=validated_data['profile_image']
+            profile_image=validated_data['profile_image'],
+            password=hash_password(validated_data['password1']),
+            is_active=True,
         )
-
-        user.set_password(validated_data['password1'])
-        user.save()
+        user.save(force_insert=True)
 
         return user
 
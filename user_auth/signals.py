@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import token_cache
+from .models import User, Token
+
+
+@receiver(post_save, sender=User)
+def evict_user_tokens(sender, instance, created, **kwargs):
+    # Cached tokens carry the user's fields, e.g. is_active
+    if not created:
+        token_cache.evict_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    # Tokens deleted in the admin or by a user's deletion
+    token_cache.evict(instance.key)
@@ -1,15 +1,34 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from unittest import mock
 from rest_framework import status
 from rest_framework.test import APIClient
 import json
+import os
+import tempfile
+import threading
 
+from store.testing import QueryBudgetMixin
+from user_auth.cache import token_cache
+from user_auth.hashing import HashingPool
 from user_auth.models import Token, User
+from user_auth.throttling import local_counters, throttle_stats
 
 ONLINE_MARKET_URL = "/api/v1/auth/"
 
 
 class RegisterViewTestCase(TestCase):
 	def setUp(self):
+		cache.clear()
 		self.client = APIClient()
 
 	def test_register(self):
@@ -78,6 +97,30 @@ class RegisterViewTestCase(TestCase):
 		))
 		self.assertEqual(bad_resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+	def test_register_is_atomic(self):
+		data = dict(
+			username="test1",
+			password1="Mobin12345",
+			password2="Mobin12345",
+			email="test1@mobin.com",
+			first_name="",
+			last_name="",
+			phone_number="",
+			profile_image=""
+		)
+		with mock.patch.object(Token.objects, 'create', side_effect=RuntimeError):
+			with self.assertRaises(RuntimeError):
+				self.client.post(ONLINE_MARKET_URL + 'register/', data)
+		self.assertFalse(User.objects.filter(username="test1").exists())
+
+		resp = self.client.post(ONLINE_MARKET_URL + 'register/', data)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		user = User.objects.get(username="test1")
+		self.assertTrue(user.is_active)
+		self.assertIsNone(user.phone_number)
+		self.assertTrue(user.check_password("Mobin12345"))
+		self.assertEqual(user.auth_tokens.get().key, resp.json()["token"])
+
 	def test_login(self):
 		url = ONLINE_MARKET_URL + 'login/'
 		u = User.objects.create(username="Mehrdad", email="mehrdad@mobin.com")
@@ -108,6 +151,10 @@ class RegisterViewTestCase(TestCase):
 		auth_user_resp = self.client.get(url)
 		self.assertEqual(auth_user_resp.status_code, status.HTTP_200_OK)
 
+		# The token is evicted from the cache
+		logged_out_resp = self.client.get(url)
+		self.assertEqual(logged_out_resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
 		self.client.credentials()
 		anon_user_resp = self.client.get(url)
 		self.assertEqual(anon_user_resp.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -130,6 +177,10 @@ class RegisterViewTestCase(TestCase):
 		)
 		self.assertEqual(auth_user_resp.status_code, status.HTTP_200_OK)
 
+		# Old tokens are evicted from the cache
+		old_token_resp = self.client.get(ONLINE_MARKET_URL + 'get-profile/')
+		self.assertEqual(old_token_resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
 		# Wrong password
 		bad_resp = self.client.post(
 			url,
@@ -220,3 +271,347 @@ class ProfileViewTestCase(TestCase):
 			profile_image=""
 		))
 		self.assertEqual(inv_token_resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TokenCacheTestCase(TestCase):
+	def setUp(self):
+		token_cache.local.clear()
+		self.u = User.objects.create(username="Mehrdad", email="mehrdad@mobin.com")
+		self.token = Token.objects.create(user=self.u)
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+	def test_cached_authentication(self):
+		url = ONLINE_MARKET_URL + 'get-profile/'
+
+		with CaptureQueriesContext(connection) as miss_ctx:
+			resp = self.client.get(url)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		with CaptureQueriesContext(connection) as hit_ctx:
+			resp = self.client.get(url)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(len(hit_ctx), len(miss_ctx) - 1)
+
+		stats = token_cache.stats()
+		self.assertGreaterEqual(stats["local_hits"], 1)
+		self.assertGreaterEqual(stats["misses"], 1)
+
+	def test_cached_values(self):
+		self.u.set_password("Mehrdad1234")
+		self.u.save()
+		self.assertEqual(self.client.get(ONLINE_MARKET_URL + 'get-profile/').status_code, status.HTTP_200_OK)
+
+		values = cache.get(token_cache.prefix + self.token.key)
+		self.assertNotIn(self.u.password, values[1])
+		# The password is loaded when it is needed
+		user = token_cache.get(self.token.key).user
+		self.assertEqual(user.get_deferred_fields(), {'password'})
+		self.assertTrue(user.check_password("Mehrdad1234"))
+
+	def test_changed_users_and_deleted_tokens(self):
+		url = ONLINE_MARKET_URL + 'get-profile/'
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+		# A hit of a user who is not active
+		token = Token.objects.select_related('user').get(pk=self.token.pk)
+		token.user.is_active = False
+		token_cache.set(token)
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+		# Saving the user evicts the tokens
+		self.u.is_active = True
+		self.u.save()
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+		self.u.is_active = False
+		self.u.save()
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+		self.u.is_active = True
+		self.u.save()
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+		Token.objects.filter(pk=self.token.pk).delete()
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_stats(self):
+		url = ONLINE_MARKET_URL + 'token-cache/stats/'
+
+		user_resp = self.client.get(url)
+		self.assertEqual(user_resp.status_code, status.HTTP_403_FORBIDDEN)
+
+		admin_user = User.objects.create_superuser(username='admin', password='admin1234', email='admin@test.com')
+		token = Token.objects.create(user=admin_user)
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+		admin_resp = self.client.get(url)
+		self.assertEqual(admin_resp.status_code, status.HTTP_200_OK)
+		self.assertIn("hit_ratio", admin_resp.json())
+
+
+class TokenExpiryTestCase(TestCase):
+	def setUp(self):
+		token_cache.local.clear()
+		self.u = User.objects.create(username="Mehrdad", email="mehrdad@mobin.com")
+		self.client = APIClient()
+
+	def test_sliding_expiry(self):
+		url = ONLINE_MARKET_URL + 'get-profile/'
+		token = Token.issue(self.u)
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+		recent = timezone.now() - timedelta(minutes=1)
+		Token.objects.filter(pk=token.pk).update(last_used=recent)
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+		# last_used is not written on every request
+		self.assertEqual(Token.objects.get(pk=token.pk).last_used, recent)
+
+		Token.objects.filter(pk=token.pk).update(last_used=timezone.now() - timedelta(days=1))
+		token_cache.evict(token.key)
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+		self.assertGreater(Token.objects.get(pk=token.pk).last_used, recent)
+
+		Token.objects.filter(pk=token.pk).update(last_used=timezone.now() - timedelta(days=30))
+		token_cache.evict(token.key)
+		self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+		self.assertFalse(Token.objects.filter(pk=token.pk).exists())
+
+	@override_settings(TOKEN_MAX_PER_USER=3)
+	def test_max_tokens_per_user(self):
+		tokens = [Token.issue(self.u) for _ in range(5)]
+
+		self.assertEqual(
+			set(Token.objects.filter(user=self.u).values_list('key', flat=True)),
+			{t.key for t in tokens[2:]}
+		)
+
+	def test_prune_tokens(self):
+		fresh = Token.issue(self.u)
+		expired = Token.issue(self.u)
+		Token.objects.filter(pk=expired.pk).update(last_used=timezone.now() - timedelta(days=30))
+
+		call_command('prune_tokens', batch_size=1, sleep=0, stdout=StringIO())
+		self.assertEqual(list(Token.objects.values_list('key', flat=True)), [fresh.key])
+
+
+class ImportUsersTestCase(TestCase):
+	def setUp(self):
+		User.objects.create(username="taken", email="taken@mobin.com", phone_number="09120000000")
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+
+	def test_import_command(self):
+		encoded = make_password("Mobin12345")
+		path = os.path.join(self.tmp.name, 'users.csv')
+		with open(path, 'w') as f:
+			f.write("username,email,first_name,phone_number,password\n"
+					f'user1,user1@mobin.com,One,09121111111,"{encoded}"\n'
+					"user2,user2@mobin.com,,,\n"
+					"taken,other@mobin.com,,,\n"
+					"user3,user3@mobin.com,,09120000000,\n"
+					"user4,user1@mobin.com,,,\n"
+					"user5,not an email,,,\n"
+					"user6,user6@mobin.com,,,plaintext\n"
+					f'user7,user7@mobin.com,,,"{encoded[:encoded.rindex("$")]}"\n')
+
+		out = StringIO()
+		call_command('import_users', path, '--batch-size', '3', stdout=out)
+		self.assertIn("8 rows: 2 created, 6 errors", out.getvalue())
+
+		user1 = User.objects.get(username="user1")
+		self.assertTrue(user1.is_active)
+		self.assertEqual((user1.first_name, user1.phone_number), ("One", "09121111111"))
+		self.assertTrue(user1.check_password("Mobin12345"))
+		user2 = User.objects.get(username="user2")
+		self.assertIsNone(user2.phone_number)
+		self.assertFalse(user2.has_usable_password())
+
+		with open(path + '.errors.ndjson') as f:
+			errors = [json.loads(line) for line in f]
+		self.assertEqual(sorted((e["row"], sorted(e["errors"])) for e in errors), [
+			(4, ["username"]), (5, ["phone_number"]), (6, ["email"]), (7, ["email"]), (8, ["password"]),
+			(9, ["password"]),
+		])
+
+	def test_import_concurrent_signup(self):
+		path = os.path.join(self.tmp.name, 'users.ndjson')
+		with open(path, 'w') as f:
+			f.write('{"username": "user1", "email": "user1@mobin.com"}\n'
+					'{"username": "user2", "email": "user2@mobin.com"}\n')
+
+		# user2 registers between the lookup and the insert, the lookup does not see it
+		User.objects.create(username="user2", email="user2@other.com")
+		out = StringIO()
+		with mock.patch.object(User.objects, 'filter', return_value=User.objects.none()):
+			call_command('import_users', path, stdout=out)
+		self.assertIn("2 rows: 1 created, 1 errors", out.getvalue())
+		self.assertTrue(User.objects.filter(username="user1").exists())
+		self.assertEqual(User.objects.get(username="user2").email, "user2@other.com")
+
+
+THROTTLE_RATES = {
+	"login_ip": "5/min",
+	"login_user": "2/min",
+	"register_ip": "2/hour",
+	"register_user": "2/hour",
+	"change_password_ip": "5/min",
+	"change_password_user": "2/min",
+}
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": THROTTLE_RATES})
+class ThrottleTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		local_counters.clear()
+		throttle_stats.clear()
+		self.client = APIClient()
+		self.u = User.objects.create(username="Mehrdad", email="mehrdad@mobin.com", is_staff=True)
+		self.u.set_password("Mehrdad1234")
+		self.u.save()
+
+	def test_login_per_username(self):
+		url = ONLINE_MARKET_URL + 'login/'
+		for _ in range(2):
+			resp = self.client.post(url, {"username": "Mehrdad", "password": "wrong"})
+			self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+
+		# Rejected before the password is hashed, whatever the case of the username
+		with mock.patch('user_auth.views.verify_password') as verify_password:
+			resp = self.client.post(url, {"username": "mehrdad", "password": "Mehrdad1234"})
+		self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertGreater(int(resp['Retry-After']), 0)
+		self.assertLessEqual(int(resp['Retry-After']), 120)
+		verify_password.assert_not_called()
+
+		# Other usernames are still limited by the IP only
+		resp = self.client.post(url, {"username": "other", "password": "wrong"})
+		self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+
+		token = Token.objects.create(user=self.u)
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+		stats = self.client.get(ONLINE_MARKET_URL + 'throttle/stats/').json()
+		self.assertEqual(stats["login_user"], {"allowed": 3, "throttled": 1})
+		self.assertEqual(stats["login_ip"], {"allowed": 4, "throttled": 0})
+
+	def test_register_per_ip(self):
+		url = ONLINE_MARKET_URL + 'register/'
+		for i in range(2):
+			resp = self.client.post(url, {"username": f"new{i}"})
+			self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.client.post(url, {"username": "new2"})
+		self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertIn('Retry-After', resp)
+
+		other_client = APIClient(REMOTE_ADDR='10.0.0.2')
+		resp = other_client.post(url, {"username": "new3"})
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_forwarded_for_is_not_trusted(self):
+		url = ONLINE_MARKET_URL + 'login/'
+		for i in range(5):
+			resp = self.client.post(url, {"username": f"user{i}", "password": "wrong"}, HTTP_X_FORWARDED_FOR=f"10.1.0.{i}")
+			self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+		resp = self.client.post(url, {"username": "user5", "password": "wrong"}, HTTP_X_FORWARDED_FOR="10.1.0.5")
+		self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+	def test_cache_failure(self):
+		url = ONLINE_MARKET_URL + 'change-password/'
+		token = Token.objects.create(user=self.u)
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+		with mock.patch.object(cache, 'incr', side_effect=ConnectionError):
+			for _ in range(2):
+				resp = self.client.post(url, {"old_pass": "wrong"})
+				self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+			resp = self.client.post(url, {"old_pass": "wrong"})
+		self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertTrue(local_counters._caches)
+
+
+@override_settings(
+	PASSWORD_HASHERS=['user_auth.hashers.Argon2PasswordHasher'],
+	ARGON2_TIME_COST=1, ARGON2_MEMORY_COST=1024, ARGON2_PARALLELISM=1,
+)
+class HashingTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.client = APIClient()
+		self.u = User.objects.create(username="Mehrdad", email="mehrdad@mobin.com")
+
+	def test_outdated_hash_is_replaced(self):
+		with self.settings(ARGON2_TIME_COST=2):
+			User.objects.filter(pk=self.u.pk).update(password=make_password("Mehrdad1234"))
+
+		resp = self.client.post(ONLINE_MARKET_URL + 'login/', {"username": "Mehrdad", "password": "Mehrdad1234"})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+		self.u.refresh_from_db()
+		params = identify_hasher(self.u.password).params()
+		self.assertEqual((params.time_cost, params.memory_cost), (1, 1024))
+		self.assertTrue(self.u.check_password("Mehrdad1234"))
+
+		# Up to date hashes are left alone
+		encoded = self.u.password
+		resp = self.client.post(ONLINE_MARKET_URL + 'login/', {"username": "Mehrdad", "password": "Mehrdad1234"})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.u.refresh_from_db()
+		self.assertEqual(self.u.password, encoded)
+
+	def test_saturated_pool_sheds(self):
+		self.u.set_password("Mehrdad1234")
+		self.u.save()
+		pool = HashingPool(workers=1, queue=0, timeout=5)
+		started, release = threading.Event(), threading.Event()
+
+		def block():
+			started.set()
+			release.wait()
+
+		# The only worker is busy
+		busy = threading.Thread(target=pool.run, args=(block,))
+		busy.start()
+		started.wait()
+		try:
+			with mock.patch('user_auth.hashing.hashing_pool', pool):
+				resp = self.client.post(ONLINE_MARKET_URL + 'login/', {"username": "Mehrdad", "password": "Mehrdad1234"})
+		finally:
+			release.set()
+			busy.join()
+		self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+		self.assertIn('Retry-After', resp)
+		self.assertEqual(pool.stats()['shed'], 1)
+
+		with mock.patch('user_auth.hashing.hashing_pool', pool):
+			resp = self.client.post(ONLINE_MARKET_URL + 'login/', {"username": "Mehrdad", "password": "Mehrdad1234"})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+	query_budgets = {
+		'register': 6,
+		'login': 3,
+		'get_profile': 2,
+		'logout': 1,
+	}
+
+	def setUp(self):
+		cache.clear()
+		token_cache.local.clear()
+		self.client = APIClient()
+
+	def test_auth_budgets(self):
+		self.assertQueryBudget('register', self.client.post, ONLINE_MARKET_URL + 'register/', dict(
+			username="test1",
+			password1="Mobin12345",
+			password2="Mobin12345",
+			email="test1@mobin.com",
+			first_name="",
+			last_name="",
+			phone_number="",
+			profile_image=""
+		))
+
+		resp = self.assertQueryBudget(
+			'login', self.client.post, ONLINE_MARKET_URL + 'login/', {"username": "test1", "password": "Mobin12345"}
+		)
+
+		self.client.credentials(HTTP_AUTHORIZATION="Token " + resp.json()["token"])
+		self.assertQueryBudget('get_profile', self.client.get, ONLINE_MARKET_URL + 'get-profile/')
+		self.assertQueryBudget('logout', self.client.get, ONLINE_MARKET_URL + 'logout/')
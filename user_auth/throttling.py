@@ -0,0 +1,175 @@
+"""
+Brute-force throttling of the endpoints which hash passwords.
+
+A view names its `throttle_scope` and attempts are limited per client IP (``<scope>_ip``) and per username
+(``<scope>_user``) at the DEFAULT_THROTTLE_RATES of REST_FRAMEWORK. DRF checks throttles before the view runs,
+so a throttled attempt never reaches a password hasher and is answered 429 with a Retry-After header.
+
+The limit is a sliding window counter: the attempts of the current fixed window plus those of the previous
+one, weighted by how much of it the sliding window still covers. Counting is a cache ``add`` and ``incr``,
+which are atomic in redis, so concurrent attempts can not slip through between a read and a write. While the
+THROTTLE_CACHE_ALIAS cache fails the counters are kept in process memory.
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .cache import LocalLRUCache
+
+
+class ThrottleStats:
+    """
+    Allowed and throttled attempts per scope, counted in this process.
+    """
+
+    def __init__(self):
+        self._counts = dict()
+        self._lock = threading.Lock()
+
+    def count(self, scope, throttled):
+        with self._lock:
+            counts = self._counts.setdefault(scope, {'allowed': 0, 'throttled': 0})
+            counts['throttled' if throttled else 'allowed'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {scope: dict(counts) for scope, counts in self._counts.items()}
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+class LocalCounters:
+    """
+    Window counters in process memory, the fallback for the shared cache.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._caches = dict()
+        self._lock = threading.Lock()
+
+    def _cache(self, timeout):
+        # One LRU per window length, each entry expires with its window
+        with self._lock:
+            if timeout not in self._caches:
+                self._caches[timeout] = LocalLRUCache(self.maxsize, timeout)
+            return self._caches[timeout]
+
+    def incr(self, key, timeout):
+        cache = self._cache(timeout)
+        with self._lock:
+            value = cache.get(key, 0) + 1
+            cache.set(key, value)
+        return value
+
+    def get(self, key, timeout):
+        return self._cache(timeout).get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._caches.clear()
+
+
+throttle_stats = ThrottleStats()
+local_counters = LocalCounters()
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Limits the attempts of one client identity, `kind` names it in the scope.
+    Views without a `throttle_scope` are not throttled.
+    """
+
+    kind = None
+    prefix = 'throttle:'
+
+    def __init__(self):
+        # The rate depends on the view, it is resolved in allow_request like ScopedRateThrottle does
+        pass
+
+    @property
+    def THROTTLE_RATES(self):
+        return api_settings.DEFAULT_THROTTLE_RATES
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+    def get_identity(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        identity = self.get_identity(request) if scope else None
+        if identity is None:
+            return True
+
+        self.scope = f'{scope}_{self.kind}'
+        self.num_requests, self.duration = self.parse_rate(self.get_rate())
+        now = self.timer()
+        window = int(now // self.duration)
+        self.elapsed = now - window * self.duration
+
+        digest = hashlib.md5(identity.encode()).hexdigest()
+        key = f'{self.prefix}{self.scope}:{digest}:'
+        self.current, self.previous = self.count(key + str(window), key + str(window - 1))
+
+        # This attempt is already counted
+        allowed = self.previous * (1 - self.elapsed / self.duration) + self.current <= self.num_requests
+        throttle_stats.count(self.scope, not allowed)
+        return allowed
+
+    def count(self, current_key, previous_key):
+        """
+        Count an attempt in the current window, returns the counts of the current and the previous window.
+        """
+        # A key lives through its window and the next one, which still weighs it
+        timeout = 2 * self.duration
+        try:
+            self.cache.add(current_key, 0, timeout)
+            return self.cache.incr(current_key), self.cache.get(previous_key, 0)
+        except Exception:
+            # Any backend failure, throttling continues per process
+            return local_counters.incr(current_key, timeout), local_counters.get(previous_key, timeout)
+
+    def wait(self):
+        """
+        Seconds until the next attempt would be allowed.
+        """
+        if self.current < self.num_requests and self.previous:
+            # Wait for the previous window to weigh less
+            fraction = 1 - (self.num_requests - self.current - 1) / self.previous
+            return max(fraction * self.duration - self.elapsed, 1)
+
+        # The current window alone is full, wait into the next one
+        fraction = 1 - (self.num_requests - 1) / self.current
+        return self.duration - self.elapsed + max(fraction, 0) * self.duration
+
+
+class IPThrottle(SlidingWindowThrottle):
+    kind = 'ip'
+
+    def get_identity(self, request):
+        return self.get_ident(request)
+
+
+class UsernameThrottle(SlidingWindowThrottle):
+    """
+    Keyed by the submitted username, or the authenticated user's, case-insensitively.
+    """
+
+    kind = 'user'
+
+    def get_identity(self, request):
+        if request.user and request.user.is_authenticated:
+            return request.user.get_username().casefold()
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not isinstance(username, str) or not username.strip():
+            return None
+        return username.strip().casefold()
@@ -10,6 +10,9 @@ urlpatterns = [
     path('get-profile/', views.ProfileView.as_view(), name='api_get_profile'),
     path('set-profile/', views.ProfileView.as_view(), name='api_set_profile'),
     path('change-password/', views.ChangePasswordView.as_view(), name='api_change_password'),
+    path('token-cache/stats/', views.TokenCacheStatsView.as_view(), name='api_token_cache_stats'),
+    path('throttle/stats/', views.ThrottleStatsView.as_view(), name='api_throttle_stats'),
+    path('hashing/stats/', views.HashingStatsView.as_view(), name='api_hashing_stats'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
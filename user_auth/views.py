@@ -1,23 +1,29 @@
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from django.db import transaction
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
 
 from .serializers import (RegisterSerializer, LoginSerializer, ProfileSerializer, ChangePasswordSerializer)
 from .models import User, Token
+from .cache import token_cache
+from .hashing import hash_password, hashing_pool, verify_password
+from .throttling import IPThrottle, UsernameThrottle, throttle_stats
 
 
 class RegisterView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [IPThrottle, UsernameThrottle]
+    throttle_scope = 'register'
 
     def post(self, request):
         serializer = RegisterSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        account = serializer.save()
-        account.is_active = True
-        account.save()
-
-        token = Token.objects.create(user=account).key
+        # The password is hashed before the first query, the transaction only spans the two inserts
+        with transaction.atomic():
+            account = serializer.save()
+            # A new account has no older tokens for Token.issue to rotate
+            token = Token.objects.create(user=account).key
 
         data = dict()
         data["token"] = token
@@ -27,6 +33,8 @@ class RegisterView(APIView):
 
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [IPThrottle, UsernameThrottle]
+    throttle_scope = 'login'
 
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
@@ -39,11 +47,11 @@ class LoginView(APIView):
         except User.DoesNotExist:
             return Response({"message": "Incorrect Login credentials"}, status=status.HTTP_403_FORBIDDEN)
 
-        if not account.check_password(password):
+        if not verify_password(account, password):
             return Response({"message": "Incorrect Login credentials"}, status=status.HTTP_403_FORBIDDEN)
 
         if account.is_active:
-            token = Token.objects.create(user=account).key
+            token = Token.issue(account).key
 
             data = dict()
             data["token"] = token
@@ -57,7 +65,8 @@ class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        request.user.auth_tokens.get(key=request.auth.key).delete()
+        # Evicted from the token cache by the post_delete signal
+        request.auth.delete()
 
         return Response(status=status.HTTP_200_OK)
 
@@ -75,19 +84,21 @@ class ProfileView(generics.RetrieveUpdateAPIView):
 
 class ChangePasswordView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [IPThrottle, UsernameThrottle]
+    throttle_scope = 'change_password'
 
     def post(self, request):
         user = request.user
         serializer = ChangePasswordSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        if user.check_password(serializer.validated_data.get('old_pass')):
+        if verify_password(user, serializer.validated_data.get('old_pass')):
             Token.objects.filter(user=user).delete()
 
-            user.set_password(serializer.validated_data.get('new_pass'))
-            user.save()
+            user.password = hash_password(serializer.validated_data.get('new_pass'))
+            user.save(update_fields=['password'])
 
-            token = Token.objects.create(user=user).key
+            token = Token.issue(user).key
 
             data = dict()
             data["token"] = token
@@ -95,3 +106,24 @@ class ChangePasswordView(APIView):
             return Response(data, status=status.HTTP_200_OK)
         else:
             return Response({"message": "Your old password is incorrect"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class TokenCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(token_cache.stats(), status=status.HTTP_200_OK)
+
+
+class ThrottleStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(throttle_stats.stats(), status=status.HTTP_200_OK)
+
+
+class HashingStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(hashing_pool.stats(), status=status.HTTP_200_OK)